@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+
+import logging
+import argparse
+import sys
+import os
+import json
+import tempfile
+import shutil
+import time
+import timeit
+import platform
+from m2m.M2mClient import M2mClient
+from m2m.StubM2mServer import StubM2mServer
+from m2m.synthetic import build_synthetic_toc, build_synthetic_deployment_events
+from m2m.deployments import normalize_deployment_events, render_timestamps
+from m2m.BulkDownloader import BulkDownloader
+from m2m.M2mRequestScheduler import M2mRequestScheduler
+
+def main(args):
+    '''Time the M2mClient hot paths against a synthetic table of contents and
+    deployment events served by a local stub m2m server.  Latency, errors and rate
+    limiting may be added to the stub server to load test the client.  Results are
+    printed as valid JSON and may be compared to a previous run to catch
+    regressions.'''
+
+    # Set up the m2m package logger
+    log_level = getattr(logging, args.loglevel.upper())
+    log_format = '%(asctime)s:%(module)s:%(levelname)s:%(message)s [line %(lineno)d]'
+    m2m_logger = logging.getLogger('m2m')
+    m2m_logger.setLevel(log_level)
+    ch = logging.StreamHandler()
+    formatter = logging.Formatter(log_format)
+    ch.setFormatter(formatter)
+    m2m_logger.addHandler(ch)
+
+    # Set up the stream logger
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+    sh = logging.StreamHandler()
+    sh_formatter = logging.Formatter('%(module)s:%(levelname)s:%(message)s [line %(lineno)d]')
+    sh.setFormatter(sh_formatter)
+    logger.addHandler(sh)
+
+    config = {'num_subsites' : args.subsites,
+        'nodes_per_subsite' : args.nodes,
+        'instruments_per_node' : args.instruments,
+        'streams_per_instrument' : args.streams,
+        'parameters_per_stream' : args.parameters,
+        'deployments_per_instrument' : args.deployments,
+        'repeat' : args.repeat,
+        'seed' : args.seed,
+        'latency' : args.latency,
+        'jitter' : args.jitter,
+        'error_rate' : args.error_rate,
+        'rate_limit' : args.rate_limit}
+
+    toc = build_synthetic_toc(num_subsites=args.subsites,
+        nodes_per_subsite=args.nodes,
+        instruments_per_node=args.instruments,
+        streams_per_instrument=args.streams,
+        parameters_per_stream=args.parameters,
+        seed=args.seed)
+    events = build_synthetic_deployment_events(toc,
+        deployments_per_instrument=args.deployments,
+        seed=args.seed)
+    toc_json = json.dumps(toc)
+
+    logger.info('Synthetic table of contents: {:0.0f} instruments, {:0.0f} streams, {:0.0f} parameters, {:0.0f} deployment events'.format(len(toc['instruments']), len(toc['parameters_by_stream']), len(toc['parameter_definitions']), len(events)))
+
+    stub = StubM2mServer(toc=toc,
+        deployment_events=events,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        seed=args.seed)
+    with stub:
+        results = run_benchmarks(stub, toc_json, args.repeat, names=args.benchmarks)
+
+    report = {'created' : time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python' : platform.python_version(),
+        'platform' : platform.platform(),
+        'config' : config,
+        'stub_stats' : stub.stats(),
+        'results' : results}
+
+    report_json = json.dumps(report, indent=1, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fid:
+            fid.write('{:s}\n'.format(report_json))
+    else:
+        sys.stdout.write('{:s}\n'.format(report_json))
+
+    if args.compare:
+        try:
+            with open(args.compare) as fid:
+                baseline = json.load(fid)
+        except (IOError, OSError, ValueError) as e:
+            logger.error(e)
+            return 1
+
+        regressions = compare_results(baseline['results'], results, args.threshold)
+        for (name, baseline_time, new_time) in regressions:
+            logger.warning('{:s}: {:0.6f}s > {:0.6f}s per call ({:+0.1f}%)'.format(name, new_time, baseline_time, 100 * (new_time - baseline_time) / baseline_time))
+        if regressions:
+            return 1
+
+    return 0
+
+def run_benchmarks(stub, toc_json, repeat, names=None):
+    '''Time each benchmark repeat times and return a dictionary mapping the
+    benchmark name to its timing statistics.  The client under test fetches
+    deployment events and sends requests to the stub server.'''
+
+    results = {}
+
+    def add(name, func, num_calls):
+        if names and name not in names:
+            return
+        results[name] = time_calls(func, num_calls, repeat)
+
+    # Table of contents decoding and index building
+    add('toc_json_decode', lambda: json.loads(toc_json), 1)
+    toc_copies = [json.loads(toc_json) for r in range(repeat)]
+    add('build_toc', lambda: M2mClient(stub.base_url, toc=toc_copies.pop()), 1)
+
+    uframe = M2mClient(stub.base_url, toc=json.loads(toc_json))
+
+    instruments = uframe.instruments
+    sample = instruments[::max(1, len(instruments) // 50)]
+    subsites = uframe.subsites
+    nodes = sorted(set(['-'.join(i.split('-')[:2]) for i in sample]))
+    classes = sorted(set([i.split('-')[3][:5] for i in sample]))
+    streams = sorted(uframe.streams.keys())
+    stream_sample = streams[::max(1, len(streams) // 20)]
+    parameters = uframe.parameters[::max(1, len(uframe.parameters) // 20)]
+
+    # Instrument, stream and parameter searches
+    instrument_targets = subsites + nodes + classes + sample + ['NOMATCH']
+    add('search_instruments', lambda: [uframe.search_instruments(t) for t in instrument_targets], len(instrument_targets))
+    add('search_instruments_metadata', lambda: [uframe.search_instruments(t, metadata=True) for t in instrument_targets], len(instrument_targets))
+    add('search_instruments_batch', lambda: list(uframe.search_instruments_batch(instrument_targets)), len(instrument_targets))
+    
+    # Shared table of contents, attached to instead of decoded and indexed
+    (fd, shared_toc_file) = tempfile.mkstemp(prefix='m2m_toc_', suffix='.m2m')
+    os.close(fd)
+    uframe.publish_toc(shared_toc_file)
+    add('attach_shared_toc', lambda: M2mClient(stub.base_url, shared_toc=shared_toc_file), 1)
+    shared = M2mClient(stub.base_url, shared_toc=shared_toc_file)
+    os.remove(shared_toc_file)
+    add('search_instruments_shared', lambda: [shared.search_instruments(t) for t in instrument_targets], len(instrument_targets))
+    add('search_instruments_metadata_shared', lambda: [shared.search_instruments(t, metadata=True) for t in instrument_targets], len(instrument_targets))
+    add('search_parameters', lambda: [uframe.search_parameters(p) for p in parameters], len(parameters))
+    add('search_streams', lambda: [uframe.search_streams(s) for s in stream_sample], len(stream_sample))
+    add('search_subsites', lambda: [uframe.search_subsites(s[:4]) for s in subsites], len(subsites))
+    typos = [i[:8] + i[9:] for i in sample]
+    add('fuzzy_search', lambda: [uframe.fuzzy_search(t) for t in typos], len(typos))
+    add('find_instruments', lambda: [uframe.find_instruments(node=n, instrument_class=c) for n in nodes for c in classes], len(nodes) * len(classes))
+    add('stream_to_instrument', lambda: [uframe.stream_to_instrument(s) for s in stream_sample], len(stream_sample))
+    add('parameter_to_instruments', lambda: [uframe.parameter_to_instruments(p) for p in parameters], len(parameters))
+    dates = ['{:0.0f}-{:02.0f}-01T00:00:00.000Z'.format(y, m) for y in range(2014, 2018) for m in (1, 7)]
+    add('streams_active_at', lambda: [uframe.streams_active_at(d) for d in dates], len(dates))
+    add('instrument_to_streams', lambda: [uframe.instrument_to_streams(i) for i in sample], len(sample))
+    add('iter_instrument_streams', lambda: [list(uframe.iter_instrument_streams(i)) for i in sample], len(sample))
+    add('iter_instruments_paged', lambda: [list(uframe.iter_instruments(after=i, limit=100)) for i in sample], len(sample))
+
+    # Request url creation for every instrument in the system
+    add('build_instrument_m2m_queries', lambda: [uframe.build_instrument_m2m_queries(i) for i in instruments], len(instruments))
+    add('build_instrument_m2m_queries_structured', lambda: [uframe.build_instrument_m2m_queries(i, structured=True) for i in instruments], len(instruments))
+    add('build_parameter_m2m_queries', lambda: [uframe.build_parameter_m2m_queries(p) for p in parameters[:5]], len(parameters[:5]))
+    add('build_instrument_m2m_queries_window', lambda: [uframe.build_instrument_m2m_queries(i, begin_ts='2017-06-01T00:00:00.000Z') for i in instruments], len(instruments))
+    add('build_instrument_m2m_queries_subset', lambda: [uframe.build_instrument_m2m_queries(i, begin_ts='2014-01-01T00:00:00.000Z', end_ts='2014-02-01T00:00:00.000Z') for i in sample], len(sample))
+
+    # Url formatting alone, for every stream in the system: one str.format call
+    # per url compared to the precompiled request template
+    instrument_streams = []
+    for i in instruments:
+        for s in uframe.instrument_to_streams(i):
+            instrument_streams.append((i, s['method'], s['stream'], s['beginTime'], s['endTime']))
+    template = uframe.request_template()
+    add('url_str_format', lambda: [format_url(uframe.m2m_base_url, *s) for s in instrument_streams], len(instrument_streams))
+    add('url_template', lambda: [template.url(*s) for s in instrument_streams], len(instrument_streams))
+
+    # Requests sent to the stub server
+    add('query_instrument_deployments', lambda: [uframe.query_instrument_deployments(s) for s in subsites], len(subsites))
+    add('query_deployments_per_instrument', lambda: [uframe.query_instrument_deployments(i) for i in instruments], len(instruments))
+    add('query_deployments_batch', lambda: uframe.query_deployments_batch(instruments), len(instruments))
+    uframe.query_instrument_deployments('')
+    raw_events = list(uframe.selected_raw_deployment_events)
+    add('normalize_deployment_events', lambda: normalize_deployment_events(raw_events), 1)
+    add('normalize_deployment_events_filtered', lambda: normalize_deployment_events(raw_events, status='active', ref_des_search_string='CTD'), 1)
+    concise_events = normalize_deployment_events(raw_events)[1]
+    add('render_timestamps', lambda: render_timestamps(concise_events), 1)
+    urls = []
+    for i in sample:
+        urls = urls + uframe.build_instrument_m2m_queries(i)
+    add('send_m2m_request', lambda: [uframe.send_m2m_request(u) for u in urls], len(urls))
+    json_urls = uframe.build_instrument_m2m_queries(sample[0], application_type='json')
+    add('send_m2m_request_json', lambda: [uframe.send_m2m_request(u) for u in json_urls], len(json_urls))
+    add('stream_m2m_request', lambda: [list(uframe.stream_m2m_request(u)) for u in json_urls], len(json_urls))
+    add('stream_m2m_request_batches', lambda: [list(uframe.stream_m2m_request(u, batch_size=1000)) for u in json_urls], len(json_urls))
+
+    # Interactive deployment queries sent while a batch of requests is queued on
+    # the same client, as an interactive job and behind the batch
+    scheduler = M2mRequestScheduler(uframe, num_threads=4)
+    def interactive_under_load(priority):
+        for u in urls:
+            scheduler.send_m2m_request(u)
+        return [scheduler.submit(uframe.query_instrument_deployments, (s,), priority=priority).result() for s in subsites]
+    add('scheduled_interactive_query', lambda: interactive_under_load('interactive'), len(subsites))
+    add('scheduled_bulk_query', lambda: interactive_under_load('bulk'), len(subsites))
+    scheduler.close(cancel=True)
+
+    # Asynchronous request output files, streamed to a new directory each time
+    file_urls = ['{:s}/async_results/stub/benchmark{:0.0f}/benchmark{:0.0f}.nc'.format(stub.base_url, i, i) for i in range(8)]
+    download_dirs = []
+    def bulk_download():
+        download_dirs.append(tempfile.mkdtemp(prefix='m2m_download_'))
+        return list(BulkDownloader(download_dirs[-1]).download(file_urls))
+    add('bulk_download', bulk_download, len(file_urls))
+    for download_dir in download_dirs:
+        shutil.rmtree(download_dir)
+
+    return results
+
+def format_url(m2m_base_url, ref_des, method, stream, begin_dt, end_dt, application_type='netcdf', limit=-1, exec_dpa=True, provenance=True, selogging=False, user='_nouser'):
+    '''Format a request url with a single str.format call, as done before request
+    templates were used, for comparison with M2mRequestTemplate.url'''
+
+    r_tokens = ref_des.split('-')
+
+    return '{:s}/12576/sensor/inv/{:s}/{:s}/{:s}-{:s}/{:s}/{:s}?beginDT={:s}&endDT={:s}&format=application/{:s}&limit={:d}&execDPA={:s}&include_provenance={:s}&selogging={:s}&user={:s}'.format(
+        m2m_base_url,
+        r_tokens[0],
+        r_tokens[1],
+        r_tokens[2],
+        r_tokens[3],
+        method,
+        stream,
+        begin_dt,
+        end_dt,
+        application_type,
+        limit,
+        str(exec_dpa).lower(),
+        str(provenance).lower(),
+        str(selogging).lower(),
+        user)
+
+def time_calls(func, num_calls, repeat):
+    '''Call func repeat times and return the timing statistics, in seconds, where
+    each call of func makes num_calls calls of the code being timed'''
+
+    times = []
+    for r in range(repeat):
+        t0 = timeit.default_timer()
+        func()
+        times.append(timeit.default_timer() - t0)
+
+    times.sort()
+
+    return {'repeat' : repeat,
+        'num_calls' : num_calls,
+        'min' : times[0],
+        'median' : times[len(times) // 2],
+        'mean' : sum(times) / len(times),
+        'max' : times[-1],
+        'per_call' : times[0] / max(1, num_calls)}
+
+def compare_results(baseline, results, threshold):
+    '''Return the list of (name, baseline_per_call, per_call) tuples for every
+    benchmark that is more than threshold (fraction) slower than the baseline'''
+
+    regressions = []
+    for name in sorted(results.keys()):
+        if name not in baseline or not baseline[name]['per_call']:
+            continue
+
+        if results[name]['per_call'] > baseline[name]['per_call'] * (1 + threshold):
+            regressions.append((name, baseline[name]['per_call'], results[name]['per_call']))
+
+    return regressions
+
+if __name__ == '__main__':
+
+    arg_parser = argparse.ArgumentParser(description=main.__doc__)
+    arg_parser.add_argument('benchmarks',
+        nargs='*',
+        help='Names of the benchmarks to run.  All benchmarks are run if none are specified')
+    arg_parser.add_argument('--subsites',
+        type=int,
+        default=20,
+        help='Number of subsites in the synthetic table of contents <Default:20>')
+    arg_parser.add_argument('--nodes',
+        type=int,
+        default=4,
+        help='Number of nodes on each subsite <Default:4>')
+    arg_parser.add_argument('--instruments',
+        type=int,
+        default=6,
+        help='Number of instruments on each node <Default:6>')
+    arg_parser.add_argument('--streams',
+        type=int,
+        default=3,
+        help='Number of stream and delivery method combinations produced by each instrument <Default:3>')
+    arg_parser.add_argument('--parameters',
+        type=int,
+        default=25,
+        help='Number of parameters in each stream <Default:25>')
+    arg_parser.add_argument('--deployments',
+        type=int,
+        default=3,
+        help='Number of deployment events for each instrument <Default:3>')
+    arg_parser.add_argument('--latency',
+        type=float,
+        default=0,
+        help='Seconds added to every stub server response <Default:0>')
+    arg_parser.add_argument('--jitter',
+        type=float,
+        default=0,
+        help='Maximum random number of seconds added to --latency <Default:0>')
+    arg_parser.add_argument('--error_rate',
+        type=float,
+        default=0,
+        help='Fraction of stub server requests answered with an HTTP 500 error <Default:0>')
+    arg_parser.add_argument('--rate_limit',
+        type=float,
+        help='Maximum number of stub server requests per second')
+    arg_parser.add_argument('-r', '--repeat',
+        type=int,
+        default=5,
+        help='Number of times each benchmark is run <Default:5>')
+    arg_parser.add_argument('--seed',
+        type=int,
+        default=0,
+        help='Random number generator seed for the synthetic data <Default:0>')
+    arg_parser.add_argument('-o', '--output',
+        help='Write the results to this JSON file instead of STDOUT')
+    arg_parser.add_argument('--compare',
+        help='JSON results file from a previous run.  Exits with status 1 if any benchmark is slower than the previous run by more than --threshold')
+    arg_parser.add_argument('--threshold',
+        type=float,
+        default=0.2,
+        help='Fractional slowdown, relative to --compare results, reported as a regression <Default:0.2>')
+    arg_parser.add_argument('--loglevel',
+        help='Verbosity level of the m2m package',
+        choices=['debug', 'info', 'warning', 'error', 'critical'],
+        default='error')
+
+    parsed_args = arg_parser.parse_args()
+
+    sys.exit(main(parsed_args))
@@ -4,8 +4,23 @@ import logging
 import argparse
 import os
 import sys
-import json
 from m2m.M2mClient import M2mClient
+from m2m.M2mDaemonClient import M2mDaemonClient
+from m2m.M2mProfiler import add_profile_arguments, profile_main, phase
+from m2m.IncrementalRequestPlanner import IncrementalRequestPlanner
+from m2m.batch import read_batch_queries
+from m2m.M2mRequest import write_requests
+from m2m.M2mShardPool import M2mShardPool
+from m2m.tocfile import load_toc
+from m2m.SharedToc import is_shared_toc
+
+# Options that may be specified for each reference designator in a --batch file
+_batch_options = ('stream',
+    'telemetry',
+    'start_date',
+    'end_date',
+    'time_delta_type',
+    'time_delta_value')
 
 def main(args):
     '''Return the list of request urls that conform to the UFrame API for the 
@@ -14,10 +29,10 @@ def main(args):
         time-coverage.  The urls are printed to STDOUT.
     '''
     
-    # Set up the m2m.M2mClient logger
+    # Set up the m2m package logger
     log_level = getattr(logging, args.loglevel.upper())
     log_format = '%(asctime)s:%(module)s:%(levelname)s:%(message)s [line %(lineno)d]'
-    m2m_logger = logging.getLogger('m2m.M2mClient')
+    m2m_logger = logging.getLogger('m2m')
     m2m_logger.setLevel(log_level)
     ch = logging.StreamHandler()
     formatter = logging.Formatter(log_format)
@@ -32,70 +47,181 @@ def main(args):
     sh.setFormatter(sh_formatter)
     logger.addHandler(sh)
     
-    base_url = args.base_url
-    if not base_url:
-        base_url = os.getenv('UFRAME_BASE_URL')
+    daemon_url = args.daemon or os.getenv('M2M_DAEMON_URL')
+    if daemon_url:
+        # Use the table of contents already loaded by the resident m2m_daemon.py service
+        uframe = M2mDaemonClient(daemon_url, timeout=args.timeout)
+        if not uframe.status():
+            logger.error('No M2mDaemon found at {:s}'.format(daemon_url))
+            return 1
+    else:
+        base_url = args.base_url
+        if not base_url:
+            base_url = os.getenv('UFRAME_BASE_URL')
         
-    if not base_url:
-        logger.error('No UFrame instance specified')
-        return 1
+        if not base_url:
+            logger.error('No UFrame instance specified')
+            return 1
          
-    # Create the M2mClient instance
-    toc = None
-    if args.tocfile:
-        if not os.path.isfile(args.tocfile):
-            logger.error('Invalid TOC json file ({:s})'.format(args.tocfile))
+        # Create the M2mClient instance
+        toc = None
+        shared_toc = None
+        if args.tocfile:
+            if not os.path.isfile(args.tocfile):
+                logger.error('Invalid TOC json file ({:s})'.format(args.tocfile))
+                return 1
+            try:
+                if is_shared_toc(args.tocfile):
+                    shared_toc = args.tocfile
+                else:
+                    with phase('json_decode'):
+                        toc = load_toc(args.tocfile)
+            except (IOError, OSError, ValueError) as e:
+                logger.error(e)
+                return 1
+            
+        uframe = M2mClient(base_url, timeout=args.timeout, toc=toc, shared_toc=shared_toc)
+        if shared_toc and not uframe.shared_toc:
             return 1
+    
+    planner = None
+    if args.watermarks:
+        planner = IncrementalRequestPlanner(uframe, args.watermarks)
+        
+    if args.batch:
+        # Resolve every query in the batch file against the same client
         try:
-            with open(args.tocfile) as fid:
-                toc = json.load(fid)
-        except (OSError, ValueError) as e:
+            queries = list(read_batch_queries(args.batch, valid_options=_batch_options))
+        except (IOError, OSError) as e:
             logger.error(e)
             return 1
+        results = zip([q[1] for q in queries], uframe.search_instruments_batch([q[0] for q in queries]))
+    elif args.parameter:
+        # Request each stream containing the parameters from every instrument
+        # producing it, optionally restricted to the reference designator
+        streams = []
+        for parameter in args.parameter:
+            parameter_streams = uframe.parameter_to_streams(parameter)
+            if not parameter_streams:
+                logger.warning('No streams found for parameter: {:s}'.format(parameter))
+            streams = streams + [s for s in parameter_streams if s not in streams]
+        results = []
+        for stream in streams:
+            instruments = uframe.stream_to_instrument(stream, exact=True)
+            if args.reference_designator:
+                instruments = [i for i in instruments if i.find(args.reference_designator) >= 0]
+            if instruments:
+                results.append(({'stream' : stream}, (args.reference_designator or '', instruments)))
+        if not results:
+            results = [({}, (args.reference_designator or '', []))]
+    elif args.reference_designator:
+        results = [({}, (args.reference_designator, uframe.search_instruments(args.reference_designator)))]
+    else:
+        results = [({}, ('', uframe.instruments))]
+        
+    # Split system-wide runs across worker processes, one subsite at a time
+    pool = None
+    if args.processes > 1:
+        if daemon_url:
+            logger.warning('Ignoring --processes: requests are built by the daemon')
+        else:
+            # Workers attach to the shared table of contents, which is published
+            # to a temporary file if not specified
+            pool = M2mShardPool(uframe, processes=args.processes, toc_file=shared_toc, watermark_file=args.watermarks)
             
-    uframe = M2mClient(base_url, timeout=args.timeout, toc=toc)
+    structured = args.request_format != 'url'
     
-    if (args.reference_designator):
-        instruments = uframe.search_instruments(args.reference_designator)
-    else:
-        instruments = uframe.instruments
+    # Write a single CSV header for all requests
+    header = True
+    
+    for (options, (ref_des, instruments)) in results:
         
-    if not instruments:
-        sys.stderr.write('No instruments found for reference designator: {:s}\n'.format(args.reference_designator))
-        sys.stderr.flush()
-
-    urls = []
-    for instrument in instruments:
-        request_urls = uframe.build_instrument_m2m_queries(instrument,
-            stream=args.stream,
-            telemetry=args.telemetry,
-            time_delta_type=args.time_delta_type,
-            time_delta_value=args.time_delta_value,
-            begin_ts=args.start_date,
-            end_ts=args.end_date,
-            time_check=args.time_check,
-            exec_dpa=args.no_dpa,
-            application_type=args.format,
-            provenance=args.no_provenance,
-            limit=args.limit,
-            annotations=args.no_annotations,
-            user=args.user,
-            email=args.email)
-#            selogging=args.selogging)
-           
-        if request_urls:
-            urls = urls + request_urls
-
-    for url in urls:
-        sys.stdout.write('{:s}\n'.format(url))
+        if not instruments:
+            sys.stderr.write('No instruments found for reference designator: {:s}\n'.format(ref_des))
+            sys.stderr.flush()
+            continue
+            
+        # Options specified on the batch file line override the command line
+        query_args = vars(args).copy()
+        query_args.update(options)
+        if query_args['time_delta_value'] is not None:
+            try:
+                query_args['time_delta_value'] = int(query_args['time_delta_value'])
+            except ValueError:
+                logger.error('{:s}: Invalid time_delta_value ({:s})'.format(ref_des, query_args['time_delta_value']))
+                continue
+            
+        if pool:
+            # Shards are returned in subsite order
+            shards = pool.build_instrument_m2m_queries(instruments,
+                planned=planner is not None,
+                structured=structured,
+                **build_kwargs(query_args, planner=planner))
+            batches = (requests for (subsite, requests) in shards)
+        else:
+            batches = (build_urls(uframe, instrument, query_args, planner=planner, structured=structured) for instrument in instruments)
+            
+        for requests in batches:
+            if args.request_format == 'url':
+                for url in requests:
+                    sys.stdout.write('{:s}\n'.format(url))
+            else:
+                if write_requests(requests, sys.stdout, file_format=args.request_format, header=header):
+                    header = False
+            sys.stdout.flush()
+        
+    if pool:
+        pool.close()
         
     return 0
     
+def build_urls(uframe, instrument, query_args, planner=None, structured=False):
+    '''Return the list of request urls, or M2mRequest instances if structured is
+    True, for the instrument using the command line arguments contained in the
+    query_args dictionary'''
+    
+    if planner:
+        # Only request the data produced since the last successful request
+        return planner.plan(instrument, structured=structured, **build_kwargs(query_args, planner=planner))
+            
+    return uframe.build_instrument_m2m_queries(instrument, structured=structured, **build_kwargs(query_args))
+    
+def build_kwargs(query_args, planner=None):
+    '''Return the keyword arguments for M2mClient.build_instrument_m2m_queries, or
+    IncrementalRequestPlanner.plan if a planner is used, from the command line
+    arguments contained in the query_args dictionary'''
+    
+    kwargs = {'stream' : query_args['stream'],
+        'telemetry' : query_args['telemetry'],
+        'exec_dpa' : query_args['no_dpa'],
+        'application_type' : query_args['format'],
+        'provenance' : query_args['no_provenance'],
+        'limit' : query_args['limit'],
+        'annotations' : query_args['no_annotations'],
+        'user' : query_args['user'],
+        'email' : query_args['email']}
+#        'selogging' : query_args['selogging']}
+        
+    if not planner:
+        kwargs['time_delta_type'] = query_args['time_delta_type']
+        kwargs['time_delta_value'] = query_args['time_delta_value']
+        kwargs['begin_ts'] = query_args['start_date']
+        kwargs['end_ts'] = query_args['end_date']
+        kwargs['time_check'] = query_args['time_check']
+        
+    return kwargs
+    
 if __name__ == '__main__':
 
     arg_parser = argparse.ArgumentParser(description=main.__doc__)
     arg_parser.add_argument('reference_designator',
+        nargs='?',
         help='Partial or fully-qualified reference designator identifying one or more instruments')
+    arg_parser.add_argument('--batch',
+        help='File containing one partial or fully-qualified reference designator per line, or - to read STDIN.  Each reference designator may be followed by name=value options overriding the stream, telemetry, start_date, end_date, time_delta_type and time_delta_value arguments.  All lines are resolved using the same table of contents')
+    arg_parser.add_argument('--parameter',
+        action='append',
+        help='Build urls for every instrument stream containing this parameter (particle_key), restricted to the instruments matching reference_designator, if specified.  May be specified more than once')
     arg_parser.add_argument('--stream',
         help='Restricts urls to the specified stream name, if it is produced by the instrument')
     arg_parser.add_argument('--telemetry',
@@ -126,6 +252,10 @@ if __name__ == '__main__':
         dest='format',
         default='netcdf',
         help='Specify the download format (<Default:netcdf> or json)')
+    arg_parser.add_argument('--request_format',
+        choices=['url', 'jsonl', 'csv'],
+        default='url',
+        help='Write the requests as urls (<Default:url>), one JSON object per line (jsonl) or CSV rows.  All formats are read by submit_m2m_requests.py')
     arg_parser.add_argument('--no_annotations',
         action='store_false',
         default=False,
@@ -150,11 +280,22 @@ if __name__ == '__main__':
         dest='email',
         type=str,
         help='Add an email address for emailing UFrame responses to the request once sent')
+    arg_parser.add_argument('--watermarks',
+        help='JSON file containing the last endDT successfully requested for each instrument stream.  If specified, urls only request the data produced since the last successful request.  Watermarks are updated by submit_m2m_requests.py')
+    arg_parser.add_argument('--tocfile',
+        help='JSON file, optionally gzip, bz2 or zstd compressed, or shared table of contents file written by fetch_toc.py --shared, containing a full copy of the UI table of contents.  If specified, this file is used instead of fetching it from the system (MUCH faster!)')
+    arg_parser.add_argument('--daemon',
+        help='Url of a running m2m_daemon.py service to answer the query instead of loading the table of contents.  Value is taken from the M2M_DAEMON_URL environment variable, if set')
+    arg_parser.add_argument('-p', '--processes',
+        type=int,
+        default=1,
+        help='Number of worker processes.  Instruments are split by subsite and the urls are printed in the same order for any number of processes <Default:1>')
     arg_parser.add_argument('--loglevel',
         help='Verbosity level',
         choices=['debug', 'info', 'warning', 'error', 'critical'],
         default='info')
+    add_profile_arguments(arg_parser)
 
     parsed_args = arg_parser.parse_args()
 
-    sys.exit(main(parsed_args))
+    sys.exit(profile_main(main, parsed_args))
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+import logging
+import argparse
+import os
+import sys
+import json
+from m2m.BulkDownloader import BulkDownloader, DOWNLOAD_EXTENSIONS
+from m2m.M2mMetrics import exporter_for_file
+from m2m.M2mProfiler import add_profile_arguments, profile_main
+
+def main(args):
+    '''Download the NetCDF, JSON and CSV files produced by the asynchronous requests
+    sent with submit_m2m_requests.py.  Lines are read from the specified files or
+    STDIN and may be submit_m2m_requests.py responses, whose output directories
+    are listed for files, output directory urls or file urls.  Files are streamed
+    to disk, several at a time, and recorded in a manifest once their size and
+    checksum are verified, so that an interrupted run resumes where it stopped.
+    The result of each download is printed to STDOUT as a line of valid JSON.'''
+
+    # Set up the m2m package logger
+    log_level = getattr(logging, args.loglevel.upper())
+    log_format = '%(asctime)s:%(module)s:%(levelname)s:%(message)s [line %(lineno)d]'
+    m2m_logger = logging.getLogger('m2m')
+    m2m_logger.setLevel(log_level)
+    ch = logging.StreamHandler()
+    formatter = logging.Formatter(log_format)
+    ch.setFormatter(formatter)
+    m2m_logger.addHandler(ch)
+
+    # Set up the stream logger
+    logger = logging.getLogger(__name__)
+    logger.setLevel(log_level)
+    sh = logging.StreamHandler()
+    sh_formatter = logging.Formatter('%(module)s:%(levelname)s:%(message)s [line %(lineno)d]')
+    sh.setFormatter(sh_formatter)
+    logger.addHandler(sh)
+
+    extensions = DOWNLOAD_EXTENSIONS
+    if args.extensions:
+        extensions = tuple([e if e.startswith('.') else '.{:s}'.format(e) for e in args.extensions])
+
+    try:
+        downloader = BulkDownloader(args.output_dir,
+            num_threads=args.num_threads,
+            chunk_size=args.chunk_size,
+            timeout=args.timeout,
+            manifest_file=args.manifest,
+            checksum=args.checksum,
+            num_retries=args.retries,
+            api_username=args.api_username,
+            api_token=args.api_token)
+    except ValueError as e:
+        logger.error(e)
+        return 1
+
+    if args.metrics:
+        downloader.metrics.add_exporter(exporter_for_file(args.metrics))
+
+    status = 0
+    url_files = args.url_files or ['-']
+    for url_file in url_files:
+        if url_file == '-':
+            fid = sys.stdin
+        else:
+            try:
+                fid = open(url_file)
+            except (IOError, OSError) as e:
+                logger.error(e)
+                status = 1
+                continue
+
+        urls = iter_file_urls(fid, downloader, extensions, logger)
+        for result in downloader.download(urls, verify=args.verify):
+
+            if not result['status']:
+                status = 1
+
+            sys.stdout.write('{:s}\n'.format(json.dumps(result)))
+            sys.stdout.flush()
+
+        if fid is not sys.stdin:
+            fid.close()
+
+    downloader.metrics.export()
+
+    return status
+
+def iter_file_urls(fid, downloader, extensions, logger):
+    '''Generator yielding the url of each file to download from the lines of fid.
+    Output directories are listed with BulkDownloader.list_files.'''
+
+    for line in fid:
+
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith('{'):
+            # submit_m2m_requests.py response
+            try:
+                response = json.loads(line)
+            except ValueError as e:
+                logger.error('Invalid response: {:s}'.format(str(e)))
+                continue
+            if not response.get('status') or not isinstance(response.get('response'), dict):
+                logger.warning('Skipping failed request: {:s}'.format(response.get('requestUrl') or line))
+                continue
+            output = response['response']
+            directories = [u for u in output.get('allURLs', []) if u.find('/async_results/') >= 0]
+            if not directories and output.get('outputURL'):
+                directories = [output['outputURL']]
+        elif os.path.splitext(line)[1].lower() in extensions:
+            yield line
+            continue
+        else:
+            directories = [line]
+
+        for directory in directories:
+            files = downloader.list_files(directory, extensions=extensions)
+            if not files:
+                logger.warning('No files found, the request may not be complete: {:s}'.format(directory))
+                continue
+            for url in files:
+                yield url
+
+if __name__ == '__main__':
+
+    arg_parser = argparse.ArgumentParser(description=main.__doc__)
+    arg_parser.add_argument('url_files',
+        nargs='*',
+        help='Files containing submit_m2m_requests.py responses or urls.  Lines are read from STDIN if no files or - is specified')
+    arg_parser.add_argument('-o', '--output_dir',
+        default='.',
+        help='Directory to write the files to.  Each file is written to the subdirectory named after its request output directory <Default:.>')
+    arg_parser.add_argument('-n', '--num_threads',
+        type=int,
+        default=4,
+        help='Maximum number of concurrent downloads <Default:4>')
+    arg_parser.add_argument('--chunk_size',
+        type=int,
+        default=1048576,
+        help='Number of bytes read and written at a time <Default:1048576>')
+    arg_parser.add_argument('--manifest',
+        help='JSON file recording the completed downloads.  Files recorded in the manifest are not downloaded again <Default:OUTPUT_DIR/manifest.json>')
+    arg_parser.add_argument('--checksum',
+        choices=['md5', 'sha1', 'sha256'],
+        default='md5',
+        help='Checksum algorithm recorded in the manifest <Default:md5>')
+    arg_parser.add_argument('--verify',
+        action='store_true',
+        help='Checksum the files recorded in the manifest and download them again if they do not match')
+    arg_parser.add_argument('-r', '--retries',
+        type=int,
+        default=2,
+        help='Number of times an interrupted download is resumed <Default:2>')
+    arg_parser.add_argument('-e', '--extension',
+        dest='extensions',
+        action='append',
+        help='File extension to download from the output directories.  May be specified more than once <Default:.nc, .json and .csv>')
+    arg_parser.add_argument('--metrics',
+        help='Write download timing metrics to this file.  Files ending in .prom are written in the Prometheus text format, all others as JSON')
+    arg_parser.add_argument('--api_username',
+        default=os.getenv('UFRAME_API_USERNAME'),
+        help='API user name associated with the registered user\'s profile.  Value is taken from the UFRAME_API_USERNAME environment variable, if set')
+    arg_parser.add_argument('--api_token',
+        default=os.getenv('UFRAME_API_TOKEN'),
+        help='API token associated with the registered user\'s profile.  Value is taken from the UFRAME_API_TOKEN environment variable, if set')
+    arg_parser.add_argument('-t', '--timeout',
+        type=int,
+        default=120,
+        help='Specify the timeout, in seconds <Default:120>')
+    arg_parser.add_argument('--loglevel',
+        help='Verbosity level',
+        choices=['debug', 'info', 'warning', 'error', 'critical'],
+        default='info')
+    add_profile_arguments(arg_parser)
+
+    parsed_args = arg_parser.parse_args()
+
+    sys.exit(profile_main(main, parsed_args))
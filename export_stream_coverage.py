@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+import logging
+import os
+import sys
+import argparse
+from m2m.M2mClient import M2mClient
+from m2m.M2mDaemonClient import M2mDaemonClient
+from m2m.M2mProfiler import add_profile_arguments, profile_main, phase
+from m2m.coverage import build_coverage_matrix, write_coverage_csv, write_coverage_parquet
+from m2m.tocfile import load_toc
+
+def main(args):
+    '''Export the stream coverage matrix: one row for each deployment overlapping
+    each instrument stream, with the stream time coverage, deployment times and
+    the overlap.  The table of contents is joined with the deployment events in a
+    single pass, using one deployment query per subsite.  The matrix is written as
+    CSV to STDOUT or to the output file, or as Parquet if the output file ends in
+    .parquet (requires pyarrow).'''
+
+    # Set up the m2m package logger
+    log_level = getattr(logging, args.loglevel.upper())
+    log_format = '%(asctime)s:%(module)s:%(levelname)s:%(message)s [line %(lineno)d]'
+    m2m_logger = logging.getLogger('m2m')
+    m2m_logger.setLevel(log_level)
+    ch = logging.StreamHandler()
+    formatter = logging.Formatter(log_format)
+    ch.setFormatter(formatter)
+    m2m_logger.addHandler(ch)
+
+    # Set up the stream logger
+    logger = logging.getLogger(__name__)
+    logger.setLevel(log_level)
+    sh = logging.StreamHandler()
+    sh_formatter = logging.Formatter('%(module)s:%(levelname)s:%(message)s [line %(lineno)d]')
+    sh.setFormatter(sh_formatter)
+    logger.addHandler(sh)
+
+    parquet = args.output and args.output.endswith('.parquet')
+    if parquet:
+        try:
+            import pyarrow
+        except ImportError:
+            logger.error('pyarrow is required to write Parquet files')
+            return 1
+
+    daemon_url = args.daemon or os.getenv('M2M_DAEMON_URL')
+    if daemon_url:
+        # Use the table of contents already loaded by the resident m2m_daemon.py service
+        uframe = M2mDaemonClient(daemon_url, timeout=args.timeout)
+        if not uframe.status():
+            logger.error('No M2mDaemon found at {:s}'.format(daemon_url))
+            return 1
+    else:
+        base_url = args.base_url
+        if not base_url:
+            base_url = os.getenv('UFRAME_BASE_URL')
+
+        if not base_url:
+            logger.error('No UFrame instance specified')
+            return 1
+
+        # Create the M2mClient instance
+        toc = None
+        if args.tocfile:
+            if not os.path.isfile(args.tocfile):
+                logger.error('Invalid TOC json file ({:s})'.format(args.tocfile))
+                return 1
+            try:
+                with phase('json_decode'):
+                    toc = load_toc(args.tocfile)
+            except (IOError, OSError, ValueError) as e:
+                logger.error(e)
+                return 1
+
+        uframe = M2mClient(base_url, timeout=args.timeout, toc=toc)
+
+    columns = build_coverage_matrix(uframe, ref_des=args.reference_designator, deployments=not args.no_deployments)
+
+    if parquet:
+        with phase('output'):
+            num_rows = write_coverage_parquet(columns, args.output)
+    elif args.output:
+        try:
+            with open(args.output, 'w') as fid, phase('output'):
+                num_rows = write_coverage_csv(columns, fid)
+        except (IOError, OSError) as e:
+            logger.error(e)
+            return 1
+    else:
+        num_rows = write_coverage_csv(columns, sys.stdout)
+
+    logger.debug('{:0.0f} coverage rows written'.format(num_rows))
+
+    return 0
+
+if __name__ == '__main__':
+
+    arg_parser = argparse.ArgumentParser(description=main.__doc__)
+    arg_parser.add_argument('reference_designator',
+        nargs='?',
+        help='Partial or fully-qualified reference designator identifying one or more instruments.  All instruments are exported if not specified')
+    arg_parser.add_argument('-o', '--output',
+        help='Write the matrix to this file instead of STDOUT.  Files ending in .parquet are written as Parquet, all others as CSV')
+    arg_parser.add_argument('--no_deployments',
+        action='store_true',
+        help='Export the stream time coverage only, without fetching the deployment events')
+    arg_parser.add_argument('-b', '--baseurl',
+        dest='base_url',
+        help='UFrame instance URL. Must begin with \'http://\'.  Default is taken from the UFRAME_BASE_URL environment variable, provided it is set.  If not set, the URL must be specified using this option')
+    arg_parser.add_argument('-t', '--timeout',
+        type=int,
+        default=120,
+        help='Request timeout, in seconds <Default=120>.')
+    arg_parser.add_argument('--daemon',
+        help='Url of a running m2m_daemon.py service to answer the query instead of loading the table of contents.  Value is taken from the M2M_DAEMON_URL environment variable, if set')
+    arg_parser.add_argument('-l', '--loglevel',
+        help='Verbosity level',
+        choices=['debug', 'info', 'warning', 'error', 'critical'],
+        default='info')
+    arg_parser.add_argument('--tocfile',
+        help='JSON file, optionally gzip, bz2 or zstd compressed, containing a full copy of the UI table of contents.  If specified, this file is used instead of fetching it from the system (MUCH faster!)')
+    add_profile_arguments(arg_parser)
+
+    parsed_args = arg_parser.parse_args()
+
+    sys.exit(profile_main(main, parsed_args))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+import logging
+import argparse
+import os
+import sys
+from m2m.M2mClient import M2mClient
+from m2m.M2mProfiler import add_profile_arguments, profile_main, phase
+from m2m.tocfile import COMPRESSIONS, load_toc
+
+def main(args):
+    '''Fetch the UI table of contents from the UFrame instance and write it to the
+    output file, for use with the --tocfile option of the other scripts.  The
+    file is compressed as specified or as given by the output file extension
+    (.gz, .bz2 or .zst).  With --shared, the table of contents and its indexes
+    are written as a shared table of contents file instead, which processes on
+    the same host attach to without building their own copy.  An existing table
+    of contents file may be converted to another format with --tocfile.'''
+
+    # Set up the m2m package logger
+    log_level = getattr(logging, args.loglevel.upper())
+    log_format = '%(asctime)s:%(module)s:%(levelname)s:%(message)s [line %(lineno)d]'
+    m2m_logger = logging.getLogger('m2m')
+    m2m_logger.setLevel(log_level)
+    ch = logging.StreamHandler()
+    formatter = logging.Formatter(log_format)
+    ch.setFormatter(formatter)
+    m2m_logger.addHandler(ch)
+
+    # Set up the stream logger
+    logger = logging.getLogger(__name__)
+    logger.setLevel(log_level)
+    sh = logging.StreamHandler()
+    sh_formatter = logging.Formatter('%(module)s:%(levelname)s:%(message)s [line %(lineno)d]')
+    sh.setFormatter(sh_formatter)
+    logger.addHandler(sh)
+
+    base_url = args.base_url
+    if not base_url:
+        base_url = os.getenv('UFRAME_BASE_URL')
+
+    if not base_url:
+        logger.error('No UFrame instance specified')
+        return 1
+
+    toc = None
+    if args.tocfile:
+        if not os.path.isfile(args.tocfile):
+            logger.error('Invalid TOC json file ({:s})'.format(args.tocfile))
+            return 1
+        try:
+            with phase('json_decode'):
+                toc = load_toc(args.tocfile)
+        except (IOError, OSError, ValueError) as e:
+            logger.error(e)
+            return 1
+
+    uframe = M2mClient(base_url, timeout=args.timeout, toc=toc)
+    if not uframe.toc:
+        logger.error('No table of contents found')
+        return 1
+
+    if args.shared:
+        with phase('output'):
+            if not uframe.publish_toc(args.output):
+                return 1
+        compression = 'shared'
+    else:
+        with phase('output'):
+            compression = uframe.save_toc(args.output, compression=args.compression)
+        if not compression:
+            return 1
+
+    logger.info('Table of contents written to {:s} ({:s}, {:0.0f} bytes)'.format(args.output, compression, os.path.getsize(args.output)))
+
+    return 0
+
+if __name__ == '__main__':
+
+    arg_parser = argparse.ArgumentParser(description=main.__doc__)
+    arg_parser.add_argument('output',
+        help='File to write the table of contents to')
+    arg_parser.add_argument('-c', '--compression',
+        choices=COMPRESSIONS,
+        help='Compression format.  Default is taken from the output file extension: .gz (gzip), .bz2 (bz2), .zst (zstd, requires zstandard) or none for any other extension')
+    arg_parser.add_argument('--shared',
+        action='store_true',
+        help='Write a shared table of contents file, memory-mapped by the processes using it, for use with build_instrument_requests.py --tocfile.  --compression is ignored')
+    arg_parser.add_argument('-b', '--baseurl',
+        dest='base_url',
+        help='UFrame instance URL. Must begin with \'http://\'.  Default is taken from the UFRAME_BASE_URL environment variable, provided it is set.  If not set, the URL must be specified using this option')
+    arg_parser.add_argument('-t', '--timeout',
+        type=int,
+        default=120,
+        help='Request timeout, in seconds <Default=120>.')
+    arg_parser.add_argument('-l', '--loglevel',
+        help='Verbosity level',
+        choices=['debug', 'info', 'warning', 'error', 'critical'],
+        default='info')
+    arg_parser.add_argument('--tocfile',
+        help='JSON file, optionally gzip, bz2 or zstd compressed, containing a full copy of the UI table of contents to write instead of fetching it from the system')
+    add_profile_arguments(arg_parser)
+
+    parsed_args = arg_parser.parse_args()
+
+    sys.exit(profile_main(main, parsed_args))
@@ -0,0 +1,457 @@
+import logging
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from multiprocessing.pool import ThreadPool
+from m2m.M2mMetrics import M2mMetrics, endpoint_label
+
+try:
+    from urlparse import urlsplit, urljoin
+except ImportError:
+    from urllib.parse import urlsplit, urljoin
+
+HTTP_STATUS_OK = 200
+HTTP_STATUS_PARTIAL_CONTENT = 206
+HTTP_STATUS_RANGE_NOT_SATISFIABLE = 416
+
+# Data product file types listed in asynchronous request output directories
+DOWNLOAD_EXTENSIONS = ('.nc',
+    '.json',
+    '.csv')
+
+# Links in html directory listings
+_HREF_REGEX = re.compile(r'href=["\']([^"\'?#]+)["\']', re.IGNORECASE)
+
+# Metrics endpoint label of the files not in asynchronous request output
+# directories, i.e.: THREDDS fileServer urls
+FILES_ENDPOINT = 'files/*'
+
+# Total size from the Content-Range header of a partial response
+_CONTENT_RANGE_REGEX = re.compile(r'bytes (\d+)-\d+/(\d+|\*)')
+
+# Total size from the Content-Range header of a range not satisfiable response
+_UNSATISFIED_RANGE_REGEX = re.compile(r'bytes \*/(\d+)')
+
+class BulkDownloader(object):
+    '''Downloads the data product files (NetCDF, JSON or CSV) produced by
+    asynchronous m2m requests.  Files are downloaded by num_threads threads over
+    pooled connections and each response body is streamed to disk in chunk_size
+    blocks, so that memory use does not depend on the file size.
+
+    Each file is written to a .part file, which is renamed once its size and
+    checksum are verified.  Interrupted downloads resume from the end of the .part
+    file with a Range request, or restart if the server ignores the range.  A
+    .part file the server reports as already complete is verified and renamed.
+    Completed files are recorded, with their size and checksum, in a JSON
+    manifest, so that restarted runs skip them.
+
+    Parameters:
+        output_dir: directory the files are written to (Default is the current
+            directory).  Each file is written to the subdirectory named after the
+            request output directory in its url.
+        num_threads: maximum number of concurrent downloads (Default is 4)
+        chunk_size: number of bytes read and written at a time (Default is 1 MB)
+        timeout: request timeout, in seconds (Default is 120)
+        manifest_file: JSON file recording the completed downloads (Default is
+            manifest.json in output_dir)
+        checksum: hashlib algorithm used to checksum the files (Default is md5)
+        num_retries: number of times a failed download is resumed, waiting one
+            more second before each attempt (Default is 2)
+        api_username: API user name associated with the registered user's profile
+        api_token: API token associated with the registered user's profile
+    '''
+
+    def __init__(self, output_dir='.', num_threads=4, chunk_size=1048576, timeout=120, manifest_file=None, checksum='md5', num_retries=2, api_username=None, api_token=None):
+
+        self._output_dir = output_dir
+        self._num_threads = max(1, num_threads)
+        self._chunk_size = chunk_size
+        self._timeout = timeout
+        self._manifest_file = manifest_file or os.path.join(output_dir, 'manifest.json')
+        self._checksum = checksum
+        self._num_retries = num_retries
+
+        self._logger = logging.getLogger(__name__)
+
+        # Raises ValueError for unsupported algorithms
+        hashlib.new(self._checksum)
+
+        self._metrics = M2mMetrics()
+
+        # Pooled HTTP connections, one per download thread.  Files are requested
+        # without content encoding so that Range offsets are file offsets.
+        self._session = requests.Session()
+        self._session.verify = False
+        adapter = HTTPAdapter(pool_connections=self._num_threads, pool_maxsize=self._num_threads)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._session.headers['Accept-Encoding'] = 'identity'
+        if api_username and api_token:
+            self._session.auth = (api_username, api_token)
+
+        # Completed downloads, keyed by url
+        self._manifest = {}
+        self._lock = threading.Lock()
+
+        if os.path.isfile(self._manifest_file):
+            self.load_manifest()
+
+    @property
+    def output_dir(self):
+        return self._output_dir
+
+    @property
+    def manifest_file(self):
+        return self._manifest_file
+
+    @property
+    def manifest(self):
+        return self._manifest
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    def load_manifest(self):
+        '''Load the completed downloads from the manifest file'''
+
+        try:
+            with open(self._manifest_file) as fid:
+                self._manifest = json.load(fid)
+        except (IOError, OSError, ValueError) as e:
+            self._logger.error('{:s}: {:s}'.format(self._manifest_file, str(e)))
+            return
+
+        return self._manifest
+
+    def save_manifest(self):
+        '''Write the completed downloads to the manifest file.  The file is replaced
+        atomically so an interrupted run never leaves a truncated manifest.'''
+
+        tmp_file = '{:s}.tmp'.format(self._manifest_file)
+        try:
+            with self._lock:
+                with open(tmp_file, 'w') as fid:
+                    json.dump(self._manifest, fid, indent=1, sort_keys=True)
+                os.rename(tmp_file, self._manifest_file)
+        except (IOError, OSError) as e:
+            self._logger.error('{:s}: {:s}'.format(self._manifest_file, str(e)))
+            return False
+
+        return True
+
+    def destination(self, url):
+        '''Return the path the file at url is written to: the file name in the
+        subdirectory of output_dir named after its parent directory in the url'''
+
+        tokens = [t for t in urlsplit(url).path.split('/') if t and t not in ('.', '..')]
+
+        return os.path.join(self._output_dir, *tokens[-2:])
+
+    def list_files(self, directory_url, extensions=DOWNLOAD_EXTENSIONS):
+        '''Return the sorted list of urls of the files with the extensions linked
+        from the html listing of the asynchronous request output directory
+        directory_url, or None if the listing cannot be fetched.'''
+
+        directory_url = '{:s}/'.format(directory_url.rstrip('/'))
+
+        try:
+            r = self._session.get(directory_url, timeout=self._timeout)
+        except requests.exceptions.RequestException as e:
+            self._logger.error('{:s}: {:s}'.format(directory_url, str(e)))
+            return
+
+        if r.status_code != HTTP_STATUS_OK:
+            self._logger.warning('{:s}: HTTP {:0.0f}'.format(directory_url, r.status_code))
+            return
+
+        urls = set()
+        for href in _HREF_REGEX.findall(r.text):
+            url = urljoin(directory_url, href)
+            # Skip links outside of the directory, i.e.: the parent directory
+            if not url.startswith(directory_url):
+                continue
+            if os.path.splitext(url)[1].lower() in extensions:
+                urls.add(url)
+
+        return sorted(urls)
+
+    def download(self, urls, checksums=None, verify=False):
+        '''Generator yielding the result of downloading each of the urls, in order,
+        as returned by download_file.  Up to num_threads files are downloaded at a
+        time.
+
+        Parameters:
+            urls: iterable of file urls
+            checksums: dictionary mapping urls to their expected checksum, as a
+                hexadecimal digest
+            verify: checksum the files already recorded in the manifest and
+                download them again if they do not match
+        '''
+
+        checksums = checksums or {}
+
+        pool = ThreadPool(self._num_threads)
+        try:
+            for result in pool.imap(lambda url: self.download_file(url, checksum=checksums.get(url), verify=verify), urls):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+
+    def download_file(self, url, checksum=None, verify=False):
+        '''Download the file at url, resuming a previously interrupted download, and
+        return a dictionary describing the result:
+
+            url: file url
+            path: destination file
+            status: True if the file was downloaded and verified or was already
+                complete
+            status_code: HTTP status code of the last response
+            skipped: True if the file was already complete
+            resumed: True if the download continued a partial file
+            bytes: number of bytes received
+            size: file size
+            checksum: file checksum
+            message: reason the download failed
+
+        Parameters:
+            url: file url
+            checksum: expected checksum, as a hexadecimal digest
+            verify: checksum the file, if already recorded in the manifest, and
+                download it again if it does not match
+        '''
+
+        path = self.destination(url)
+        result = {'url' : url,
+            'path' : path,
+            'status' : False,
+            'status_code' : None,
+            'skipped' : False,
+            'resumed' : False,
+            'bytes' : 0,
+            'size' : None,
+            'checksum' : None,
+            'message' : None}
+
+        if self._is_complete(url, path, checksum, verify):
+            record = self._manifest[url]
+            result.update({'status' : True,
+                'skipped' : True,
+                'size' : record['size'],
+                'checksum' : record['checksum']})
+            return result
+
+        try:
+            _makedirs(os.path.dirname(path))
+        except OSError as e:
+            result['message'] = str(e)
+            self._logger.error('{:s}: {:s}'.format(path, str(e)))
+            return result
+
+        (port, end_point) = _request_label(url)
+        start_time = time.time()
+        for attempt in range(self._num_retries + 1):
+            if attempt:
+                self._logger.info('Resuming download ({:0.0f}/{:0.0f}): {:s}'.format(attempt, self._num_retries, url))
+                self._metrics.observe_retry(port, end_point)
+                time.sleep(attempt)
+            request_time = time.time()
+            num_bytes = result['bytes']
+            retry = self._fetch(url, path, checksum, result)
+            self._metrics.observe_request(port, end_point, result['status_code'], request_time, time.time() - request_time, result['bytes'] - num_bytes)
+            if result['status'] or not retry:
+                break
+
+        self._metrics.observe_operation('download', start_time, time.time() - start_time)
+
+        if not result['status']:
+            self._logger.error('{:s}: {:s}'.format(url, result['message']))
+            return result
+
+        with self._lock:
+            self._manifest[url] = {'path' : path,
+                'size' : result['size'],
+                'checksum' : result['checksum'],
+                'algorithm' : self._checksum,
+                'completed' : time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+        self.save_manifest()
+
+        return result
+
+    def _is_complete(self, url, path, checksum, verify):
+        '''Return True if url is recorded in the manifest and path still matches the
+        recorded size and checksum'''
+
+        with self._lock:
+            record = self._manifest.get(url)
+
+        if not record or record.get('path') != path or not os.path.isfile(path):
+            return False
+
+        if os.path.getsize(path) != record['size']:
+            return False
+
+        if checksum and checksum.lower() != record['checksum']:
+            return False
+
+        if verify and record.get('algorithm', self._checksum) == self._checksum:
+            return self._checksum_file(path).hexdigest() == record['checksum']
+
+        return True
+
+    def _fetch(self, url, path, checksum, result):
+        '''Send one request for the file at url, appending the response body to the
+        .part file, and update result.  Returns True if the download failed and
+        may be resumed.'''
+
+        part_file = '{:s}.part'.format(path)
+
+        offset = 0
+        if os.path.isfile(part_file):
+            offset = os.path.getsize(part_file)
+
+        headers = {}
+        if offset:
+            headers['Range'] = 'bytes={:0.0f}-'.format(offset)
+
+        try:
+            r = self._session.get(url, headers=headers, stream=True, timeout=self._timeout)
+        except requests.exceptions.RequestException as e:
+            result['message'] = str(e)
+            return True
+
+        try:
+            result['status_code'] = r.status_code
+
+            if r.status_code == HTTP_STATUS_RANGE_NOT_SATISFIABLE:
+                match = _UNSATISFIED_RANGE_REGEX.match(r.headers.get('Content-Range', ''))
+                if offset and match and int(match.group(1)) == offset:
+                    # The partial file was complete: the download was interrupted
+                    # before it was renamed
+                    return self._finish(path, part_file, self._checksum_file(part_file), offset, checksum, result)
+                # The partial file is not a prefix of the current file
+                os.remove(part_file)
+                result['message'] = 'Partial file does not match: HTTP {:0.0f}'.format(r.status_code)
+                return True
+
+            total = None
+            if r.status_code == HTTP_STATUS_PARTIAL_CONTENT:
+                match = _CONTENT_RANGE_REGEX.match(r.headers.get('Content-Range', ''))
+                if not match or int(match.group(1)) != offset:
+                    os.remove(part_file)
+                    result['message'] = 'Invalid Content-Range: {:s}'.format(r.headers.get('Content-Range', ''))
+                    return True
+                if match.group(2) != '*':
+                    total = int(match.group(2))
+                result['resumed'] = True
+            elif r.status_code == HTTP_STATUS_OK:
+                # The server ignored the range: start over
+                offset = 0
+                if 'Content-Length' in r.headers:
+                    total = int(r.headers['Content-Length'])
+            else:
+                result['message'] = 'HTTP {:0.0f}'.format(r.status_code)
+                return r.status_code >= 500 or r.status_code == 429
+
+            if offset:
+                digest = self._checksum_file(part_file)
+                mode = 'ab'
+            else:
+                digest = hashlib.new(self._checksum)
+                mode = 'wb'
+
+            with open(part_file, mode) as fid:
+                for chunk in r.iter_content(chunk_size=self._chunk_size):
+                    if not chunk:
+                        continue
+                    fid.write(chunk)
+                    digest.update(chunk)
+                    result['bytes'] += len(chunk)
+
+        except (requests.exceptions.RequestException, IOError, OSError) as e:
+            # Keep the partial file to resume from
+            result['message'] = str(e)
+            return True
+        finally:
+            r.close()
+
+        return self._finish(path, part_file, digest, total, checksum, result)
+
+    def _finish(self, path, part_file, digest, total, checksum, result):
+        '''Verify the size and checksum of the downloaded part_file, rename it to path
+        and update result.  Returns True if the download failed and may be
+        resumed.'''
+
+        size = os.path.getsize(part_file)
+        if total is not None and size != total:
+            if size > total:
+                os.remove(part_file)
+            result['message'] = 'Size mismatch: {:0.0f} bytes received, {:0.0f} expected'.format(size, total)
+            return True
+
+        hexdigest = digest.hexdigest()
+        if checksum and checksum.lower() != hexdigest:
+            os.remove(part_file)
+            result['message'] = 'Checksum mismatch: {:s} != {:s}'.format(hexdigest, checksum.lower())
+            return True
+
+        if os.path.isfile(path):
+            os.remove(path)
+        os.rename(part_file, path)
+
+        result.update({'status' : True,
+            'size' : size,
+            'checksum' : hexdigest,
+            'message' : None})
+
+        return False
+
+    def _checksum_file(self, path):
+        '''Return the hashlib object updated with the contents of path'''
+
+        digest = hashlib.new(self._checksum)
+        with open(path, 'rb') as fid:
+            while True:
+                chunk = fid.read(self._chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+
+        return digest
+
+    def __repr__(self):
+        return '<BulkDownloader(output_dir={:s}, num_threads={:0.0f})>'.format(self._output_dir, self._num_threads)
+
+def _request_label(url):
+    '''Return the (port, end_point) metrics labels of the file url.  Files outside
+    of asynchronous request output directories are all labelled FILES_ENDPOINT,
+    so that each file does not create its own series.'''
+
+    parts = urlsplit(url)
+    port = parts.port
+    if port is None:
+        port = 443 if parts.scheme == 'https' else 80
+
+    end_point = endpoint_label(parts.path)
+    if end_point != 'async_results/*':
+        end_point = FILES_ENDPOINT
+
+    return port, end_point
+
+def _makedirs(path):
+    '''Create the directory path, if it does not exist, from any thread'''
+
+    if not path or os.path.isdir(path):
+        return
+
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
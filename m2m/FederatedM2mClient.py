@@ -0,0 +1,283 @@
+import logging
+import threading
+import functools
+import time
+from multiprocessing.pool import ThreadPool
+from m2m.M2mClient import M2mClient
+from m2m.M2mRequest import M2mRequest
+
+# Request routing policies
+ROUTING_POLICIES = ('latency',
+    'queue')
+
+# Weight of the newest request duration in the latency moving average
+_LATENCY_ALPHA = 0.3
+
+class FederatedM2mClient(object):
+    '''Client for several UFrame instances, i.e.: production and staging mirrors.
+    Each instance is queried through its own M2mClient, with its own table of
+    contents and connection pool.
+
+    Searches and deployment queries are sent to all instances concurrently and the
+    results are merged, in instance order, with each result tagged with the
+    source it came from.  Data requests are sent to a single instance, chosen by
+    the routing policy:
+
+        latency: the instance with the lowest expected wait, its average request
+            duration times the number of requests in flight plus one.
+            Instances that have not answered a request yet are tried first.
+        queue: the instance with the fewest requests in flight
+
+    Each instance handles several calls at a time: M2mClient methods return the
+    results of their own call, but the properties describing its last request
+    hold those of whichever call finished last.
+
+    Parameters:
+        clients: list of M2mClient instances
+        sources: names used to tag the results of each client.  Defaults to the
+            client base urls.
+        routing: request routing policy, 'latency' (default) or 'queue'
+        num_threads: number of threads used to send concurrent queries and
+            requests.  Defaults to the larger of 4 and the number of clients.
+    '''
+
+    def __init__(self, clients, sources=None, routing='latency', num_threads=None):
+
+        if routing not in ROUTING_POLICIES:
+            raise ValueError('Invalid routing policy: {:s}'.format(routing))
+
+        sources = sources or [c.base_url for c in clients]
+        if len(sources) != len(clients):
+            raise ValueError('One source name is required for each client')
+
+        self._clients = list(clients)
+        self._sources = list(sources)
+        self._routing = routing
+        self._num_threads = num_threads or max(4, len(self._clients))
+
+        self._logger = logging.getLogger(__name__)
+
+        self._pool = None
+        self._lock = threading.Lock()
+        self._latency = [None for c in self._clients]
+        self._in_flight = [0 for c in self._clients]
+
+    @classmethod
+    def from_base_urls(cls, base_urls, timeout=120, api_username=None, api_token=None, routing='latency'):
+        '''Create a FederatedM2mClient for the list of UFrame base urls, fetching the
+        table of contents of each instance concurrently'''
+
+        def create(base_url):
+            return M2mClient(base_url, timeout=timeout, api_username=api_username, api_token=api_token)
+
+        pool = ThreadPool(len(base_urls))
+        try:
+            clients = pool.map(create, base_urls)
+        finally:
+            pool.close()
+            pool.join()
+
+        return cls(clients, routing=routing)
+
+    @property
+    def clients(self):
+        return self._clients
+
+    @property
+    def sources(self):
+        return self._sources
+
+    @property
+    def routing(self):
+        return self._routing
+
+    @property
+    def instruments(self):
+        '''Sorted reference designators available from any instance'''
+
+        instruments = set()
+        for client in self._clients:
+            instruments.update(client.instruments)
+
+        return sorted(instruments)
+
+    @property
+    def subsites(self):
+        '''Sorted subsites available from any instance'''
+
+        subsites = set()
+        for client in self._clients:
+            subsites.update(client.subsites)
+
+        return sorted(subsites)
+
+    def status(self):
+        '''Return the list of dictionaries containing the source, average request
+        latency and number of requests in flight for each instance'''
+
+        with self._lock:
+            return [{'source' : source,
+                'latency' : self._latency[i],
+                'in_flight' : self._in_flight[i]} for (i, source) in enumerate(self._sources)]
+
+    def search_instruments(self, target_string, metadata=False):
+        return self._merge(self._fan_out('search_instruments', target_string, metadata=metadata), 'reference_designator')
+
+    def search_parameters(self, target_string, metadata=False):
+        return self._merge(self._fan_out('search_parameters', target_string, metadata=metadata), 'parameter')
+
+    def search_streams(self, target_stream, metadata=False):
+        return self._merge(self._fan_out('search_streams', target_stream, metadata=metadata), 'stream')
+
+    def search_subsites(self, target_subsite):
+        return self._merge(self._fan_out('search_subsites', target_subsite), 'subsite')
+
+    def stream_to_instrument(self, target_stream):
+        return self._merge(self._fan_out('stream_to_instrument', target_stream), 'reference_designator')
+
+    def instrument_to_streams(self, reference_designator):
+        return self._merge(self._fan_out('instrument_to_streams', reference_designator), 'stream')
+
+    def query_instrument_deployments(self, ref_des, ref_des_search_string=None, status=None, raw=False):
+        '''Return the deployment events for the partial or fully-qualified reference
+        designator from all instances.  Arguments are the same as
+        M2mClient.query_instrument_deployments'''
+
+        return self._merge(self._fan_out('query_instrument_deployments',
+            ref_des,
+            ref_des_search_string=ref_des_search_string,
+            status=status,
+            raw=raw), 'event')
+
+    def send_m2m_request(self, url):
+        '''Send the request url or M2mRequest to the instance chosen by the routing
+        policy and return the M2mClient.send_m2m_request response, tagged with the
+        source.  Stream request urls are sent to the chosen instance regardless of
+        the base url they were created for.  Other urls are sent to the instance
+        they were created for.'''
+
+        request = url
+        i = None
+        if not isinstance(url, M2mRequest):
+            request = M2mRequest.from_url(url)
+            if not request:
+                # Not a stream request: send it to the instance in the url
+                request = url.strip()
+                for (j, client) in enumerate(self._clients):
+                    if request.startswith(client.m2m_base_url):
+                        i = j
+                        break
+                if i is None:
+                    self._logger.warning('No instance found for url: {:s}'.format(request))
+                    return
+                with self._lock:
+                    self._in_flight[i] += 1
+
+        if i is None:
+            i = self._route()
+
+        try:
+            start_time = time.time()
+            response = self._clients[i].send_m2m_request(request)
+            duration = time.time() - start_time
+        finally:
+            with self._lock:
+                self._in_flight[i] -= 1
+
+        if not response:
+            return
+
+        # Only requests that reached the instance update its latency
+        if response['status_code'] is not None:
+            with self._lock:
+                if self._latency[i] is None:
+                    self._latency[i] = duration
+                else:
+                    self._latency[i] = _LATENCY_ALPHA * duration + (1 - _LATENCY_ALPHA) * self._latency[i]
+
+        response = dict(response)
+        response['source'] = self._sources[i]
+
+        return response
+
+    def send_m2m_requests(self, urls):
+        '''Generator yielding a (url, response) tuple for each request url or
+        M2mRequest.  Requests are sent concurrently and the responses are yielded
+        in request order.'''
+
+        urls = list(urls)
+
+        for (url, response) in zip(urls, self._get_pool().imap(self.send_m2m_request, urls)):
+            yield url, response
+
+    def close(self):
+        '''Stop the threads used to send concurrent queries and requests'''
+
+        if self._pool:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _route(self):
+        '''Return the index of the instance the next request is sent to and count
+        the request as in flight'''
+
+        with self._lock:
+            if self._routing == 'latency':
+                # Untried instances first, then by expected wait
+                keys = [(self._latency[i] is not None, (self._latency[i] or 0) * (self._in_flight[i] + 1), self._in_flight[i], i) for i in range(len(self._clients))]
+            else:
+                keys = [(self._in_flight[i], self._latency[i] or 0, i) for i in range(len(self._clients))]
+            i = min(keys)[-1]
+            self._in_flight[i] += 1
+
+        return i
+
+    def _fan_out(self, name, *args, **kwargs):
+        '''Call the M2mClient method name on every instance concurrently and return
+        the list of (source, result) tuples in instance order'''
+
+        call = functools.partial(self._call, name, args, kwargs)
+
+        return list(zip(self._sources, self._get_pool().map(call, range(len(self._clients)))))
+
+    def _call(self, name, args, kwargs, i):
+
+        try:
+            return getattr(self._clients[i], name)(*args, **kwargs)
+        except Exception as e:
+            # A failing instance must not break the results from the others
+            self._logger.exception('{:s}: {:s}'.format(self._sources[i], str(e)))
+
+    def _merge(self, results, key):
+        '''Merge the (source, result) tuples into a single list.  Dictionaries are
+        copied and tagged with the source, all other values are returned as
+        {'source' : source, key : value}'''
+
+        merged = []
+        for (source, result) in results:
+            for item in result or []:
+                if isinstance(item, dict):
+                    item = item.copy()
+                    item['source'] = source
+                else:
+                    item = {'source' : source, key : item}
+                merged.append(item)
+
+        return merged
+
+    def _get_pool(self):
+
+        if not self._pool:
+            self._pool = ThreadPool(self._num_threads)
+
+        return self._pool
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return '<FederatedM2mClient(sources={:s}, routing={:s})>'.format(', '.join(self._sources), self._routing)
@@ -0,0 +1,243 @@
+import logging
+import json
+import os
+from dateutil import parser
+from m2m.M2mRequest import M2mRequest
+
+try:
+    from urlparse import urlsplit, parse_qs
+except ImportError:
+    from urllib.parse import urlsplit, parse_qs
+
+class IncrementalRequestPlanner(object):
+    '''Class for planning data requests that only cover the time since the last
+    successful request.  A watermark, the last endDT requested successfully, is
+    kept for each reference designator, delivery method and stream.  Requests
+    begin at the watermark and end at the stream endTime.
+
+    Parameters:
+        client: M2mClient instance used to build and send the requests
+        watermark_file: JSON file used to store the watermarks between runs
+    '''
+
+    def __init__(self, client, watermark_file=None):
+
+        self._client = client
+        self._watermark_file = watermark_file
+        self._watermarks = {}
+
+        self._logger = logging.getLogger(__name__)
+
+        if self._watermark_file and os.path.isfile(self._watermark_file):
+            self.load()
+
+    @property
+    def client(self):
+        return self._client
+
+    @property
+    def watermark_file(self):
+        return self._watermark_file
+
+    @property
+    def watermarks(self):
+        return self._watermarks
+
+    def load(self, watermark_file=None):
+        '''Load the watermarks from the JSON watermark_file.  Defaults to the file
+        specified when the instance was created'''
+
+        watermark_file = watermark_file or self._watermark_file
+        if not watermark_file:
+            self._logger.warning('No watermark file specified')
+            return
+
+        try:
+            with open(watermark_file) as fid:
+                self._watermarks = json.load(fid)
+        except (IOError, OSError, ValueError) as e:
+            self._logger.error('{:s}: {:s}'.format(watermark_file, str(e)))
+            return
+
+        return self._watermarks
+
+    def save(self, watermark_file=None):
+        '''Write the watermarks to the JSON watermark_file.  Defaults to the file
+        specified when the instance was created.  The file is replaced atomically
+        so an interrupted run never leaves a truncated watermark file.'''
+
+        watermark_file = watermark_file or self._watermark_file
+        if not watermark_file:
+            self._logger.warning('No watermark file specified')
+            return False
+
+        tmp_file = '{:s}.tmp'.format(watermark_file)
+        try:
+            with open(tmp_file, 'w') as fid:
+                json.dump(self._watermarks, fid, indent=1, sort_keys=True)
+            os.rename(tmp_file, watermark_file)
+        except (IOError, OSError) as e:
+            self._logger.error('{:s}: {:s}'.format(watermark_file, str(e)))
+            return False
+
+        return True
+
+    def get_watermark(self, ref_des, method, stream):
+        '''Return the last endDT successfully requested for the fully-qualified
+        reference designator, delivery method and stream or None if no request
+        has been recorded'''
+
+        return self._watermarks.get(_watermark_key(ref_des, method, stream))
+
+    def set_watermark(self, ref_des, method, stream, end_ts):
+        '''Set the watermark for the fully-qualified reference designator, delivery
+        method and stream to end_ts.  Watermarks only move forward; an end_ts
+        earlier than the current watermark is ignored.  Returns True if the
+        watermark was updated'''
+
+        try:
+            end_dt = parser.parse(end_ts)
+        except ValueError as e:
+            self._logger.error('Invalid watermark: {:s} ({:s})'.format(end_ts, str(e)))
+            return False
+
+        key = _watermark_key(ref_des, method, stream)
+        watermark = self._watermarks.get(key)
+        if watermark and parser.parse(watermark) >= end_dt:
+            return False
+
+        self._watermarks[key] = end_ts
+
+        return True
+
+    def plan(self, ref_des, stream=None, telemetry=None, **kwargs):
+        '''Return the list of request urls that cover the gap from the watermark
+        to the current stream endTime for all streams produced by the partial or
+        fully-qualified reference designator.  Streams with no watermark are
+        requested over their entire time coverage.  Streams whose watermark is at
+        or past the stream endTime are skipped.
+
+        Parameters:
+            ref_des: partial or fully-qualified reference designator
+            stream: restricts urls to the specified stream name
+            telemetry: restricts urls to the specified telemetry type
+
+        Additional keyword arguments (exec_dpa, application_type, provenance,
+        limit, annotations, user, email, selogging) are passed to
+        M2mClient.build_instrument_m2m_queries.  Time subsetting arguments are
+        ignored as the request times are taken from the watermarks.'''
+
+        for k in ('time_delta_type', 'time_delta_value', 'begin_ts', 'end_ts', 'time_check'):
+            if kwargs.pop(k, None):
+                self._logger.warning('Ignoring {:s}: request times are set by the watermarks'.format(k))
+
+        urls = []
+
+        for instrument in self._client.search_instruments(ref_des):
+            for instrument_stream in self._client.instrument_to_streams(instrument):
+
+                if stream and instrument_stream['stream'] != stream:
+                    continue
+
+                if telemetry and instrument_stream['method'].find(telemetry) == -1:
+                    continue
+
+                watermark = self.get_watermark(instrument,
+                    instrument_stream['method'],
+                    instrument_stream['stream'])
+
+                if watermark:
+                    try:
+                        if parser.parse(watermark) >= parser.parse(instrument_stream['endTime']):
+                            self._logger.debug('{:s}-{:s}-{:s}: No new data since {:s}'.format(instrument, instrument_stream['method'], instrument_stream['stream'], watermark))
+                            continue
+                    except ValueError:
+                        self._logger.warning('{:s}-{:s}: Invalid endTime ({:s})'.format(instrument, instrument_stream['stream'], instrument_stream['endTime']))
+                        continue
+
+                stream_urls = self._client.build_instrument_m2m_queries(instrument,
+                    stream=instrument_stream['stream'],
+                    method=instrument_stream['method'],
+                    begin_ts=watermark,
+                    time_check=True,
+                    **kwargs)
+
+                if stream_urls:
+                    urls = urls + stream_urls
+
+        return urls
+
+    def record_request(self, url):
+        '''Advance the watermark of the stream requested by url, a request url or
+        M2mRequest, to the request endDT.  Returns True if the watermark was
+        updated'''
+
+        if isinstance(url, M2mRequest):
+            return self.set_watermark(url.reference_designator,
+                url.method,
+                url.stream,
+                url.end_dt)
+
+        request = parse_request_url(url)
+        if not request:
+            self._logger.warning('Not a stream request url: {:s}'.format(url))
+            return False
+
+        return self.set_watermark(request['reference_designator'],
+            request['method'],
+            request['stream'],
+            request['endDT'])
+
+    def submit(self, urls, save=True):
+        '''Send each request url or M2mRequest and advance the watermark of every
+        successfully submitted request.  The watermarks are written to the
+        watermark file after all requests have been sent if save is True.  Returns the list of
+        M2mClient.send_m2m_request responses.'''
+
+        responses = []
+
+        for url in urls:
+            response = self._client.send_m2m_request(url)
+            if not response:
+                continue
+
+            responses.append(response)
+
+            if response['status']:
+                self.record_request(url)
+
+        if save and self._watermark_file:
+            self.save()
+
+        return responses
+
+    def __repr__(self):
+        return '<IncrementalRequestPlanner(watermarks={:0.0f})>'.format(len(self._watermarks))
+
+def parse_request_url(url):
+    '''Parse a stream request url, as created by M2mClient.build_instrument_m2m_queries,
+    into a dictionary containing the reference_designator, method, stream, beginDT
+    and endDT.  Returns None if the url is not a stream request url.'''
+
+    tokens = urlsplit(url.strip())
+
+    path = tokens.path.split('/12576/sensor/inv/')
+    if len(path) != 2:
+        return
+
+    path_tokens = path[1].strip('/').split('/')
+    if len(path_tokens) != 5:
+        return
+
+    query = parse_qs(tokens.query)
+    if 'endDT' not in query:
+        return
+
+    return {'reference_designator' : '-'.join(path_tokens[:3]),
+        'method' : path_tokens[3],
+        'stream' : path_tokens[4],
+        'beginDT' : query.get('beginDT', [None])[0],
+        'endDT' : query['endDT'][0]}
+
+def _watermark_key(ref_des, method, stream):
+    return '{:s}/{:s}/{:s}'.format(ref_des, method, stream)
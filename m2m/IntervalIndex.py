@@ -0,0 +1,97 @@
+import bisect
+
+class IntervalIndex(object):
+    '''Centered interval tree over closed (begin, end, value) intervals.  Returns
+    the values of all intervals overlapping a time window, or containing a single
+    time, in O(log n + k) time for k matching intervals.
+
+    Parameters:
+        intervals: iterable of (begin, end, value) tuples, where begin <= end
+    '''
+
+    def __init__(self, intervals):
+
+        intervals = [i for i in intervals if i[0] <= i[1]]
+        self._size = len(intervals)
+        self._root = _build_node(intervals)
+
+    @property
+    def size(self):
+        return self._size
+
+    def overlap(self, begin, end):
+        '''Return the values of all intervals overlapping the closed window
+        [begin, end].  Either bound may be None for an open-ended window.'''
+
+        values = []
+        if begin is not None and end is not None and begin > end:
+            return values
+
+        nodes = [self._root]
+        while nodes:
+            node = nodes.pop()
+            if not node:
+                continue
+
+            (center, begins, by_begin, ends, by_end, left, right) = node
+
+            if end is not None and end < center:
+                # Intervals at this node begin at or before center: keep those
+                # beginning at or before the window end
+                values.extend(by_begin[:bisect.bisect_right(begins, end)])
+                nodes.append(left)
+            elif begin is not None and begin > center:
+                # Intervals at this node end at or after center: keep those
+                # ending at or after the window begin
+                values.extend(by_end[bisect.bisect_left(ends, begin):])
+                nodes.append(right)
+            else:
+                # The window contains center, so every interval at this node
+                # overlaps it
+                values.extend(by_begin)
+                nodes.append(left)
+                nodes.append(right)
+
+        return values
+
+    def at(self, t):
+        '''Return the values of all intervals containing t'''
+        return self.overlap(t, t)
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return '<IntervalIndex(intervals={:0.0f})>'.format(self._size)
+
+def _build_node(intervals):
+    '''Return the tree node (center, begins, by_begin, ends, by_end, left, right)
+    for the intervals, where by_begin and by_end are the values of the intervals
+    containing center, sorted by begin and end'''
+
+    if not intervals:
+        return
+
+    points = sorted([i[0] for i in intervals] + [i[1] for i in intervals])
+    center = points[len(points) // 2]
+
+    left = []
+    right = []
+    centered = []
+    for interval in intervals:
+        if interval[1] < center:
+            left.append(interval)
+        elif interval[0] > center:
+            right.append(interval)
+        else:
+            centered.append(interval)
+
+    centered.sort(key=lambda i: i[0])
+    begins = [i[0] for i in centered]
+    by_begin = [i[2] for i in centered]
+
+    centered.sort(key=lambda i: i[1])
+    ends = [i[1] for i in centered]
+    by_end = [i[2] for i in centered]
+
+    return (center, begins, by_begin, ends, by_end, _build_node(left), _build_node(right))
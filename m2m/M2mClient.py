@@ -3,15 +3,37 @@ import requests
 import json
 import time
 import datetime
+import calendar
+import bisect
+import itertools
+from multiprocessing.pool import ThreadPool
 from dateutil import parser
 from dateutil.relativedelta import relativedelta as tdelta
 from pytz import timezone
+from m2m.M2mMetrics import M2mMetrics, timed
+from m2m.M2mRequest import M2mRequest
+from m2m.M2mRequestTemplate import M2mRequestTemplate
+from m2m.IntervalIndex import IntervalIndex
+from m2m.RefDesIndex import RefDesIndex
+from m2m.TrigramIndex import TrigramIndex
+from m2m.ReadOnlyView import ReadOnlyView
+from m2m.deployments import normalize_deployment_events
+from m2m.particles import iter_particles, iter_particle_batches
+from m2m.tocfile import save_toc
+from m2m.SharedToc import SharedToc, StringTable, write_shared_toc
 
 # Disables SSL warnings
 import requests.packages.urllib3
 requests.packages.urllib3.disable_warnings()
 
 HTTP_STATUS_OK = 200
+HTTP_STATUS_TOO_MANY_REQUESTS = 429
+
+# Names searched by M2mClient.fuzzy_search
+FUZZY_SEARCH_KINDS = ('instruments',
+    'streams',
+    'parameters',
+    'subsites')
 
 _valid_relativedeltatypes = ('years',
     'months',
@@ -29,18 +51,36 @@ class M2mClient(object):
         timeout: timeout duration (Default is 120 seconds)
         api_username: API user name associated with the registered user's profile
         api_token: API token associated with the registered user's profile
+        shared_toc: shared table of contents file, written by publish_toc, to
+            attach to instead of fetching and indexing the table of contents.
+            Searches use the memory-mapped tables directly.  The toc,
+            instruments, parameters and streams properties are decoded from the
+            file into plain lists and dictionaries when first read.
+        num_retries: number of times a request is resent after a connection
+            error, timeout, HTTP 429 or 5xx response, waiting one more second
+            before each attempt (Default is 0)
     '''
     
-    def __init__(self, base_url=None, timeout=120, api_username=None, api_token=None, toc=None):
+    def __init__(self, base_url=None, timeout=120, api_username=None, api_token=None, toc=None, shared_toc=None, num_retries=0):
         
         self._base_url = None
         self._m2m_base_url = None
         self._timeout = timeout
+        self._num_retries = num_retries
         self._api_username = api_username
         self._api_token = api_token
     
         self._logger = logging.getLogger(__name__)
         
+        # Request and operation metrics
+        self._metrics = M2mMetrics()
+        
+        # Pooled HTTP connections, reused by all requests sent by this instance
+        self._session = requests.Session()
+        self._session.verify = False
+        if self._api_username and self._api_token:
+            self._session.auth = (self._api_username, self._api_token)
+        
         # properties for last m2m request
         self._last_m2m_request = None
         self._last_m2m_response = None
@@ -50,24 +90,53 @@ class M2mClient(object):
         self._toc = []
         self._subsites = []
         self._instruments = []
+        # Newline-delimited reference designators and the offset of each in the text
+        self._instrument_text = ''
+        self._instrument_offsets = []
+        # Reference designator components (subsite, node, port, instrument, class)
+        self._refdes_index = RefDesIndex([])
         self._parameters = []
         self._streams = []
+        self._stream_names = []
+        # Inverted indexes: parameter name to streams and stream to instruments
+        self._parameter_streams = {}
+        self._stream_instruments = {}
+        # Trigram indexes for fuzzy searches, built with the table of contents
+        # indexes
+        self._fuzzy_indexes = {}
+        # Stream time coverage, built on first use
+        self._stream_coverage = None
+        self._coverage_index = None
         self._toc_response = toc
         self._static_toc = False
         if self._toc_response:
             self._static_toc = True
+        # Memory-mapped table of contents and indexes shared with other processes
+        self._shared_toc_file = shared_toc
+        self._shared_toc = None
+        # Plain copies of the shared tables returned by the properties
+        self._plain_tables = {}
+        if self._shared_toc_file:
+            self._static_toc = True
         
         # Deployment events
         self._selected_raw_events = []
         self._filtered_raw_events = []
         self._instrument_deployment_events = []
+        self._active_deployment_events = []
+        
+        # Request url templates, keyed by the shared query string parameters
+        self._request_templates = {}
         
         # Set the base url
         self.base_url = base_url
-        self._static_toc = False
         
         self._logger.debug('UFrame instance: {:s}'.format(self.base_url))
         
+    @property
+    def metrics(self):
+        return self._metrics
+        
     @property
     def last_m2m_request(self):
         return self._last_m2m_request
@@ -109,27 +178,39 @@ class M2mClient(object):
             return
             
         self._timeout = seconds
+        
+    @property
+    def num_retries(self):
+        return self._num_retries
     
     @property
     def toc(self):
-        return self._toc_response
+        return self._plain_table('toc', self._toc_response)
             
     @property
     def instruments(self):
-        return self._instruments
+        return self._plain_table('instruments', self._instruments)
         
     @property
     def parameters(self):
-        return self._parameters
+        return self._plain_table('parameters', self._parameters)
         
     @property
     def streams(self):
-        return self._streams
+        return self._plain_table('streams', self._streams)
         
     @property
     def subsites(self):
         return self._subsites
         
+    @property
+    def refdes_index(self):
+        return self._refdes_index
+        
+    @property
+    def shared_toc(self):
+        return self._shared_toc
+        
     @property
     def instrument_deployment_events(self):
         return self._instrument_deployment_events
@@ -142,10 +223,85 @@ class M2mClient(object):
     def deployed_instruments(self):
         return self._active_deployment_events
         
+    def refresh_toc(self):
+        '''Fetch a new copy of the table of contents and rebuild the internal data
+        structures.  Does nothing if the instance was created with a static table
+        of contents.'''
+        
+        if self._static_toc:
+            self._logger.debug('Keeping static table of contents')
+            return
+            
+        toc = self._fetch_toc()
+        if not toc:
+            self._logger.warning('Keeping current table of contents')
+            return
+            
+        self._toc_response = toc
+        self._build_toc()
+        
     def toc_to_json(self):
         '''Dump the UI table of contents as a valid JSON object'''
-        return json.dumps(self._toc_response)
+        return json.dumps(self._export_toc())
+        
+    def save_toc(self, path, compression=None):
+        '''Write the table of contents to path, for use with --tocfile, and return
+        the compression format used.  The file is compressed as specified (none,
+        gzip, bz2 or zstd) or as given by the path extension (.gz, .bz2 or .zst).
+        Returns None if there is no table of contents or it cannot be written.'''
         
+        if not self._toc_response:
+            self._logger.warning('No table of contents found')
+            return
+            
+        try:
+            return save_toc(self._export_toc(), path, compression=compression)
+        except (IOError, OSError, ValueError) as e:
+            self._logger.error('{:s}: {:s}'.format(path, str(e)))
+            return
+        
+    @timed('toc_publish')
+    def publish_toc(self, path):
+        '''Write the table of contents and its indexes to the shared table of
+        contents file path, for other processes on the host to attach to with the
+        shared_toc option instead of each building their own copy.  Returns True
+        if the file was written.'''
+        
+        if not self._toc_response:
+            self._logger.warning('No table of contents found')
+            return False
+            
+        toc = self._export_toc()
+        toc_keys = sorted(toc.keys())
+        parameter_streams = sorted(self._parameter_streams.keys())
+        stream_instruments = sorted(self._stream_instruments.keys())
+        
+        tables = {'toc' : (toc_keys, [toc[k] for k in toc_keys]),
+            'instruments' : (self._instruments, [self._toc[r] for r in self._instruments]),
+            'parameters' : (self._parameters, None),
+            'streams' : (self._stream_names, [self._streams[s] for s in self._stream_names]),
+            'parameter_streams' : (parameter_streams, [self._parameter_streams[p] for p in parameter_streams]),
+            'stream_instruments' : (stream_instruments, [self._stream_instruments[s] for s in stream_instruments])}
+            
+        try:
+            write_shared_toc(path, tables)
+        except (IOError, OSError, ValueError) as e:
+            self._logger.error('{:s}: {:s}'.format(path, str(e)))
+            return False
+            
+        return True
+        
+    def _export_toc(self):
+        '''Return the table of contents without the instrument_parameters lists
+        added to each instrument when it is indexed, which are rebuilt when it is
+        loaded'''
+        
+        toc = dict(self._toc_response)
+        toc['instruments'] = [{k:v for (k,v) in i.items() if k != 'instrument_parameters'} for i in self._toc_response['instruments']]
+        
+        return toc
+        
+    @timed('search_instruments')
     def search_instruments(self, target_string, metadata=False):
         '''Return a list of all fully-qualified instrument reference designators 
         containing the target_string.
@@ -159,11 +315,184 @@ class M2mClient(object):
             self._logger.warning('No table of contents found')
             return []
             
+        instruments = self._find_instruments(target_string)
+        
         if metadata:
-            return [self._toc[r] for r in self._instruments if r.find(target_string) >= 0]
+            return [self._toc[r] for r in instruments]
         else:
-            return [r for r in self._instruments if r.find(target_string) >= 0]
+            return instruments
+            
+    def search_instruments_batch(self, target_strings, metadata=False):
+        '''Generator yielding a (target_string, instruments) tuple for each of the
+        target_strings, in order, where instruments is the list returned by
+        search_instruments.  Fully-qualified reference designators are resolved
+        directly from the table of contents and repeated target strings are only
+        searched once.
         
+        Parameters:
+            target_strings: iterable of partial or fully-qualified reference designators
+            metadata: set to True to return an array of dictionaries containing 
+            streams and parameters produced by each matching instrument.'''
+            
+        if not self._toc:
+            self._logger.warning('No table of contents found')
+            return
+            
+        resolved = {}
+        for target_string in target_strings:
+            
+            if target_string not in resolved:
+                if target_string in self._toc:
+                    resolved[target_string] = [target_string]
+                else:
+                    resolved[target_string] = self._find_instruments(target_string)
+                    
+            instruments = resolved[target_string]
+            if metadata:
+                yield target_string, [self._toc[r] for r in instruments]
+            else:
+                yield target_string, list(instruments)
+                
+    def _find_instruments(self, target_string):
+        '''Return the sorted list of reference designators containing target_string.
+        The search runs over the newline-delimited instrument text, rather than
+        looping over each reference designator.'''
+        
+        return [self._instruments[r] for r in self._iter_find_instruments(target_string)]
+        
+    def _iter_find_instruments(self, target_string, first=0):
+        '''Generator yielding the index of each reference designator containing
+        target_string, starting at the reference designator at index first'''
+        
+        if first >= len(self._instruments):
+            return
+            
+        start = self._instrument_offsets[first]
+        while True:
+            i = self._instrument_text.find(target_string, start)
+            if i == -1:
+                break
+                
+            # Map the match offset back to the reference designator and continue
+            # searching from the start of the next one
+            r = bisect.bisect_right(self._instrument_offsets, i) - 1
+            if r >= len(self._instruments):
+                break
+            yield r
+            start = self._instrument_offsets[r+1]
+            
+    def iter_instruments(self, target_string=None, after=None, limit=None, metadata=False):
+        '''Generator yielding the sorted fully-qualified reference designators
+        containing the target_string, without building the list of matches.
+        Paging is done in the index: iteration starts after the reference
+        designator after and stops after limit instruments, so walking the whole
+        catalog page by page uses constant extra memory.
+        
+        Parameters:
+            target_string: partial or fully-qualified reference designator.  Default
+                is all instruments
+            after: yield only the reference designators sorting after this one, i.e.:
+                the last reference designator of the previous page
+            limit: maximum number of instruments to yield
+            metadata: set to True to yield a read-only view of the metadata of each
+                instrument instead of the reference designator'''
+        
+        if not self._toc:
+            self._logger.warning('No table of contents found')
+            return
+            
+        first = 0
+        if after is not None:
+            first = bisect.bisect_right(self._instruments, after)
+            
+        if target_string:
+            indexes = self._iter_find_instruments(target_string, first)
+        else:
+            indexes = _iter_range(first, len(self._instruments))
+            
+        for r in itertools.islice(indexes, limit):
+            if metadata:
+                yield ReadOnlyView(self._toc[self._instruments[r]])
+            else:
+                yield self._instruments[r]
+                
+    def iter_parameters(self, target_string=None, after=None, limit=None):
+        '''Generator yielding the sorted parameter names containing the
+        target_string (Default is all parameters).  after and limit page through
+        the parameters as in iter_instruments.'''
+        
+        if not self._toc:
+            self._logger.warning('No table of contents found')
+            return
+            
+        for p in _iter_sorted(self._parameters, target_string, after, limit):
+            yield p
+            
+    def iter_streams(self, target_stream=None, after=None, limit=None, metadata=False):
+        '''Generator yielding the sorted stream names containing the target_stream
+        fragment (Default is all streams).  after and limit page through the streams
+        as in iter_instruments.
+        
+        Parameters:
+            target_stream: partial or full stream name
+            after: yield only the streams sorting after this one
+            limit: maximum number of streams to yield
+            metadata: set to True to yield a read-only view containing the stream
+                and its parameters instead of the stream name'''
+        
+        if not self._toc:
+            self._logger.warning('No table of contents found')
+            return
+            
+        for s in _iter_sorted(self._stream_names, target_stream, after, limit):
+            if metadata:
+                yield ReadOnlyView({'stream' : s, 'parameters' : self._streams[s]})
+            else:
+                yield s
+                
+    def iter_subsites(self, target_subsite=None, after=None, limit=None):
+        '''Generator yielding the sorted subsites containing the target_subsite
+        fragment (Default is all subsites).  after and limit page through the
+        subsites as in iter_instruments.'''
+        
+        if not self._toc:
+            self._logger.warning('No table of contents found')
+            return
+            
+        for s in _iter_sorted(self._subsites, target_subsite, after, limit):
+            yield s
+            
+    def iter_instrument_streams(self, reference_designator=None, limit=None):
+        '''Generator yielding a read-only view of each stream produced by the
+        partial or fully-qualified reference designator (Default is all
+        instruments).  Unlike instrument_to_streams, the table of contents stream
+        dictionaries are neither copied nor modified: the beginTimeEpochMs and
+        endTimeEpochMs unix timestamps (UTC, in milliseconds) are added to the view.
+        Streams with invalid beginTime or endTime values are skipped.
+        
+        Parameters:
+            reference_designator: partial or fully-qualified reference designator
+            limit: maximum number of streams to yield'''
+        
+        streams = self._iter_instrument_streams(reference_designator)
+        
+        for stream in itertools.islice(streams, limit):
+            yield stream
+            
+    def _iter_instrument_streams(self, reference_designator):
+        
+        for instrument in self.iter_instruments(reference_designator):
+            for stream in self._toc[instrument]['streams']:
+                try:
+                    times = {'beginTimeEpochMs' : _parse_epoch_ms(stream['beginTime']),
+                        'endTimeEpochMs' : _parse_epoch_ms(stream['endTime'])}
+                except ValueError as e:
+                    self._logger.error('{:s}-{:s}: Invalid stream time coverage ({:s})'.format(stream['reference_designator'], stream['stream'], str(e)))
+                    continue
+                    
+                yield ReadOnlyView(stream, extra=times)
+                
+    @timed('search_parameters')
     def search_parameters(self, target_string, metadata=False):
         '''Return the list of all stream parameters containing the target_string
         from the current UFrame table of contents.
@@ -185,6 +514,7 @@ class M2mClient(object):
         #    #return [p['particleKey'] for p in self._parameters if p['particleKey'].find(target_string) >= 0]
         #    return [p for p in self._parameters if p.find(target_string) >= 0]
     
+    @timed('search_streams')
     def search_streams(self, target_stream, metadata=False):
         '''Returns a the list of all streams containing the target_stream fragment
         
@@ -201,6 +531,7 @@ class M2mClient(object):
         else:
             return [s for s in streams if s.find(target_stream) >= 0]
         
+    @timed('search_subsites')
     def search_subsites(self, target_subsite):
         '''Returns a the list of all subsites containing the target_subsite fragment
         
@@ -220,32 +551,172 @@ class M2mClient(object):
         
         return arrays
         
-    def stream_to_instrument(self, target_stream):
+    @timed('fuzzy_search')
+    def fuzzy_search(self, target_string, kind='instruments', limit=10, min_score=0.5, time_budget=None):
+        '''Return the ranked list of up to limit instruments, streams, parameters or
+        subsites best matching the possibly misspelled target_string, as
+        dictionaries containing the match and its score.  The score is the
+        fraction of the target_string trigrams (3 character substrings) found in
+        the match (see TrigramIndex).  The trigram indexes are built with the
+        table of contents indexes, or, when attached to a shared table of
+        contents, the first time each kind is searched.
+        
+        Parameters:
+            target_string: partial or full name
+            kind: instruments (Default), streams, parameters or subsites
+            limit: maximum number of matches (Default is 10)
+            min_score: minimum score, from 0 to 1 (Default is 0.5)
+            time_budget: maximum number of seconds spent searching the index.
+                Default is no limit.'''
+        
+        if kind not in FUZZY_SEARCH_KINDS:
+            self._logger.error('Invalid fuzzy search kind: {:s}'.format(kind))
+            return []
+            
+        if not self._toc:
+            self._logger.warning('No table of contents found')
+            return []
+            
+        matches = self._get_fuzzy_index(kind).search(target_string, limit=limit, min_score=min_score, time_budget=time_budget)
+        
+        return [{'match' : match, 'score' : score} for (match, score) in matches]
+        
+    def _get_fuzzy_index(self, kind):
+        '''Return the TrigramIndex for the kind of name, building it if not built
+        yet'''
+        
+        if kind not in self._fuzzy_indexes:
+            with self._metrics.timer('fuzzy_index'):
+                if kind == 'instruments':
+                    names = self._instruments
+                elif kind == 'streams':
+                    names = self._stream_names
+                elif kind == 'parameters':
+                    names = self._parameters
+                else:
+                    names = self._subsites
+                self._fuzzy_indexes[kind] = TrigramIndex(names)
+                
+        return self._fuzzy_indexes[kind]
+        
+    def find_instruments(self, subsite=None, node=None, instrument_class=None):
+        '''Return the sorted list of fully-qualified reference designators on the
+        subsite and node and of the instrument class, looked up in the reference
+        designator component index.
+        
+        Parameters:
+            subsite: subsite (i.e.: CE01ISSM)
+            node: subsite-node (i.e.: CE01ISSM-MFD35) or, if subsite is specified,
+                the node name (i.e.: MFD35)
+            instrument_class: 5 character instrument class (i.e.: CTDBP)'''
+        
+        if not self._toc:
+            self._logger.warning('No table of contents found')
+            return []
+            
+        return self._refdes_index.instruments(subsite=subsite, node=node, instrument_class=instrument_class)
+        
+    def find_nodes(self, subsite=None):
+        '''Return the sorted list of nodes, as subsite-node, on the subsite (Default
+        is all subsites)'''
+        
+        return self._refdes_index.nodes(subsite)
+        
+    @timed('stream_to_instrument')
+    def stream_to_instrument(self, target_stream, exact=False):
         '''Returns a the list of all instrument reference designators producing
         the specified stream
         
         Parameters:
-            target_stream: partial or full stream name'''
-        
-        instruments = []
+            target_stream: partial or full stream name
+            exact: only match the full stream name (Default is False)'''
         
         if not self._toc:
             self._logger.warning('No table of contents found')
-            return instruments
+            return []
             
-        for r in self._toc.keys():
-            streams = [s for s in self._toc[r]['streams'] if s['stream'].find(target_stream) >= 0]
-            if not streams:
-                continue
-            for stream in streams:
-                if stream['reference_designator'] in instruments:
-                    continue
-                instruments.append(stream['reference_designator'])
+        if exact:
+            return list(self._stream_instruments.get(target_stream, []))
+            
+        instruments = set()
+        for stream in self._stream_instruments.keys():
+            if stream.find(target_stream) >= 0:
+                instruments.update(self._stream_instruments[stream])
                 
-        instruments.sort()
+        return sorted(instruments)
         
-        return instruments
+    def parameter_to_streams(self, parameter):
+        '''Returns the sorted list of all streams containing the parameter
         
+        Parameters:
+            parameter: full parameter name (particle_key)'''
+        
+        if not self._toc:
+            self._logger.warning('No table of contents found')
+            return []
+            
+        return list(self._parameter_streams.get(parameter, []))
+        
+    def parameter_to_instruments(self, parameter):
+        '''Returns the sorted list of all instrument reference designators producing
+        a stream containing the parameter
+        
+        Parameters:
+            parameter: full parameter name (particle_key)'''
+        
+        instruments = set()
+        for stream in self.parameter_to_streams(parameter):
+            instruments.update(self._stream_instruments.get(stream, []))
+            
+        return sorted(instruments)
+        
+    def streams_with_data(self, begin_ts=None, end_ts=None, ref_des=None):
+        '''Return the list of all instrument streams whose time coverage overlaps the
+        time window.  Each stream is a dictionary containing the
+        reference_designator, method, stream, beginTime and endTime.
+        
+        Parameters:
+            begin_ts: ISO-8601 formatted window start time.  Default is no start
+            end_ts: ISO-8601 formatted window end time.  Default is no end
+            ref_des: partial or fully-qualified reference designator restricting
+                the instruments
+        '''
+        
+        if not self._toc:
+            self._logger.warning('No table of contents found')
+            return []
+            
+        begin_ms = None
+        end_ms = None
+        try:
+            if begin_ts:
+                begin_ms = _parse_epoch_ms(begin_ts)
+            if end_ts:
+                end_ms = _parse_epoch_ms(end_ts)
+        except ValueError as e:
+            self._logger.error('Invalid time window: {:s}'.format(str(e)))
+            return []
+            
+        self._get_stream_coverage()
+        
+        keys = self._coverage_index.overlap(begin_ms, end_ms)
+        if ref_des:
+            keys = [k for k in keys if k[0].find(ref_des) >= 0]
+        keys.sort()
+        
+        return [{'reference_designator' : k[0],
+            'method' : k[1],
+            'stream' : k[2],
+            'beginTime' : self._stream_coverage[k][2],
+            'endTime' : self._stream_coverage[k][3]} for k in keys]
+            
+    def streams_active_at(self, ts, ref_des=None):
+        '''Return the list of all instrument streams producing data at the ISO-8601
+        formatted time ts.  Streams are returned as in streams_with_data.'''
+        
+        return self.streams_with_data(begin_ts=ts, end_ts=ts, ref_des=ref_des)
+        
+    @timed('instrument_to_streams')
     def instrument_to_streams(self, reference_designator):
         '''Return the list of all streams produced by the partial or fully-qualified
         reference designator.
@@ -324,17 +795,58 @@ class M2mClient(object):
     def _build_toc(self):
         '''Fetch the UFrame table of contents and build the internal data structures'''
         
+        if self._shared_toc_file:
+            self._attach_toc(self._shared_toc_file)
+            return
+            
         if self._toc_response:
             self._logger.debug('Using static table of contents')
             toc = self._toc_response
         else:
-            self._logger.debug('Fetching table of contents')
-            toc = self._build_and_send_m2m_request(12576, '/sensor/inv/toc')
+            toc = self._fetch_toc()
             if not toc:
                 return
             
         self._toc_response = toc
         
+        self._index_toc(toc)
+        
+    @timed('coverage_index')
+    def _get_stream_coverage(self):
+        '''Return the dictionary mapping each (reference_designator, method, stream)
+        to its (begin_ms, end_ms, beginTime, endTime) time coverage, building it and
+        the interval index over all streams on first use'''
+        
+        if self._stream_coverage is not None:
+            return self._stream_coverage
+            
+        coverage = {}
+        for i in self._toc.keys():
+            for s in self._toc[i]['streams']:
+                try:
+                    begin_ms = _parse_epoch_ms(s['beginTime'])
+                    end_ms = _parse_epoch_ms(s['endTime'])
+                except ValueError:
+                    self._logger.warning('{:s}-{:s}: Invalid stream time coverage ({:s} - {:s})'.format(i, s['stream'], s['beginTime'], s['endTime']))
+                    continue
+                coverage[(i, s['method'], s['stream'])] = (begin_ms, end_ms, s['beginTime'], s['endTime'])
+                
+        self._coverage_index = IntervalIndex([(c[0], c[1], k) for (k, c) in coverage.items()])
+        self._stream_coverage = coverage
+        
+        return self._stream_coverage
+        
+    @timed('toc_fetch')
+    def _fetch_toc(self):
+        '''Fetch and return the UFrame table of contents'''
+        
+        self._logger.debug('Fetching table of contents')
+        return self._build_and_send_m2m_request(12576, '/sensor/inv/toc')
+        
+    @timed('toc_index')
+    def _index_toc(self, toc):
+        '''Build the internal data structures from the table of contents'''
+        
         # Map the instrument metadata response to the reference designator
         self._toc = {i['reference_designator']:i for i in toc['instruments']}
         
@@ -343,6 +855,19 @@ class M2mClient(object):
         ref_des.sort()
         self._instruments = ref_des
         
+        # Index the reference designators for substring searches
+        self._instrument_text = '\n'.join(ref_des) + '\n'
+        offsets = [0]
+        for r in ref_des:
+            offsets.append(offsets[-1] + len(r) + 1)
+        self._instrument_offsets = offsets
+        
+        # Parse the reference designator components once
+        self._refdes_index = RefDesIndex(ref_des)
+        
+        # Templates cache the url path of each reference designator in the index
+        self._request_templates = {}
+        
         # Create a dictionary mapping parameter id (pdId) to the parameter metadata
         param_defs = {p['pdId']:p for p in toc['parameter_definitions']}
         # Loop through the toc_response['parameters_by_stream'] and create
@@ -362,6 +887,25 @@ class M2mClient(object):
                 s['reference_designator'] = i
                 self._toc[i]['instrument_parameters'] = self._toc[i]['instrument_parameters'] + stream_defs[s['stream']]
                 
+        # Index the streams containing each parameter and the instruments producing
+        # each stream
+        parameter_streams = {}
+        for s in stream_defs.keys():
+            for p in stream_defs[s]:
+                parameter_streams.setdefault(p['particle_key'], set()).add(s)
+        self._parameter_streams = {p:sorted(streams) for (p, streams) in parameter_streams.items()}
+        
+        stream_instruments = {}
+        for i in self._toc.keys():
+            for s in self._toc[i]['streams']:
+                stream_instruments.setdefault(s['stream'], set()).add(i)
+        self._stream_instruments = {s:sorted(instruments) for (s, instruments) in stream_instruments.items()}
+        
+        # Rebuild the stream time coverage index on next use
+        self._fuzzy_indexes = {}
+        self._stream_coverage = None
+        self._coverage_index = None
+        
         # Create the full list of parameter names
         parameters = [p['particle_key'] for p in toc['parameter_definitions']]
         # Create the full list of streams
@@ -373,17 +917,80 @@ class M2mClient(object):
         #streams.sort()        
         self._parameters = parameters
         self._streams = stream_defs
+        self._stream_names = sorted(stream_defs.keys())
         
-        # Create a dict of unique array names
-        subsites = {t.split('-')[0]:True for t in self._toc.keys()}.keys()
-        subsites.sort()
-        self._subsites = subsites
+        # Create the sorted list of unique array names
+        self._subsites = self._refdes_index.subsites
+        
+        # Index the names for fuzzy searches
+        for kind in FUZZY_SEARCH_KINDS:
+            self._get_fuzzy_index(kind)
         
         # Search for all actively deployed instruments
         # 2016-12-15: m2m api can't handle this volume of deployments, so wait until
         # it's fixed to create the active deployments catalog
         #self._get_active_deployments()
             
+    @timed('toc_index')
+    def _attach_toc(self, path):
+        '''Use the table of contents and indexes in the shared table of contents
+        file path in place of the internal data structures.  Records are decoded
+        from the mapped file on access, so only the reference designator component
+        index is built by this process.'''
+        
+        if self._shared_toc and self._shared_toc.path == path:
+            return
+            
+        try:
+            shared_toc = SharedToc(path)
+        except (IOError, OSError, ValueError) as e:
+            self._logger.error('{:s}: {:s}'.format(path, str(e)))
+            return
+            
+        self._logger.debug('Attached to shared table of contents: {:s}'.format(path))
+        
+        self._shared_toc = shared_toc
+        self._toc_response = shared_toc.table('toc')
+        self._toc = shared_toc.table('instruments')
+        
+        self._instruments = shared_toc.keys('instruments')
+        self._instrument_text = self._instruments.text
+        self._instrument_offsets = self._instruments.offsets
+        
+        self._refdes_index = RefDesIndex(self._instruments)
+        self._request_templates = {}
+        
+        self._parameters = shared_toc.keys('parameters')
+        self._streams = shared_toc.table('streams')
+        self._stream_names = shared_toc.keys('streams')
+        self._parameter_streams = shared_toc.table('parameter_streams')
+        self._stream_instruments = shared_toc.table('stream_instruments')
+        
+        # Names are decoded from the mapped file on access, so the fuzzy search
+        # indexes are only built for the kinds searched
+        self._fuzzy_indexes = {}
+        self._stream_coverage = None
+        self._coverage_index = None
+        self._plain_tables = {}
+        
+        self._subsites = self._refdes_index.subsites
+        
+    def _plain_table(self, name, table):
+        '''Return table, or, if attached to a shared table of contents, its plain list
+        or dictionary copy, decoded from the mapped file once'''
+        
+        if not self._shared_toc:
+            return table
+            
+        if name not in self._plain_tables:
+            if isinstance(table, StringTable):
+                self._plain_tables[name] = list(table)
+            else:
+                self._plain_tables[name] = dict(table)
+                
+        return self._plain_tables[name]
+        
+    @timed('query_instrument_deployments')
     def query_instrument_deployments(self, ref_des, ref_des_search_string=None, status=None, raw=False):
         '''Return the list of all deployment events for the specified reference
         designator, which may be partial or fully-qualified reference designator
@@ -391,99 +998,124 @@ class M2mClient(object):
         (status) may be set to all, active or inactive to return all <default>,
         active or inactive deployment events'''
         
+        self._selected_raw_events = []
+        self._filtered_raw_events = []
+        self._instrument_deployment_events = []
+        
         end_point = '/events/deployment/query?refdes={:s}'.format(ref_des)
         deployment_events = self._build_and_send_m2m_request(12587, end_point)
         if not deployment_events:
             self._logger.debug('No deployment events for {:s}'.format(ref_des))
             return
             
-        self._selected_raw_events = []
-        self._filtered_raw_events = []
-        self._instrument_deployment_events = []
-         
+        # Normalize and filter all events at once
+        (filtered_raw_events, events) = normalize_deployment_events(deployment_events,
+            status=status,
+            ref_des_search_string=ref_des_search_string,
+            refdes_index=self._refdes_index)
+        
         self._selected_raw_events = deployment_events
+        self._filtered_raw_events = filtered_raw_events
+        self._instrument_deployment_events = events
             
-        for event in self._selected_raw_events:
-            
-            # Event must have a fully qualified reference designator
-            if not event['referenceDesignator']['full']:
-                self._logger.warning('{:s}: Invalid instrument for event id={:0.0f}\n'.format(event['eventName'], event['eventId']))
-                continue
-             
-            # Create the fully qualified reference designator
-            reference_designator = '{:s}-{:s}-{:s}'.format(
-                event['referenceDesignator']['subsite'],
-                event['referenceDesignator']['node'],
-                event['referenceDesignator']['sensor'])   
-                
-            # Events must have a eventStartTime to be considered valid
-            if not event['eventStartTime']:
-                self._logger.warning('{:s}: Deployment event (id={:0.0f}) has no eventStartTime\n'.format(event['eventName'], event['eventId']))
-                continue
+        # Return this call's events, which may be run from several threads
+        return events
+        
+    def plan_deployment_queries(self, instruments, min_fraction=0.5):
+        '''Return the sorted list of reference designator prefixes to query for the
+        deployment events of the fully-qualified reference designators in
+        instruments.  Each subsite is queried as a whole if at least min_fraction
+        of its instruments are in instruments.  Otherwise, each node containing
+        one or more of the instruments is queried.
+        
+        Parameters:
+            instruments: list of fully-qualified reference designators
+            min_fraction: fraction of the subsite instruments above which the
+                subsite is queried instead of its nodes (Default is 0.5)'''
+        
+        nodes = {}
+        targets = {}
+        for instrument in set(instruments):
+            components = self._refdes_index.components(instrument)
+            if components:
+                (subsite, node) = components[:2]
+            else:
+                (subsite, node) = instrument.split('-')[:2]
+            nodes.setdefault(subsite, set()).add('{:s}-{:s}'.format(subsite, node))
+            targets[subsite] = targets.get(subsite, 0) + 1
             
-            # Create the concise instrument deployment event object    
-            deployment_event = {'instrument' : None,
-                'event_start_ms' : event['eventStartTime'],
-                'event_stop_ms' : event['eventStopTime'],
-                'deployment_number' : event['deploymentNumber'],
-                'event_start_ts' : None,
-                'event_stop_ts' : None,
-                'active' : False,
-                'valid' : False}
-            instrument = {'reference_designator' : reference_designator,
-                'node' : event['referenceDesignator']['node'],
-                'full' : event['referenceDesignator']['full'],
-                'subsite' : event['referenceDesignator']['subsite'],
-                'sensor' : event['referenceDesignator']['sensor']}
-            # Add the instrument info to the event
-            deployment_event['instrument'] = instrument
-    
-            # Parse the deployment event start time
-            try:
-                deployment_event['event_start_ts'] = datetime.datetime.utcfromtimestamp(deployment_event['event_start_ms']/1000).strftime('%Y-%m-%dT%H:%M:%S.%sZ')
-            except ValueError as e:
-                self._logger.error('Error parsing event_start_ms: {:s}\n'.format(e))
-                continue
-    
-            # Parse the deployment event end time, if there is one
-            if deployment_event['event_stop_ms']:
-                try:
-                    deployment_event['event_stop_ts'] = datetime.datetime.utcfromtimestamp(deployment_event['event_stop_ms']/1000).strftime('%Y-%m-%dT%H:%M:%S.%sZ')
-                except ValueError as e:
-                    self._logger.error('Error parsing event_start_ms: {:s}\n'.format(e))
-                    continue
+        queries = []
+        for subsite in sorted(nodes.keys()):
+            total = max(targets[subsite], len(self._refdes_index.instruments(subsite=subsite)))
+            if float(targets[subsite]) / total >= min_fraction:
+                queries.append(subsite)
             else:
-                # If the event does not have an end time, mark the deployment as active
-                deployment_event['active'] = True
+                queries = queries + sorted(nodes[subsite])
                 
-            # Deployment is valid
-            deployment_event['valid'] = True
+        return queries
+        
+    @timed('query_deployments_batch')
+    def query_deployments_batch(self, instruments=None, status=None, ref_des_search_string=None, min_fraction=0.5, num_threads=4):
+        '''Return a dictionary mapping each fully-qualified reference designator to
+        the list of its deployment events, fetched with one request per subsite or
+        node (see plan_deployment_queries) instead of one request per instrument.
+        The requests are sent concurrently and the events are split back out by
+        instrument, in response order.  Instruments without deployment events map
+        to an empty list.  Unlike query_instrument_deployments, the last request
+        and deployment event properties are not updated.
         
-            # Optionally filter the event based on it's status (None, 'all', 'active', 'inactive')
-            if status:
-                if status.lower() == 'active' and not deployment_event['active']:
-                    continue
-                elif status.lower() == 'inactive' and deployment_event['active']:
-                    continue
-                    
-            # Search the reference_designator for ref_des_search_string if specified
-            if ref_des_search_string:
-                if reference_designator.find(ref_des_search_string) == -1:
-                    continue
-                    
-            # If we've made it here, add the event and deployment_event
-            self._filtered_raw_events.append(event)
-            self._instrument_deployment_events.append(deployment_event)
+        Parameters:
+            instruments: list of fully-qualified reference designators or a partial
+                reference designator.  Default is all instruments
+            status: all (Default), active or inactive
+            ref_des_search_string: keep only the events whose fully-qualified
+                reference designator contains this string
+            min_fraction: see plan_deployment_queries
+            num_threads: maximum number of concurrent requests (Default is 4)'''
+        
+        if instruments is None:
+            instruments = self.instruments
+        elif not isinstance(instruments, (list, tuple)):
+            instruments = self.search_instruments(instruments)
             
-        return self._instrument_deployment_events
+        deployments = {i:[] for i in instruments}
+        if not deployments:
+            return deployments
+            
+        queries = self.plan_deployment_queries(instruments, min_fraction=min_fraction)
+        self._logger.debug('{:0.0f} deployment queries for {:0.0f} instruments'.format(len(queries), len(deployments)))
+        
+        pool = ThreadPool(max(1, min(num_threads, len(queries))))
+        try:
+            responses = pool.map(self._fetch_deployment_events, queries)
+        finally:
+            pool.close()
+            pool.join()
+            
+        for (query, raw_events) in zip(queries, responses):
+            if raw_events is None:
+                self._logger.warning('No deployment events for {:s}'.format(query))
+                continue
+            (selected, events) = normalize_deployment_events(raw_events,
+                status=status,
+                ref_des_search_string=ref_des_search_string,
+                refdes_index=self._refdes_index)
+            for event in events:
+                reference_designator = event['instrument']['reference_designator']
+                if reference_designator in deployments:
+                    deployments[reference_designator].append(event)
+                    
+        return deployments
         
-    def build_instrument_m2m_queries(self, ref_des, stream=None, telemetry=None, time_delta_type=None, time_delta_value=None, begin_ts=None, end_ts=None, time_check=True, exec_dpa=True, application_type='netcdf', provenance=True, limit=-1, annotations=False, user='_nouser', email=None, selogging=False):
+    @timed('build_instrument_m2m_queries')
+    def build_instrument_m2m_queries(self, ref_des, stream=None, telemetry=None, method=None, time_delta_type=None, time_delta_value=None, begin_ts=None, end_ts=None, time_check=True, exec_dpa=True, application_type='netcdf', provenance=True, limit=-1, annotations=False, user='_nouser', email=None, selogging=False, structured=False):
         '''Return the list of request urls that conform to the UFrame m2m API for the specified
         reference_designator.
         
         Parameters:
             ref_des: partial or fully-qualified reference designator
             telemetry: telemetry type (Default is all telemetry types
+            method: exact stream delivery method (i.e.: telemetered, recovered_host).  Unlike telemetry, which matches any method containing the string, only streams with this method are used
             time_delta_type: Type for calculating the subset start time, i.e.: years, months, weeks, days.  Must be a type kwarg accepted by dateutil.relativedelta'
             time_delta_value: Positive integer value to subtract from the end time to get the start time for subsetting.
             begin_dt: ISO-8601 formatted datestring specifying the dataset start time
@@ -493,6 +1125,7 @@ class M2mClient(object):
             provenance: boolean value specifying whether provenance information should be included in the data set (Default is True)
             limit: integer value ranging from -1 to 10000.  A value of -1 (default) results in a non-decimated dataset
             annotations: boolean value (True or False) specifying whether to include all dataset annotations
+            structured: return M2mRequest instances, which are sent directly by send_m2m_request, instead of urls (Default is False)
         '''
         
         m2m_urls = []
@@ -500,6 +1133,19 @@ class M2mClient(object):
         instruments = self.search_instruments(ref_des)
         if not instruments:
             return []    
+            
+        # Time spent parsing dates and formatting urls
+        parse_seconds = 0.
+        format_seconds = 0.
+        start_time = time.time()
+        
+        template = self.request_template(application_type=application_type,
+            limit=limit,
+            exec_dpa=exec_dpa,
+            provenance=provenance,
+            selogging=selogging,
+            user=user,
+            email=email)
         
         if time_delta_type and time_delta_value:
             if time_delta_type not in _valid_relativedeltatypes:
@@ -522,35 +1168,63 @@ class M2mClient(object):
                 self._logger.error('Invalid end_dt: {:s} ({:s})'.format(end_ts, e.message))
                 return []
                 
+        # Streams with no data in the requested window are skipped before any
+        # per-stream work when their times would be clipped by time_check: the
+        # (method, stream) of each instrument stream overlapping the window are
+        # looked up once in the coverage interval index
+        window_streams = None
+        if time_check and (begin_dt or end_dt) and not (time_delta_type and time_delta_value):
+            stream_coverage = self._get_stream_coverage()
+            begin_ms = _to_epoch_ms(begin_dt) if begin_dt else None
+            end_ms = _to_epoch_ms(end_dt) if end_dt else None
+            window_streams = {}
+            for k in self._coverage_index.overlap(begin_ms, end_ms):
+                # Streams ending at the window start or starting at the window end
+                # have no data in it
+                coverage = stream_coverage[k]
+                if (begin_ms is not None and begin_ms >= coverage[1]) or (end_ms is not None and end_ms <= coverage[0]):
+                    continue
+                window_streams.setdefault(k[0], set()).add((k[1], k[2]))
+            
         for instrument in instruments:
                 
             # Get the streams produced by this instrument
-            instrument_streams = self.instrument_to_streams(instrument)
+            if window_streams is None:
+                instrument_streams = self.instrument_to_streams(instrument)
+            else:
+                # Streams without a valid time coverage are kept, as before the
+                # window was checked
+                overlapping = window_streams.get(instrument, ())
+                instrument_streams = [s for s in self._toc[instrument]['streams'] if (s['method'], s['stream']) in overlapping or (instrument, s['method'], s['stream']) not in stream_coverage]
+                if not instrument_streams:
+                    self._logger.debug('{:s}: No data in the requested time window'.format(instrument))
+                    continue
             if stream:
                 stream_names = [s['stream'] for s in instrument_streams]
                 if stream not in stream_names:
                     self._logger.warning('{:s}: Invalid stream specified: {:s}'.format(instrument, stream))
                     continue
                     
-                i = stream_names.index(stream)
-                instrument_streams = [instrument_streams[i]]
+                # The same stream may be produced by more than one delivery method
+                instrument_streams = [s for s in instrument_streams if s['stream'] == stream]
                 
             if not instrument_streams:
                 self._logger.warning('{:s}: No valid streams found'.format(instrument))
                 continue
                 
-            # Break the reference designator up
-            r_tokens = instrument.split('-')
-            
             for instrument_stream in instrument_streams:
                 
                 if telemetry and instrument_stream['method'].find(telemetry) == -1:
                     continue
                     
+                if method and instrument_stream['method'] != method:
+                    continue
+                    
                 #Figure out what we're doing for time
                 dt0 = None
                 dt1 = None
                
+                t0 = time.time()
                 try:
                     stream_dt0 = parser.parse(instrument_stream['beginTime'])
                 except ValueError:
@@ -562,6 +1236,7 @@ class M2mClient(object):
                 except ValueError:
                     self._logger.warning('{:s}-{:s}: Invalid endTime ({:s})'.format('instrument', instrument_stream['stream'], instrument_stream['endTime']))
                     continue
+                parse_seconds += time.time() - t0
 
                 if time_delta_type and time_delta_value:
                     dt1 = stream_dt1
@@ -604,48 +1279,195 @@ class M2mClient(object):
                         ts0 = instrument_stream['beginTime']
                        
                     # Check that ts0 < ts1
+                    t0 = time.time()
                     dt0 = parser.parse(ts0)
                     dt1 = parser.parse(ts1)
+                    parse_seconds += time.time() - t0
                     if dt0 >= dt1:
                         self._logger.warning('{:s}: Invalid time range specified ({:s} >= {:s})'.format(instrument_stream['stream'], ts0, ts1))
                         continue
 
                 # Create the url
-                stream_url = '{:s}/12576/sensor/inv/{:s}/{:s}/{:s}-{:s}/{:s}/{:s}?beginDT={:s}&endDT={:s}&format=application/{:s}&limit={:d}&execDPA={:s}&include_provenance={:s}&selogging={:s}&user={:s}'.format(
-                    self.m2m_base_url,
-                    r_tokens[0],
-                    r_tokens[1],
-                    r_tokens[2],
-                    r_tokens[3],
-                    instrument_stream['method'],
-                    instrument_stream['stream'],
-                    ts0,
-                    ts1,
-                    application_type,
-                    limit,
-                    str(exec_dpa).lower(),
-                    str(provenance).lower(),
-                    str(selogging).lower(),
-                    user)
-                    
-                if email:
-                    stream_url = '{:s}&email={:s}'.format(stream_url, email)
+                t0 = time.time()
+                if structured:
+                    stream_url = template.request(instrument, instrument_stream['method'], instrument_stream['stream'], ts0, ts1)
+                else:
+                    stream_url = template.url(instrument, instrument_stream['method'], instrument_stream['stream'], ts0, ts1)
+                format_seconds += time.time() - t0
                     
                 m2m_urls.append(stream_url)
                             
+        self._metrics.observe_operation('date_parse', start_time, parse_seconds)
+        self._metrics.observe_operation('url_format', start_time, format_seconds)
+        
+        return m2m_urls
+        
+    @timed('build_parameter_m2m_queries')
+    def build_parameter_m2m_queries(self, parameters, ref_des=None, **kwargs):
+        '''Return the list of request urls for every instrument stream containing one
+        or more of the parameters.  Each instrument stream is requested once.
+        
+        Parameters:
+            parameters: full parameter name (particle_key) or list of names
+            ref_des: partial or fully-qualified reference designator restricting
+                the instruments
+            
+        Additional keyword arguments (telemetry, method, time_delta_type,
+        time_delta_value, begin_ts, end_ts, time_check, exec_dpa,
+        application_type, provenance, limit, annotations, user, email,
+        selogging, structured) are passed to build_instrument_m2m_queries.
+        '''
+        
+        if not isinstance(parameters, (list, tuple)):
+            parameters = [parameters]
+            
+        kwargs.pop('stream', None)
+        
+        # Unique instrument streams, in parameter order
+        instrument_streams = []
+        selected = set()
+        for parameter in parameters:
+            streams = self.parameter_to_streams(parameter)
+            if not streams:
+                self._logger.warning('No streams found for parameter: {:s}'.format(parameter))
+                continue
+            for stream in streams:
+                for instrument in self._stream_instruments.get(stream, []):
+                    if ref_des and instrument.find(ref_des) == -1:
+                        continue
+                    if (instrument, stream) not in selected:
+                        selected.add((instrument, stream))
+                        instrument_streams.append((instrument, stream))
+                        
+        m2m_urls = []
+        for (instrument, stream) in instrument_streams:
+            m2m_urls = m2m_urls + self.build_instrument_m2m_queries(instrument, stream=stream, **kwargs)
+            
         return m2m_urls
         
+    def request_template(self, application_type='netcdf', limit=-1, exec_dpa=True, provenance=True, selogging=False, user='_nouser', email=None):
+        '''Return the M2mRequestTemplate for the query string parameters shared by
+        a batch of requests.  Templates are created once and reused.'''
+        
+        key = (self.m2m_base_url, application_type, limit, exec_dpa, provenance, selogging, user, email)
+        if key not in self._request_templates:
+            self._request_templates[key] = M2mRequestTemplate(self.m2m_base_url,
+                application_type=application_type,
+                limit=limit,
+                exec_dpa=exec_dpa,
+                provenance=provenance,
+                selogging=selogging,
+                user=user,
+                email=email,
+                refdes_index=self._refdes_index)
+                
+        return self._request_templates[key]
+        
     def send_m2m_request(self, url):
         '''Validate and send the request url directly to the UFrame instance.  The 
-        request response is returned and also stored in UFrame.last_async_response'''
+        request response is returned and also stored in UFrame.last_async_response.
+        url may also be an M2mRequest, which is sent without parsing a url.  The
+        returned response is that of this request, even when requests are sent
+        from several threads (see M2mRequestScheduler).'''
+        
+        (m2m_port, m2m_endpoint) = self._parse_m2m_url(url)
+        if m2m_port is None:
+            return
+            
+        if not self._base_url:
+            self._logger.warning('base_url has not been specified')
+            return self._m2m_response()
+            
+        # Send the request
+        (m2m_url, status_code, response, decoded) = self._fetch_m2m_response(m2m_port, m2m_endpoint)
+        if not m2m_url:
+            return self._m2m_response()
+            
+        self._last_m2m_request = m2m_url
+        self._last_m2m_status_code = status_code
+        self._last_m2m_response = response
+        
+        return _m2m_response(m2m_url, status_code, response)
         
+    def stream_m2m_request(self, url, batch_size=None, chunk_size=65536):
+        '''Generator yielding the particles returned by the data request url, built
+        with application_type='json', as they are decoded from the response body.
+        The response is read chunk_size bytes at a time, so memory use does not
+        depend on the number of particles and particles may be processed before
+        the transfer is complete.  url may also be an M2mRequest.  Nothing is
+        yielded if the request fails or the response is not a JSON array of
+        particles.
         
+        Parameters:
+            url: data request url or M2mRequest
+            batch_size: yield batches of batch_size particles as numpy record
+                arrays, or lists if numpy is not installed, instead of single
+                particles (see iter_particle_batches)
+            chunk_size: number of bytes read from the response at a time
+                (Default is 64 KB)'''
+        
+        (port, end_point) = self._parse_m2m_url(url)
+        if port is None:
+            return
+            
+        if not self._base_url:
+            self._logger.warning('base_url has not been specified')
+            return
+            
+        m2m_url = '{:s}/{:0.0f}/{:s}'.format(self.m2m_base_url, port, end_point.strip('/'))
+        self._last_m2m_request = m2m_url
+        self._last_m2m_status_code = None
+        self._last_m2m_response = None
+        
+        start_time = time.time()
+        try:
+            r = self._session.get(m2m_url, timeout=self._timeout, stream=True)
+        except (requests.exceptions.MissingSchema, requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            self._metrics.observe_request(port, end_point, None, start_time, time.time() - start_time)
+            self._logger.error('{:s}: {:s}'.format(str(e), m2m_url))
+            return
+            
+        self._last_m2m_status_code = r.status_code
+        
+        # Count the bytes received as the body is read
+        num_bytes = [0]
+        def chunks():
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                num_bytes[0] += len(chunk)
+                yield chunk
+                
+        try:
+            if r.status_code != HTTP_STATUS_OK:
+                self._last_m2m_response = r.json()
+                self._logger.warning(self._last_m2m_response['message'])
+                return
+                
+            particles = iter_particles(chunks())
+            if batch_size:
+                particles = iter_particle_batches(particles, batch_size=batch_size)
+                
+            for item in particles:
+                yield item
+                
+        except (ValueError, requests.exceptions.RequestException) as e:
+            self._logger.error('{:s}: {:s}'.format(str(e), m2m_url))
+        finally:
+            r.close()
+            self._metrics.observe_request(port, end_point, r.status_code, start_time, time.time() - start_time, num_bytes[0])
+            
+    def _parse_m2m_url(self, url):
+        '''Return the (port, end_point) tuple of the request url or M2mRequest, or
+        (None, None) if the url is not an m2m request to the UFrame instance'''
+        
+        if isinstance(url, M2mRequest):
+            return url.port, url.end_point
+            
         # Remove leading and trailing whitespace from the url
         request_url = url.strip()
         
         # The url must be sent to the UFrame.base_url UFrame instance
-        if not request_url.startswith(self.m2m_base_url):
-            return
+        if not self.m2m_base_url or not request_url.startswith(self.m2m_base_url):
+            return None, None
             
         # Make sure the url begins with self.m2m_base_url
         m2m_endpoint = url[len(self.m2m_base_url)+1:]
@@ -655,20 +1477,14 @@ class M2mClient(object):
             m2m_endpoint = '{:s}'.format('/'.join(m2m_tokens[1:]))
         except ValueError as e:
             self._logger.error(e)
-            return
+            return None, None
             
-        # Send the request
-        self._build_and_send_m2m_request(m2m_port, m2m_endpoint)
+        return m2m_port, m2m_endpoint
         
-        response = {'requestUrl' : self._last_m2m_request,
-            'status' : False,
-            'status_code' : self._last_m2m_status_code,
-            'response' : self._last_m2m_response}
-            
-        if self._last_m2m_status_code == HTTP_STATUS_OK:
-            response['status'] = True
-            
-        return response
+    def _m2m_response(self):
+        '''Return the response to the last m2m request'''
+        
+        return _m2m_response(self._last_m2m_request, self._last_m2m_status_code, self._last_m2m_response)
         
     def _build_and_send_m2m_request(self, port, end_point):
         '''Send a UFrame API request through the m2m interface to the specified port and end_point'''
@@ -677,32 +1493,76 @@ class M2mClient(object):
             self._logger.warning('base_url has not been specified')
             return
             
-        m2m_url = '{:s}/{:0.0f}/{:s}'.format(self.m2m_base_url, port, end_point.strip('/'))
-            
-        try:
-            if self._api_username and self._api_token:
-                r = requests.get(m2m_url, auth=(self._api_username, self._api_token), verify=False)
-            else:
-                r = requests.get(m2m_url, verify=False)
-        except (requests.exceptions.MissingSchema, requests.exceptions.ConnectionError) as e:
-            self._logger.error('{:s}: {:s}'.format(e, m2m_url))
+        (m2m_url, status_code, response, decoded) = self._fetch_m2m_response(port, end_point)
+        if not m2m_url:
             return
-           
+            
         self._last_m2m_request = m2m_url
-        self._last_m2m_status_code = r.status_code
+        self._last_m2m_status_code = status_code
+        self._last_m2m_response = response
         
-        if r.status_code != HTTP_STATUS_OK:
-            self._last_m2m_response = r.json()
-            self._logger.warning(self._last_m2m_response['message'])
+        if status_code != HTTP_STATUS_OK or not decoded:
             return
             
+        return response
+        
+    def _fetch_m2m_response(self, port, end_point):
+        '''Send a UFrame API request through the m2m interface and return the
+        (m2m_url, status_code, response, decoded) tuple, without updating the last
+        request properties, so that requests may be sent from several threads.
+        m2m_url is None if the request could not be sent.  If the response is not
+        valid JSON, decoded is False and response is the response text.'''
+        
+        m2m_url = '{:s}/{:0.0f}/{:s}'.format(self.m2m_base_url, port, end_point.strip('/'))
+            
+        for attempt in range(self._num_retries + 1):
+            if attempt:
+                self._logger.info('Retrying request ({:0.0f}/{:0.0f}): {:s}'.format(attempt, self._num_retries, m2m_url))
+                self._metrics.observe_retry(port, end_point)
+                time.sleep(attempt)
+                
+            r = None
+            start_time = time.time()
+            try:
+                r = self._session.get(m2m_url, timeout=self._timeout)
+            except requests.exceptions.MissingSchema as e:
+                self._metrics.observe_request(port, end_point, None, start_time, time.time() - start_time)
+                self._logger.error('{:s}: {:s}'.format(str(e), m2m_url))
+                return None, None, None, False
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._metrics.observe_request(port, end_point, None, start_time, time.time() - start_time)
+                self._logger.error('{:s}: {:s}'.format(str(e), m2m_url))
+                continue
+                
+            self._metrics.observe_request(port, end_point, r.status_code, start_time, time.time() - start_time, len(r.content))
+            if r.status_code < 500 and r.status_code != HTTP_STATUS_TOO_MANY_REQUESTS:
+                break
+                
+        if r is None:
+            return None, None, None, False
+           
+        if r.status_code != HTTP_STATUS_OK:
+            response = r.json()
+            self._logger.warning(response['message'])
+            return m2m_url, r.status_code, response, True
+            
         try:
-            self._last_m2m_response = r.json()
-            return self._last_m2m_response
+            with self._metrics.timer('json_decode'):
+                return m2m_url, r.status_code, r.json(), True
         except ValueError as e:
             self._logger.error('{:s}: {:s}'.format(e, m2m_url))
-            self._last_m2m_response = r.text
+            return m2m_url, r.status_code, r.text, False
+        
+    def _fetch_deployment_events(self, ref_des):
+        '''Return the raw deployment events for the partial or fully-qualified
+        reference designator, or None on error'''
+        
+        end_point = '/events/deployment/query?refdes={:s}'.format(ref_des)
+        (m2m_url, status_code, response, decoded) = self._fetch_m2m_response(12587, end_point)
+        if status_code != HTTP_STATUS_OK or not decoded:
             return
+            
+        return response
         
     def _get_active_deployments(self, ref_des=None, ref_des_search_string=None):
         '''Retrieve the list of actively deployed instruments from the entire UFrame
@@ -710,8 +1570,6 @@ class M2mClient(object):
         only active deployment events for that instrument or array.  Resulting
         events may also be filtered by specifying a ref_des_search_string'''
         
-        events = []
-
         if ref_des:
             # Get the list of fully-qualified instrument reference designators for 
             # the specified partial or fully qualified ref_des
@@ -719,15 +1577,11 @@ class M2mClient(object):
         else:
             instruments = self.instruments
             
-        x = 0
+        deployments = self.query_deployments_batch(instruments, status='active', ref_des_search_string=ref_des_search_string)
+        
+        events = []
         for i in instruments:
-            x = x + 1
-            new_events = self.query_instrument_deployments(i, status='active', ref_des_search_string=ref_des_search_string)
-            if not new_events:
-                continue
-            events = events + new_events
-            
-        self._logger.critical('Sent {:0.0f} requests'.format(x))
+            events = events + deployments[i]
             
         self._active_deployment_events = events
             
@@ -736,4 +1590,50 @@ class M2mClient(object):
             return '<M2mClient(url={:s})>'.format(self.m2m_base_url)
         else:
             return '<M2mClient(url=None)>'
-
+        
+def _m2m_response(m2m_url, status_code, response):
+    '''Return the response dictionary returned by M2mClient.send_m2m_request'''
+    
+    return {'requestUrl' : m2m_url,
+        'status' : status_code == HTTP_STATUS_OK,
+        'status_code' : status_code,
+        'response' : response}
+        
+def _to_epoch_ms(dt):
+    '''Return the datetime as a unix timestamp in milliseconds.  Naive datetimes
+    are assumed to be UTC.'''
+    
+    return calendar.timegm(dt.utctimetuple()) * 1000 + dt.microsecond // 1000
+    
+def _parse_epoch_ms(timestamp):
+    '''Return the ISO-8601 formatted timestamp as a unix timestamp in milliseconds'''
+    
+    try:
+        dt = datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%fZ')
+    except ValueError:
+        dt = parser.parse(timestamp)
+        
+    return _to_epoch_ms(dt)
+        
+def _iter_range(first, last):
+    '''Generator yielding the integers from first up to, but not including, last,
+    without building the list under python 2'''
+    
+    i = first
+    while i < last:
+        yield i
+        i += 1
+        
+def _iter_sorted(sequence, target_string=None, after=None, limit=None):
+    '''Return an iterator over the items of the sorted sequence containing
+    target_string, starting after the item after and stopping after limit items'''
+    
+    first = 0
+    if after is not None:
+        first = bisect.bisect_right(sequence, after)
+        
+    items = (sequence[i] for i in _iter_range(first, len(sequence)))
+    if target_string:
+        items = (s for s in items if s.find(target_string) >= 0)
+        
+    return itertools.islice(items, limit)
@@ -0,0 +1,243 @@
+import logging
+import json
+import time
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from urlparse import urlsplit, parse_qs
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlsplit, parse_qs
+
+from m2m.M2mClient import FUZZY_SEARCH_KINDS
+
+# M2mClient methods and properties that may be queried through the daemon
+_QUERY_METHODS = ('search_instruments',
+    'search_parameters',
+    'search_streams',
+    'search_subsites',
+    'fuzzy_search',
+    'find_instruments',
+    'find_nodes',
+    'stream_to_instrument',
+    'parameter_to_streams',
+    'parameter_to_instruments',
+    'instrument_to_streams',
+    'streams_with_data',
+    'streams_active_at',
+    'query_instrument_deployments',
+    'query_deployments_batch',
+    'build_instrument_m2m_queries',
+    'build_parameter_m2m_queries')
+
+_QUERY_PROPERTIES = ('instruments',
+    'parameters',
+    'streams',
+    'subsites',
+    'toc',
+    'base_url',
+    'm2m_base_url')
+
+# Query string arguments that are converted before calling the M2mClient method
+_BOOLEAN_ARGS = ('metadata',
+    'time_check',
+    'exec_dpa',
+    'provenance',
+    'annotations',
+    'selogging',
+    'structured',
+    'exact')
+
+_INTEGER_ARGS = ('limit',
+    'time_delta_value',
+    'num_threads')
+
+_FLOAT_ARGS = ('min_fraction',
+    'min_score',
+    'time_budget')
+
+class M2mDaemon(object):
+    '''Resident service that keeps an M2mClient, its table of contents, indexes and
+    pooled HTTP connections warm and answers queries over a local HTTP endpoint.
+    Each M2mClient method or property is available as a path, with the method
+    keyword arguments passed as query string parameters:
+
+        http://127.0.0.1:8765/search_instruments?target_string=CE01ISSM
+
+    Responses are JSON objects containing the result or, on error, a message.
+    Requests are answered one at a time by the same M2mClient instance.
+
+    Parameters:
+        client: M2mClient instance used to answer the queries
+        host: interface to listen on (Default is 127.0.0.1)
+        port: port to listen on (Default is 8765)
+        refresh_interval: number of seconds after which the table of contents is
+            fetched again.  Default is to never refresh.
+    '''
+
+    def __init__(self, client, host='127.0.0.1', port=8765, refresh_interval=None):
+
+        self._client = client
+        self._host = host
+        self._port = port
+        self._refresh_interval = refresh_interval
+
+        self._logger = logging.getLogger(__name__)
+
+        self._server = None
+        self._start_time = None
+        self._toc_time = time.time()
+        self._num_queries = 0
+
+    @property
+    def client(self):
+        return self._client
+
+    @property
+    def url(self):
+        return 'http://{:s}:{:0.0f}'.format(self._host, self._port)
+
+    def status(self):
+        '''Return a dictionary describing the state of the service'''
+
+        uptime = 0
+        if self._start_time:
+            uptime = time.time() - self._start_time
+
+        return {'url' : self.url,
+            'base_url' : self._client.base_url,
+            'num_instruments' : len(self._client.instruments),
+            'num_queries' : self._num_queries,
+            'toc_age' : time.time() - self._toc_time,
+            'uptime' : uptime}
+
+    def query(self, name, **kwargs):
+        '''Call the M2mClient method or property name with the keyword arguments and
+        return the tuple (http_status_code, response), where response is a
+        dictionary containing the result or an error message'''
+
+        self._num_queries += 1
+
+        if name == 'status':
+            return 200, {'result' : self.status()}
+
+        if name == 'metrics':
+            return 200, {'result' : self._client.metrics.to_dict()}
+
+        if name == 'refresh_toc':
+            self._refresh_toc()
+            return 200, {'result' : self.status()}
+
+        if self._refresh_interval and time.time() - self._toc_time > self._refresh_interval:
+            self._refresh_toc()
+
+        if name in _QUERY_PROPERTIES:
+            return 200, {'result' : getattr(self._client, name)}
+
+        if name not in _QUERY_METHODS:
+            return 404, {'message' : 'Invalid query: {:s}'.format(name)}
+
+        try:
+            kwargs = _convert_args(kwargs)
+        except ValueError as e:
+            return 400, {'message' : 'Invalid argument: {:s}'.format(str(e))}
+
+        try:
+            result = getattr(self._client, name)(**kwargs)
+        except TypeError as e:
+            return 400, {'message' : str(e)}
+        except Exception as e:
+            # Keep the service up and report the failure to the caller
+            self._logger.exception('{:s}: {:s}'.format(name, str(e)))
+            return 500, {'message' : str(e)}
+
+        if name in ('build_instrument_m2m_queries', 'build_parameter_m2m_queries') and kwargs.get('structured'):
+            result = [r.to_dict() for r in result]
+
+        if name == 'query_instrument_deployments':
+            # Queries without events leave no raw events from a previous query
+            result = {'events' : result,
+                'raw_events' : self._client.selected_raw_deployment_events if result else []}
+
+        return 200, {'result' : result}
+
+    def warm(self):
+        '''Run one of each query to load anything that is built on first use'''
+
+        if not self._client.instruments:
+            self._logger.warning('No table of contents found')
+            return
+
+        instrument = self._client.instruments[0]
+        self._client.search_instruments(instrument)
+        for kind in FUZZY_SEARCH_KINDS:
+            self._client.fuzzy_search(instrument, kind=kind)
+        self._client.instrument_to_streams(instrument)
+        self._client.build_instrument_m2m_queries(instrument)
+
+    def serve_forever(self):
+        '''Listen for and answer queries until shutdown is called'''
+
+        self._server = HTTPServer((self._host, self._port), _M2mDaemonRequestHandler)
+        self._server.m2m_daemon = self
+        # Use the port assigned by the system if port 0 was requested
+        self._port = self._server.server_address[1]
+        self._start_time = time.time()
+
+        self._logger.info('Serving {:s} at {:s}'.format(self._client.base_url, self.url))
+
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def shutdown(self):
+        '''Stop serving queries'''
+
+        if self._server:
+            self._server.shutdown()
+
+    def _refresh_toc(self):
+
+        self._logger.info('Refreshing table of contents')
+        self._client.refresh_toc()
+        self._toc_time = time.time()
+
+    def __repr__(self):
+        return '<M2mDaemon(url={:s})>'.format(self.url)
+
+class _M2mDaemonRequestHandler(BaseHTTPRequestHandler):
+    '''Translates GET requests into M2mDaemon queries'''
+
+    def do_GET(self):
+
+        tokens = urlsplit(self.path)
+        name = tokens.path.strip('/')
+        kwargs = {k:v[-1] for k,v in parse_qs(tokens.query).items()}
+
+        status_code, response = self.server.m2m_daemon.query(name, **kwargs)
+
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format % args)
+
+def _convert_args(kwargs):
+
+    converted = {}
+    for k,v in kwargs.items():
+        if k in _BOOLEAN_ARGS:
+            converted[k] = v.lower() in ('true', '1', 'yes')
+        elif k in _INTEGER_ARGS:
+            converted[k] = int(v)
+        elif k in _FLOAT_ARGS:
+            converted[k] = float(v)
+        else:
+            converted[k] = v
+
+    return converted
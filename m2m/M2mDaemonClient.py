@@ -0,0 +1,212 @@
+import logging
+import requests
+from m2m.M2mRequest import M2mRequest
+
+HTTP_STATUS_OK = 200
+
+class M2mDaemonClient(object):
+    '''Thin client for a resident M2mDaemon.  Provides the M2mClient search, stream,
+    deployment and request building methods, which are answered by the daemon's
+    warm M2mClient instead of fetching and indexing the table of contents in this
+    process.
+
+    Parameters:
+        daemon_url: url of the M2mDaemon, i.e.: http://127.0.0.1:8765
+        timeout: timeout duration (Default is 120 seconds)
+    '''
+
+    def __init__(self, daemon_url, timeout=120):
+
+        self._daemon_url = daemon_url.strip('/')
+        self._timeout = timeout
+
+        self._logger = logging.getLogger(__name__)
+
+        self._session = requests.Session()
+
+        # Deployment events from the last query_instrument_deployments call
+        self._filtered_raw_events = []
+        self._instrument_deployment_events = []
+
+    @property
+    def daemon_url(self):
+        return self._daemon_url
+
+    @property
+    def base_url(self):
+        return self._query('base_url')
+
+    @property
+    def m2m_base_url(self):
+        return self._query('m2m_base_url')
+
+    @property
+    def toc(self):
+        return self._query('toc')
+
+    @property
+    def instruments(self):
+        return self._query('instruments') or []
+
+    @property
+    def parameters(self):
+        return self._query('parameters') or []
+
+    @property
+    def streams(self):
+        return self._query('streams') or {}
+
+    @property
+    def subsites(self):
+        return self._query('subsites') or []
+
+    @property
+    def instrument_deployment_events(self):
+        return self._instrument_deployment_events
+
+    @property
+    def selected_raw_deployment_events(self):
+        return self._filtered_raw_events
+
+    def status(self):
+        '''Return the daemon status or None if the daemon cannot be reached'''
+        return self._query('status')
+
+    def metrics(self):
+        '''Return the request and operation metrics collected by the daemon's client'''
+        return self._query('metrics')
+
+    def refresh_toc(self):
+        '''Ask the daemon to fetch a new copy of the table of contents'''
+        return self._query('refresh_toc')
+
+    def search_instruments(self, target_string, metadata=False):
+        return self._query('search_instruments', target_string=target_string, metadata=metadata) or []
+
+    def search_instruments_batch(self, target_strings, metadata=False):
+        for target_string in target_strings:
+            yield target_string, self.search_instruments(target_string, metadata=metadata)
+
+    def search_parameters(self, target_string, metadata=False):
+        return self._query('search_parameters', target_string=target_string, metadata=metadata) or []
+
+    def search_streams(self, target_stream, metadata=False):
+        return self._query('search_streams', target_stream=target_stream, metadata=metadata) or []
+
+    def search_subsites(self, target_subsite):
+        return self._query('search_subsites', target_subsite=target_subsite) or []
+
+    def fuzzy_search(self, target_string, kind='instruments', limit=10, min_score=0.5, time_budget=None):
+        return self._query('fuzzy_search', target_string=target_string, kind=kind, limit=limit, min_score=min_score, time_budget=time_budget) or []
+
+    def find_instruments(self, subsite=None, node=None, instrument_class=None):
+        return self._query('find_instruments', subsite=subsite, node=node, instrument_class=instrument_class) or []
+
+    def find_nodes(self, subsite=None):
+        return self._query('find_nodes', subsite=subsite) or []
+
+    def stream_to_instrument(self, target_stream, exact=False):
+        return self._query('stream_to_instrument', target_stream=target_stream, exact=exact) or []
+
+    def parameter_to_streams(self, parameter):
+        return self._query('parameter_to_streams', parameter=parameter) or []
+
+    def parameter_to_instruments(self, parameter):
+        return self._query('parameter_to_instruments', parameter=parameter) or []
+
+    def instrument_to_streams(self, reference_designator):
+        return self._query('instrument_to_streams', reference_designator=reference_designator) or []
+
+    def streams_with_data(self, begin_ts=None, end_ts=None, ref_des=None):
+        return self._query('streams_with_data', begin_ts=begin_ts, end_ts=end_ts, ref_des=ref_des) or []
+
+    def streams_active_at(self, ts, ref_des=None):
+        return self._query('streams_active_at', ts=ts, ref_des=ref_des) or []
+
+    def query_instrument_deployments(self, ref_des, ref_des_search_string=None, status=None):
+
+        self._filtered_raw_events = []
+        self._instrument_deployment_events = []
+
+        result = self._query('query_instrument_deployments',
+            ref_des=ref_des,
+            ref_des_search_string=ref_des_search_string,
+            status=status)
+        if not result or not result['events']:
+            return
+
+        self._filtered_raw_events = result['raw_events']
+        self._instrument_deployment_events = result['events']
+
+        return self._instrument_deployment_events
+
+    def query_deployments_batch(self, instruments=None, status=None, ref_des_search_string=None, min_fraction=None, num_threads=None):
+        '''Return the dictionary mapping each fully-qualified reference designator to
+        its deployment events, fetched by the daemon.  instruments must be a partial
+        or fully-qualified reference designator (Default is all instruments).
+        Other arguments are the same as M2mClient.query_deployments_batch'''
+
+        if isinstance(instruments, (list, tuple)):
+            self._logger.error('instruments must be a partial or fully-qualified reference designator')
+            return {}
+
+        return self._query('query_deployments_batch',
+            instruments=instruments,
+            status=status,
+            ref_des_search_string=ref_des_search_string,
+            min_fraction=min_fraction,
+            num_threads=num_threads) or {}
+
+    def build_instrument_m2m_queries(self, ref_des, **kwargs):
+        '''Return the list of request urls built by the daemon.  Keyword arguments
+        are the same as M2mClient.build_instrument_m2m_queries'''
+
+        result = self._query('build_instrument_m2m_queries', ref_des=ref_des, **kwargs) or []
+        if kwargs.get('structured'):
+            return [M2mRequest.from_dict(r) for r in result]
+
+        return result
+
+    def build_parameter_m2m_queries(self, parameter, **kwargs):
+        '''Return the list of request urls built by the daemon for a single
+        parameter.  Keyword arguments are the same as
+        M2mClient.build_parameter_m2m_queries'''
+
+        result = self._query('build_parameter_m2m_queries', parameters=parameter, **kwargs) or []
+        if kwargs.get('structured'):
+            return [M2mRequest.from_dict(r) for r in result]
+
+        return result
+
+    def _query(self, name, **kwargs):
+        '''Send the query to the daemon and return the result or None on error'''
+
+        params = {}
+        for k,v in kwargs.items():
+            if v is None:
+                continue
+            if type(v) == bool:
+                v = str(v).lower()
+            params[k] = v
+
+        url = '{:s}/{:s}'.format(self._daemon_url, name)
+        try:
+            r = self._session.get(url, params=params, timeout=self._timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            self._logger.error('{:s}: {:s}'.format(str(e), url))
+            return
+
+        try:
+            response = r.json()
+        except ValueError as e:
+            self._logger.error('{:s}: {:s}'.format(str(e), url))
+            return
+
+        if r.status_code != HTTP_STATUS_OK:
+            self._logger.warning(response['message'])
+            return
+
+        return response['result']
+
+    def __repr__(self):
+        return '<M2mDaemonClient(url={:s})>'.format(self._daemon_url)
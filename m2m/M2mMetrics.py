@@ -0,0 +1,332 @@
+import logging
+import json
+import os
+import time
+import threading
+import functools
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Trace hooks called for every M2mMetrics instance
+_global_trace_hooks = []
+
+class M2mMetrics(object):
+    '''Collects request and operation metrics for an M2mClient: latency histograms,
+    response counts by status code, bytes received and retries for each m2m port and
+    endpoint, and the time spent in operations such as building the table of
+    contents and searching.
+
+    Trace hooks, added with add_trace_hook, are called with the arguments (name,
+    start_time, duration, attributes) when each request or timed operation
+    completes.  Exporters, added with add_exporter, are objects with an
+    export(metrics) method and are called by export.
+
+    Parameters:
+        buckets: upper bounds, in seconds, of the latency histogram buckets
+    '''
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+
+        self._buckets = tuple(sorted(buckets))
+
+        self._logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._trace_hooks = []
+        self._exporters = []
+
+        self.reset()
+
+    @property
+    def buckets(self):
+        return self._buckets
+
+    def reset(self):
+        '''Clear all collected metrics'''
+
+        with self._lock:
+            # Keyed by (port, endpoint)
+            self._request_latency = {}
+            self._response_bytes = {}
+            self._retries = {}
+            # Keyed by (port, endpoint, status_code)
+            self._responses = {}
+            # Keyed by operation name
+            self._operations = {}
+
+    def add_trace_hook(self, hook):
+        '''Call hook(name, start_time, duration, attributes) on completion of each
+        request and timed operation'''
+        self._trace_hooks.append(hook)
+
+    def remove_trace_hook(self, hook):
+        self._trace_hooks.remove(hook)
+
+    def add_exporter(self, exporter):
+        '''Add an exporter, an object with an export(metrics) method, called by
+        export'''
+        self._exporters.append(exporter)
+
+    def export(self):
+        '''Export the metrics with each of the exporters'''
+
+        for exporter in self._exporters:
+            exporter.export(self)
+
+    def observe_request(self, port, end_point, status_code, start_time, duration, num_bytes=0):
+        '''Record a completed m2m request.  status_code is None if no response was
+        received.
+
+        Parameters:
+            port: m2m port the request was sent to
+            end_point: request end point, which is reduced to a low-cardinality
+                endpoint label
+            status_code: HTTP status code of the response
+            start_time: time the request was sent, in seconds since the epoch
+            duration: request duration, in seconds
+            num_bytes: number of bytes in the response body
+        '''
+
+        key = (str(port), endpoint_label(end_point))
+        status = str(status_code or 'error')
+
+        with self._lock:
+            if key not in self._request_latency:
+                self._request_latency[key] = _Histogram(self._buckets)
+            self._request_latency[key].observe(duration)
+            self._response_bytes[key] = self._response_bytes.get(key, 0) + num_bytes
+            response_key = key + (status,)
+            self._responses[response_key] = self._responses.get(response_key, 0) + 1
+
+        self._trace('request', start_time, duration, {'port' : key[0],
+            'endpoint' : key[1],
+            'status_code' : status,
+            'bytes' : num_bytes})
+
+    def observe_retry(self, port, end_point):
+        '''Record a retried m2m request'''
+
+        key = (str(port), endpoint_label(end_point))
+        with self._lock:
+            self._retries[key] = self._retries.get(key, 0) + 1
+
+    def observe_operation(self, name, start_time, duration):
+        '''Record the duration of a completed operation'''
+
+        with self._lock:
+            if name not in self._operations:
+                self._operations[name] = _Histogram(self._buckets)
+            self._operations[name].observe(duration)
+
+        self._trace(name, start_time, duration, {})
+
+    @contextmanager
+    def timer(self, name):
+        '''Context manager recording the time spent in the block as operation name'''
+
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.observe_operation(name, start_time, time.time() - start_time)
+
+    def operation_seconds(self, name):
+        '''Return the total number of seconds spent in operation name'''
+
+        with self._lock:
+            if name not in self._operations:
+                return 0
+            return self._operations[name].sum
+
+    def to_dict(self):
+        '''Return a snapshot of the metrics as a JSON serializable dictionary'''
+
+        with self._lock:
+            requests = []
+            for (port, endpoint) in sorted(self._request_latency.keys()):
+                key = (port, endpoint)
+                requests.append({'port' : port,
+                    'endpoint' : endpoint,
+                    'latency' : self._request_latency[key].to_dict(),
+                    'bytes' : self._response_bytes.get(key, 0),
+                    'retries' : self._retries.get(key, 0),
+                    'status_codes' : {s:n for ((p, e, s), n) in self._responses.items() if (p, e) == key}})
+
+            operations = {name:h.to_dict() for (name, h) in self._operations.items()}
+
+        return {'requests' : requests,
+            'operations' : operations}
+
+    def to_prometheus(self, prefix='m2m'):
+        '''Return the metrics in the Prometheus text exposition format'''
+
+        lines = []
+
+        with self._lock:
+            lines.append('# HELP {:s}_request_duration_seconds UFrame m2m request latency'.format(prefix))
+            lines.append('# TYPE {:s}_request_duration_seconds histogram'.format(prefix))
+            for (port, endpoint) in sorted(self._request_latency.keys()):
+                labels = 'port="{:s}",endpoint="{:s}"'.format(port, endpoint)
+                lines = lines + self._request_latency[(port, endpoint)].to_prometheus('{:s}_request_duration_seconds'.format(prefix), labels)
+
+            lines.append('# HELP {:s}_responses_total UFrame m2m responses by HTTP status code'.format(prefix))
+            lines.append('# TYPE {:s}_responses_total counter'.format(prefix))
+            for (port, endpoint, status) in sorted(self._responses.keys()):
+                lines.append('{:s}_responses_total{{port="{:s}",endpoint="{:s}",status_code="{:s}"}} {:0.0f}'.format(prefix, port, endpoint, status, self._responses[(port, endpoint, status)]))
+
+            lines.append('# HELP {:s}_response_bytes_total UFrame m2m response body bytes'.format(prefix))
+            lines.append('# TYPE {:s}_response_bytes_total counter'.format(prefix))
+            for (port, endpoint) in sorted(self._response_bytes.keys()):
+                lines.append('{:s}_response_bytes_total{{port="{:s}",endpoint="{:s}"}} {:0.0f}'.format(prefix, port, endpoint, self._response_bytes[(port, endpoint)]))
+
+            lines.append('# HELP {:s}_retries_total Retried UFrame m2m requests'.format(prefix))
+            lines.append('# TYPE {:s}_retries_total counter'.format(prefix))
+            for (port, endpoint) in sorted(self._retries.keys()):
+                lines.append('{:s}_retries_total{{port="{:s}",endpoint="{:s}"}} {:0.0f}'.format(prefix, port, endpoint, self._retries[(port, endpoint)]))
+
+            lines.append('# HELP {:s}_operation_duration_seconds Time spent in M2mClient operations'.format(prefix))
+            lines.append('# TYPE {:s}_operation_duration_seconds histogram'.format(prefix))
+            for name in sorted(self._operations.keys()):
+                labels = 'operation="{:s}"'.format(name)
+                lines = lines + self._operations[name].to_prometheus('{:s}_operation_duration_seconds'.format(prefix), labels)
+
+        return '\n'.join(lines) + '\n'
+
+    def _trace(self, name, start_time, duration, attributes):
+
+        for hook in self._trace_hooks + _global_trace_hooks:
+            try:
+                hook(name, start_time, duration, attributes)
+            except Exception as e:
+                # A failing hook must not break the request
+                self._logger.error('Trace hook failed: {:s}'.format(str(e)))
+
+    def __repr__(self):
+        return '<M2mMetrics(endpoints={:0.0f}, operations={:0.0f})>'.format(len(self._request_latency), len(self._operations))
+
+class JsonMetricsExporter(object):
+    '''Writes the metrics to a JSON file
+
+    Parameters:
+        path: name of the JSON file
+    '''
+
+    def __init__(self, path):
+        self._path = path
+
+    def export(self, metrics):
+        _write_atomic(self._path, json.dumps(metrics.to_dict(), indent=1, sort_keys=True))
+
+class PrometheusTextExporter(object):
+    '''Writes the metrics to a file in the Prometheus text exposition format, as
+    read by the node_exporter textfile collector
+
+    Parameters:
+        path: name of the .prom file
+        prefix: prefix for the metric names (Default is m2m)
+    '''
+
+    def __init__(self, path, prefix='m2m'):
+        self._path = path
+        self._prefix = prefix
+
+    def export(self, metrics):
+        _write_atomic(self._path, metrics.to_prometheus(prefix=self._prefix))
+
+def add_global_trace_hook(hook):
+    '''Call hook(name, start_time, duration, attributes) on completion of each
+    request and timed operation recorded by any M2mMetrics instance'''
+    _global_trace_hooks.append(hook)
+
+def remove_global_trace_hook(hook):
+    _global_trace_hooks.remove(hook)
+
+def exporter_for_file(path):
+    '''Return a PrometheusTextExporter for .prom files or a JsonMetricsExporter for
+    any other file'''
+
+    if path.endswith('.prom'):
+        return PrometheusTextExporter(path)
+
+    return JsonMetricsExporter(path)
+
+def timed(name):
+    '''Decorator recording the duration of each call of an M2mClient method as
+    operation name in the instance's metrics'''
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self._metrics.timer(name):
+                return func(self, *args, **kwargs)
+        return wrapper
+
+    return decorator
+
+def endpoint_label(end_point):
+    '''Reduce an m2m end point to a low-cardinality label: the query string is
+    removed, stream data requests are collapsed to sensor/inv/* and asynchronous
+    request output files to async_results/*'''
+
+    path = end_point.split('?')[0].strip('/')
+    tokens = path.split('/')
+    if tokens[:2] == ['sensor', 'inv'] and len(tokens) > 3:
+        return 'sensor/inv/*'
+    if tokens[0] == 'async_results' and len(tokens) > 1:
+        return 'async_results/*'
+
+    return path
+
+class _Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def observe(self, value):
+
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def to_dict(self):
+
+        mean = 0
+        if self.count:
+            mean = self.sum / self.count
+
+        return {'count' : self.count,
+            'sum' : self.sum,
+            'mean' : mean,
+            'max' : self.max,
+            'buckets' : [[bound, n] for (bound, n) in zip(list(self.buckets) + ['+Inf'], self.counts)]}
+
+    def to_prometheus(self, name, labels):
+
+        lines = []
+        cumulative = 0
+        for (bound, n) in zip(list(self.buckets) + ['+Inf'], self.counts):
+            cumulative += n
+            lines.append('{:s}_bucket{{{:s},le="{:s}"}} {:0.0f}'.format(name, labels, str(bound), cumulative))
+        lines.append('{:s}_sum{{{:s}}} {:0.6f}'.format(name, labels, self.sum))
+        lines.append('{:s}_count{{{:s}}} {:0.0f}'.format(name, labels, self.count))
+
+        return lines
+
+def _write_atomic(path, text):
+
+    tmp_path = '{:s}.tmp'.format(path)
+    with open(tmp_path, 'w') as fid:
+        fid.write(text)
+    os.rename(tmp_path, path)
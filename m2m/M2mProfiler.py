@@ -0,0 +1,283 @@
+import logging
+import os
+import sys
+import time
+import threading
+from contextlib import contextmanager
+from m2m.M2mMetrics import add_global_trace_hook, remove_global_trace_hook
+
+# Report order of the phases
+PHASES = ('toc_fetch',
+    'http_request',
+    'json_decode',
+    'toc_index',
+    'search',
+    'date_parse',
+    'url_format',
+    'output',
+    'other')
+
+# M2mClient timed operations reported in the search phase
+_SEARCH_OPERATIONS = ('search_instruments',
+    'search_parameters',
+    'search_streams',
+    'search_subsites',
+    'fuzzy_search',
+    'stream_to_instrument')
+
+# M2mClient timed operations reported under their own name
+_PHASE_OPERATIONS = ('json_decode',
+    'toc_index',
+    'date_parse',
+    'url_format')
+
+# Profiler started by profile_main
+_active_profiler = None
+
+class M2mProfiler(object):
+    '''Records the wall time spent in each phase of a script run: fetching the
+    table of contents, other m2m requests, JSON decoding, building the table of
+    contents indexes, searching, date parsing, url formatting and writing output.
+    Time not spent in any of these is reported as other.
+
+    Phases are measured from the trace spans of every M2mMetrics instance,
+    blocks wrapped in phase and writes to sys.stdout.  Optionally, a cProfile
+    dump, readable with the pstats module or snakeviz, and a collapsed stack file,
+    readable with flamegraph.pl or speedscope, are written when the profiler is
+    stopped.
+
+    Parameters:
+        pstats_file: name of the cProfile stats file to write
+        stacks_file: name of the collapsed stack file to write
+        sample_interval: seconds between stack samples (Default is 0.001)
+    '''
+
+    def __init__(self, pstats_file=None, stacks_file=None, sample_interval=0.001):
+
+        self._pstats_file = pstats_file
+        self._stacks_file = stacks_file
+        self._sample_interval = sample_interval
+
+        self._logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._phase_seconds = {}
+        self._phase_counts = {}
+        self._start_time = None
+        self._stop_time = None
+
+        self._profile = None
+        self._sampler = None
+        self._sampling = False
+        self._stacks = {}
+        self._stdout = None
+
+    @property
+    def total_seconds(self):
+        if not self._start_time:
+            return 0
+
+        return (self._stop_time or time.time()) - self._start_time
+
+    def start(self):
+        '''Start recording'''
+
+        self._start_time = time.time()
+        self._stop_time = None
+
+        add_global_trace_hook(self._on_span)
+
+        # Time everything written to STDOUT as output
+        self._stdout = sys.stdout
+        sys.stdout = _TimedStream(sys.stdout, self)
+
+        if self._stacks_file:
+            self._sampling = True
+            self._sampler = threading.Thread(target=self._sample_stacks)
+            self._sampler.daemon = True
+            self._sampler.start()
+
+        if self._pstats_file:
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop(self):
+        '''Stop recording and write the cProfile and collapsed stack files'''
+
+        if self._profile:
+            self._profile.disable()
+
+        if self._sampler:
+            self._sampling = False
+            self._sampler.join()
+            self._sampler = None
+
+        sys.stdout = self._stdout
+        remove_global_trace_hook(self._on_span)
+
+        self._stop_time = time.time()
+
+        if self._profile:
+            self._profile.dump_stats(self._pstats_file)
+            self._logger.info('cProfile stats written: {:s}'.format(self._pstats_file))
+            self._profile = None
+
+        if self._stacks_file:
+            try:
+                with open(self._stacks_file, 'w') as fid:
+                    for stack in sorted(self._stacks.keys()):
+                        fid.write('{:s} {:0.0f}\n'.format(stack, self._stacks[stack]))
+            except (IOError, OSError) as e:
+                self._logger.error(e)
+                return
+            self._logger.info('Collapsed stacks written: {:s}'.format(self._stacks_file))
+
+    @contextmanager
+    def phase(self, name):
+        '''Context manager adding the time spent in the block to phase name'''
+
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.time() - start_time)
+
+    def add_time(self, name, seconds):
+        '''Add seconds to phase name'''
+
+        with self._lock:
+            self._phase_seconds[name] = self._phase_seconds.get(name, 0) + seconds
+            self._phase_counts[name] = self._phase_counts.get(name, 0) + 1
+
+    def report(self):
+        '''Return the list of (phase, seconds, count) tuples, in PHASES order, with
+        the time not spent in any other phase reported as other'''
+
+        total = self.total_seconds
+
+        with self._lock:
+            phase_seconds = dict(self._phase_seconds)
+            phase_counts = dict(self._phase_counts)
+
+        measured = sum(phase_seconds.values())
+        phase_seconds['other'] = max(0, total - measured)
+        phase_counts['other'] = 0
+
+        return [(p, phase_seconds.get(p, 0), phase_counts.get(p, 0)) for p in PHASES]
+
+    def write_report(self, stream=None):
+        '''Write the phase report to stream (Default is sys.stderr)'''
+
+        stream = stream or sys.stderr
+
+        total = self.total_seconds
+
+        stream.write('{:<14s}{:>12s}{:>9s}{:>10s}\n'.format('phase', 'seconds', 'percent', 'count'))
+        for (phase, seconds, count) in self.report():
+            percent = 0
+            if total:
+                percent = 100 * seconds / total
+            stream.write('{:<14s}{:>12.6f}{:>8.1f}%{:>10.0f}\n'.format(phase, seconds, percent, count))
+        stream.write('{:<14s}{:>12.6f}\n'.format('total', total))
+
+    def _on_span(self, name, start_time, duration, attributes):
+        '''M2mMetrics trace hook mapping request and operation spans to phases'''
+
+        if name == 'request':
+            if attributes.get('endpoint') == 'sensor/inv/toc':
+                self.add_time('toc_fetch', duration)
+            else:
+                self.add_time('http_request', duration)
+        elif name in _SEARCH_OPERATIONS:
+            self.add_time('search', duration)
+        elif name in _PHASE_OPERATIONS:
+            self.add_time(name, duration)
+
+    def _sample_stacks(self):
+        '''Periodically record the call stack of every other thread'''
+
+        sampler_id = threading.current_thread().ident
+
+        while self._sampling:
+            for (thread_id, frame) in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{:s} ({:s}:{:0.0f})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                    frame = frame.f_back
+                key = ';'.join(reversed(stack))
+                self._stacks[key] = self._stacks.get(key, 0) + 1
+            time.sleep(self._sample_interval)
+
+    def __repr__(self):
+        return '<M2mProfiler(seconds={:0.3f})>'.format(self.total_seconds)
+
+class _TimedStream(object):
+    '''File object wrapper adding the time spent writing to the output phase'''
+
+    def __init__(self, stream, profiler):
+        self._stream = stream
+        self._profiler = profiler
+
+    def write(self, text):
+        with self._profiler.phase('output'):
+            return self._stream.write(text)
+
+    def writelines(self, lines):
+        with self._profiler.phase('output'):
+            return self._stream.writelines(lines)
+
+    def flush(self):
+        with self._profiler.phase('output'):
+            return self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+@contextmanager
+def phase(name):
+    '''Context manager adding the time spent in the block to phase name of the
+    profiler started by profile_main.  Does nothing if no profiler is running.'''
+
+    if not _active_profiler:
+        yield
+        return
+
+    with _active_profiler.phase(name):
+        yield
+
+def add_profile_arguments(arg_parser):
+    '''Add the --profile, --profile_pstats and --profile_stacks options to the
+    argparse.ArgumentParser'''
+
+    arg_parser.add_argument('--profile',
+        action='store_true',
+        help='Write the wall time spent in each phase of the run to STDERR')
+    arg_parser.add_argument('--profile_pstats',
+        help='Write cProfile stats to this file.  Implies --profile')
+    arg_parser.add_argument('--profile_stacks',
+        help='Write sampled call stacks, in the collapsed format used by flamegraph.pl, to this file.  Implies --profile')
+
+def profile_main(main, args):
+    '''Return main(args), profiled if the --profile, --profile_pstats or
+    --profile_stacks options were specified'''
+
+    global _active_profiler
+
+    if not args.profile and not args.profile_pstats and not args.profile_stacks:
+        return main(args)
+
+    profiler = M2mProfiler(pstats_file=args.profile_pstats, stacks_file=args.profile_stacks)
+    _active_profiler = profiler
+    profiler.start()
+    try:
+        status = main(args)
+    finally:
+        profiler.stop()
+        _active_profiler = None
+        profiler.write_report()
+
+    return status
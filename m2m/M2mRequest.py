@@ -0,0 +1,273 @@
+import logging
+import json
+import csv
+
+try:
+    from urlparse import urlsplit, parse_qs
+except ImportError:
+    from urllib.parse import urlsplit, parse_qs
+
+# Query string parameters, in url order, following beginDT and endDT
+OPTION_KEYS = ('format',
+    'limit',
+    'execDPA',
+    'include_provenance',
+    'selogging',
+    'user',
+    'email')
+
+# Columns of the JSON Lines and CSV request files
+FIELDS = ('port',
+    'subsite',
+    'node',
+    'sensor',
+    'method',
+    'stream',
+    'beginDT',
+    'endDT') + OPTION_KEYS
+
+FILE_FORMATS = ('jsonl',
+    'csv',
+    'url')
+
+_logger = logging.getLogger(__name__)
+
+class M2mRequest(object):
+    '''Stream data request, as created by M2mClient.build_instrument_m2m_queries with
+    structured=True.  Requests are sent directly with M2mClient.send_m2m_request,
+    without formatting and parsing a url, and are written to and read from JSON
+    Lines or CSV files with write_requests and read_requests.
+
+    Parameters:
+        port: m2m port the request is sent to (12576)
+        subsite: reference designator subsite
+        node: reference designator node
+        sensor: reference designator port and instrument (i.e.: 01-CTDBPC000)
+        method: stream delivery method
+        stream: stream name
+        begin_dt: ISO-8601 formatted request start time
+        end_dt: ISO-8601 formatted request end time
+        options: dictionary of the remaining query string parameters (format,
+            limit, execDPA, include_provenance, selogging, user, email).  The
+            dictionary may be shared by many requests and must not be modified.
+    '''
+
+    __slots__ = ('port',
+        'subsite',
+        'node',
+        'sensor',
+        'method',
+        'stream',
+        'begin_dt',
+        'end_dt',
+        'options')
+
+    def __init__(self, port, subsite, node, sensor, method, stream, begin_dt, end_dt, options=None):
+
+        self.port = port
+        self.subsite = subsite
+        self.node = node
+        self.sensor = sensor
+        self.method = method
+        self.stream = stream
+        self.begin_dt = begin_dt
+        self.end_dt = end_dt
+        self.options = options or {}
+
+    @property
+    def reference_designator(self):
+        return '{:s}-{:s}-{:s}'.format(self.subsite, self.node, self.sensor)
+
+    @property
+    def end_point(self):
+        '''Request end point, including the query string, relative to the port'''
+
+        query = ['beginDT={:s}'.format(self.begin_dt), 'endDT={:s}'.format(self.end_dt)]
+        for k in OPTION_KEYS:
+            v = self.options.get(k)
+            if v is None:
+                continue
+            query.append('{:s}={:s}'.format(k, str(v)))
+
+        return 'sensor/inv/{:s}/{:s}/{:s}/{:s}/{:s}?{:s}'.format(self.subsite,
+            self.node,
+            self.sensor,
+            self.method,
+            self.stream,
+            '&'.join(query))
+
+    def url(self, m2m_base_url):
+        '''Return the request url for the m2m_base_url UFrame instance'''
+
+        return '{:s}/{:0.0f}/{:s}'.format(m2m_base_url, self.port, self.end_point)
+
+    def to_dict(self):
+        '''Return the request as a flat dictionary keyed by FIELDS'''
+
+        request = {'port' : self.port,
+            'subsite' : self.subsite,
+            'node' : self.node,
+            'sensor' : self.sensor,
+            'method' : self.method,
+            'stream' : self.stream,
+            'beginDT' : self.begin_dt,
+            'endDT' : self.end_dt}
+        for k in OPTION_KEYS:
+            if self.options.get(k) is not None:
+                request[k] = self.options[k]
+
+        return request
+
+    @classmethod
+    def from_dict(cls, request):
+        '''Create a request from a dictionary returned by to_dict.  Empty option
+        values, as written to CSV files, are ignored.'''
+
+        options = {}
+        for k in OPTION_KEYS:
+            v = request.get(k)
+            if v is None or v == '':
+                continue
+            options[k] = v
+        if 'limit' in options:
+            options['limit'] = int(options['limit'])
+
+        return cls(int(request['port']),
+            request['subsite'],
+            request['node'],
+            request['sensor'],
+            request['method'],
+            request['stream'],
+            request['beginDT'],
+            request['endDT'],
+            options)
+
+    @classmethod
+    def from_url(cls, url):
+        '''Create a request from a stream request url.  Returns None if url is not
+        a stream request url.'''
+
+        tokens = urlsplit(url.strip())
+
+        path_tokens = tokens.path.strip('/').split('/')
+        try:
+            i = path_tokens.index('sensor')
+            port = int(path_tokens[i-1])
+        except (ValueError, IndexError):
+            return
+
+        path_tokens = path_tokens[i+2:]
+        if len(path_tokens) != 5:
+            return
+
+        query = parse_qs(tokens.query)
+        if 'beginDT' not in query or 'endDT' not in query:
+            return
+
+        options = {k:query[k][-1] for k in OPTION_KEYS if k in query}
+        if 'limit' in options:
+            options['limit'] = int(options['limit'])
+
+        return cls(port,
+            path_tokens[0],
+            path_tokens[1],
+            path_tokens[2],
+            path_tokens[3],
+            path_tokens[4],
+            query['beginDT'][-1],
+            query['endDT'][-1],
+            options)
+
+    def __eq__(self, other):
+        if not isinstance(other, M2mRequest):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __repr__(self):
+        return '<M2mRequest(reference_designator={:s}, method={:s}, stream={:s}, beginDT={:s}, endDT={:s})>'.format(self.reference_designator, self.method, self.stream, self.begin_dt, self.end_dt)
+
+def write_requests(requests, fid, file_format='jsonl', m2m_base_url=None, header=True):
+    '''Write the M2mRequest instances to the open file fid and return the number of
+    requests written.
+
+    Parameters:
+        requests: iterable of M2mRequest instances
+        fid: open file object
+        file_format: 'jsonl' (one JSON object per line), 'csv' (header row
+            followed by one row per request) or 'url' (one url per line, which
+            requires m2m_base_url).  Default is 'jsonl'.
+        m2m_base_url: m2m base url of the UFrame instance used for 'url'
+        header: write the CSV header row before the first request (Default is
+            True).  Set to False when appending to a CSV file that already
+            contains the header.
+    '''
+
+    if file_format not in FILE_FORMATS:
+        raise ValueError('Invalid request file format: {:s}'.format(file_format))
+
+    if file_format == 'url' and not m2m_base_url:
+        raise ValueError('m2m_base_url is required to write urls')
+
+    csv_writer = None
+    if file_format == 'csv':
+        csv_writer = csv.writer(fid)
+
+    num_requests = 0
+    for request in requests:
+        if file_format == 'jsonl':
+            fid.write('{:s}\n'.format(json.dumps(request.to_dict(), sort_keys=True)))
+        elif file_format == 'csv':
+            if header and not num_requests:
+                csv_writer.writerow(FIELDS)
+            row = request.to_dict()
+            csv_writer.writerow([row.get(k, '') for k in FIELDS])
+        else:
+            fid.write('{:s}\n'.format(request.url(m2m_base_url)))
+        num_requests += 1
+
+    return num_requests
+
+def read_requests(fid, file_format='jsonl'):
+    '''Generator yielding the M2mRequest instances read from the open file fid.
+    Blank lines are skipped and invalid lines are logged and skipped.
+
+    Parameters:
+        fid: open file object
+        file_format: 'jsonl', 'csv' or 'url', as written by write_requests.
+            Default is 'jsonl'.
+    '''
+
+    if file_format not in FILE_FORMATS:
+        raise ValueError('Invalid request file format: {:s}'.format(file_format))
+
+    if file_format == 'csv':
+        for row in csv.DictReader(fid):
+            try:
+                yield M2mRequest.from_dict(row)
+            except (KeyError, TypeError, ValueError) as e:
+                _logger.warning('Invalid request row: {:s} ({:s})'.format(str(row), str(e)))
+        return
+
+    for line in fid:
+        line = line.strip()
+        if not line:
+            continue
+
+        if file_format == 'url':
+            request = M2mRequest.from_url(line)
+            if not request:
+                _logger.warning('Not a stream request url: {:s}'.format(line))
+                continue
+            yield request
+            continue
+
+        try:
+            yield M2mRequest.from_dict(json.loads(line))
+        except (KeyError, TypeError, ValueError) as e:
+            _logger.warning('Invalid request: {:s} ({:s})'.format(line, str(e)))
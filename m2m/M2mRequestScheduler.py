@@ -0,0 +1,353 @@
+import logging
+import threading
+import time
+from collections import deque
+
+try:
+    from urlparse import urlsplit, parse_qs
+except ImportError:
+    from urllib.parse import urlsplit, parse_qs
+
+from m2m.M2mRequest import M2mRequest
+
+# Priority classes, highest first.  Queued jobs of a higher class are always
+# started before those of a lower class.
+PRIORITIES = ('interactive',
+    'default',
+    'bulk')
+
+# Fair share key of jobs submitted without a user
+ANONYMOUS_USER = '_nouser'
+
+class M2mRequestScheduler(object):
+    '''Runs M2mClient calls and data requests from a pool of worker threads, in
+    priority order, so that interactive lookups sharing a client with large
+    request batches are not queued behind them.  Each job belongs to one of the
+    PRIORITIES classes and a user.  Queued jobs of a higher class are always
+    started first and, within a class, the users with queued jobs take turns, one
+    job at a time, so a user submitting thousands of requests does not hold up the
+    others.  Data requests are shared by the user query string parameter.
+
+    reserved_threads of the num_threads workers only run interactive jobs, so an
+    interactive job starts as soon as it is submitted even when every other
+    worker is waiting on a slow data request.  The remaining workers run jobs of
+    any class and keep the bulk requests flowing when there is no interactive
+    work.
+
+    Client methods return the results of their own call when run from several
+    workers at once, but the properties describing the last request or
+    deployment query (last_m2m_request, last_m2m_response,
+    instrument_deployment_events, selected_raw_deployment_events) hold those of
+    whichever job finished last: use the job results instead.
+
+    Parameters:
+        client: M2mClient instance used to run the jobs
+        num_threads: number of worker threads (Default is 4)
+        reserved_threads: number of workers that only run interactive jobs
+            (Default is 1)
+    '''
+
+    def __init__(self, client, num_threads=4, reserved_threads=1):
+
+        if num_threads < 1:
+            raise ValueError('num_threads must be at least 1')
+        if reserved_threads < 0 or reserved_threads >= num_threads:
+            raise ValueError('reserved_threads must be between 0 and num_threads - 1')
+
+        self._client = client
+        self._num_threads = num_threads
+        self._reserved_threads = reserved_threads
+
+        self._logger = logging.getLogger(__name__)
+
+        self._condition = threading.Condition()
+        # Queued jobs of each priority class, by user, and the users with queued
+        # jobs in the order they are served
+        self._queues = {p:{} for p in PRIORITIES}
+        self._turns = {p:deque() for p in PRIORITIES}
+        self._num_queued = {p:0 for p in PRIORITIES}
+        self._num_running = {p:0 for p in PRIORITIES}
+        self._num_completed = {p:0 for p in PRIORITIES}
+        self._wait_seconds = {p:0. for p in PRIORITIES}
+        self._closed = False
+
+        self._threads = []
+        for i in range(num_threads):
+            thread = threading.Thread(target=self._work, args=(i < reserved_threads,))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def client(self):
+        return self._client
+
+    @property
+    def num_threads(self):
+        return self._num_threads
+
+    @property
+    def reserved_threads(self):
+        return self._reserved_threads
+
+    def submit(self, func, args=(), kwargs=None, priority='default', user=None):
+        '''Queue the call func(*args, **kwargs) and return its M2mJob
+
+        Parameters:
+            func: callable to run, i.e.: an M2mClient method
+            args: tuple of positional arguments
+            kwargs: dictionary of keyword arguments
+            priority: one of PRIORITIES (Default is default)
+            user: user the job is shared by.  Default is ANONYMOUS_USER
+        '''
+
+        if priority not in PRIORITIES:
+            raise ValueError('Invalid priority: {:s}'.format(priority))
+
+        job = M2mJob(func, args, kwargs or {}, priority, user or ANONYMOUS_USER)
+
+        with self._condition:
+            if self._closed:
+                raise ValueError('Scheduler is closed')
+            queues = self._queues[priority]
+            if job.user not in queues:
+                queues[job.user] = deque()
+                self._turns[priority].append(job.user)
+            queues[job.user].append(job)
+            self._num_queued[priority] += 1
+            self._condition.notify_all()
+
+        return job
+
+    def call(self, name, *args, **kwargs):
+        '''Run the M2mClient method name as an interactive job and return its
+        result, i.e.: scheduler.call('search_instruments', 'CE01ISSM')'''
+
+        return self.submit(getattr(self._client, name), args, kwargs, priority='interactive').result()
+
+    def send_m2m_request(self, url, priority='bulk', user=None):
+        '''Queue the data request url or M2mRequest, sent with
+        M2mClient.send_m2m_request, and return its M2mJob.  user defaults to the
+        user query string parameter of the request.'''
+
+        if user is None:
+            user = request_user(url)
+
+        return self.submit(self._client.send_m2m_request, (url,), priority=priority, user=user)
+
+    def send_m2m_requests(self, urls, priority='bulk'):
+        '''Queue all of the data requests and yield the (url, response) tuple of
+        each, in request order, as they complete'''
+
+        jobs = [(url, self.send_m2m_request(url, priority=priority)) for url in urls]
+        for (url, job) in jobs:
+            yield url, job.result()
+
+    def stats(self):
+        '''Return a dictionary mapping each priority class to the number of queued,
+        running and completed jobs, the mean number of seconds completed jobs were
+        queued for and the number of jobs queued by each user'''
+
+        stats = {}
+        with self._condition:
+            for p in PRIORITIES:
+                num_completed = self._num_completed[p]
+                stats[p] = {'queued' : self._num_queued[p],
+                    'running' : self._num_running[p],
+                    'completed' : num_completed,
+                    'mean_wait' : self._wait_seconds[p] / num_completed if num_completed else 0.,
+                    'users' : {u:len(q) for (u, q) in self._queues[p].items()}}
+
+        return stats
+
+    def close(self, cancel=False):
+        '''Stop accepting jobs and wait for the workers to finish.  Queued jobs are
+        run first, unless cancel is True, in which case they are cancelled and
+        their result is None.'''
+
+        with self._condition:
+            self._closed = True
+            if cancel:
+                for p in PRIORITIES:
+                    for queue in self._queues[p].values():
+                        for job in queue:
+                            job._cancel()
+                    self._queues[p] = {}
+                    self._turns[p].clear()
+                    self._num_queued[p] = 0
+            self._condition.notify_all()
+
+        for thread in self._threads:
+            thread.join()
+
+    def _next_job(self, interactive_only):
+        '''Remove and return the next job to run, taking turns between the users of
+        the highest priority class with queued jobs, or None if there are none.
+        Must be called with the condition held.'''
+
+        for p in PRIORITIES:
+            if interactive_only and p != 'interactive':
+                break
+            turns = self._turns[p]
+            if not turns:
+                continue
+            user = turns.popleft()
+            queue = self._queues[p][user]
+            job = queue.popleft()
+            if queue:
+                turns.append(user)
+            else:
+                del self._queues[p][user]
+            self._num_queued[p] -= 1
+            return job
+
+        return None
+
+    def _work(self, interactive_only):
+
+        while True:
+
+            with self._condition:
+                job = self._next_job(interactive_only)
+                while job is None:
+                    if self._closed:
+                        return
+                    self._condition.wait()
+                    job = self._next_job(interactive_only)
+                self._num_running[job.priority] += 1
+
+            job._run()
+
+            with self._condition:
+                self._num_running[job.priority] -= 1
+                self._num_completed[job.priority] += 1
+                self._wait_seconds[job.priority] += job.wait_time
+
+            self._client.metrics.observe_operation('scheduler_wait_{:s}'.format(job.priority), job.submit_time, job.wait_time)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(cancel=exc_type is not None)
+
+    def __repr__(self):
+        return '<M2mRequestScheduler(num_threads={:0.0f}, reserved_threads={:0.0f})>'.format(self._num_threads, self._reserved_threads)
+
+class M2mJob(object):
+    '''Call queued with M2mRequestScheduler.submit.  The result is available from
+    result once the job has run.
+
+    Parameters:
+        func: callable to run
+        args: tuple of positional arguments
+        kwargs: dictionary of keyword arguments
+        priority: priority class
+        user: user the job is shared by
+    '''
+
+    def __init__(self, func, args, kwargs, priority, user):
+
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        self._priority = priority
+        self._user = user
+
+        self._logger = logging.getLogger(__name__)
+
+        self._done = threading.Event()
+        self._result = None
+        self._exception = None
+        self._cancelled = False
+        self._submit_time = time.time()
+        self._start_time = None
+        self._end_time = None
+
+    @property
+    def priority(self):
+        return self._priority
+
+    @property
+    def user(self):
+        return self._user
+
+    @property
+    def submit_time(self):
+        return self._submit_time
+
+    @property
+    def wait_time(self):
+        '''Number of seconds the job was queued for'''
+        return (self._start_time or time.time()) - self._submit_time
+
+    @property
+    def run_time(self):
+        '''Number of seconds the job ran for'''
+        if self._start_time is None:
+            return 0.
+        return (self._end_time or time.time()) - self._start_time
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    @property
+    def exception(self):
+        '''Exception raised by the call, if any'''
+        return self._exception
+
+    def done(self):
+        '''Return True if the job has run or was cancelled'''
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        '''Wait up to timeout seconds for the job to finish and return True if it
+        has'''
+        return self._done.wait(timeout)
+
+    def result(self, timeout=None):
+        '''Wait up to timeout seconds for the job to finish and return the result of
+        the call.  Returns None if the job has not finished or was cancelled and
+        raises the exception raised by the call, if any.'''
+
+        if not self._done.wait(timeout):
+            self._logger.warning('Job not finished after {:0.1f} seconds'.format(timeout))
+            return
+
+        if self._exception is not None:
+            raise self._exception
+
+        return self._result
+
+    def _run(self):
+
+        self._start_time = time.time()
+        try:
+            self._result = self._func(*self._args, **self._kwargs)
+        except Exception as e:
+            # Keep the worker up and report the failure to the caller
+            self._logger.exception('{:s}: {:s}'.format(getattr(self._func, '__name__', repr(self._func)), str(e)))
+            self._exception = e
+        finally:
+            self._end_time = time.time()
+            self._done.set()
+
+    def _cancel(self):
+
+        self._cancelled = True
+        self._done.set()
+
+    def __repr__(self):
+        return '<M2mJob(priority={:s}, user={:s}, done={:s})>'.format(self._priority, self._user, str(self.done()))
+
+def request_user(url):
+    '''Return the user query string parameter of the data request url or
+    M2mRequest, or ANONYMOUS_USER if not set'''
+
+    if isinstance(url, M2mRequest):
+        user = url.options.get('user')
+    else:
+        user = parse_qs(urlsplit(url.strip()).query).get('user', [None])[-1]
+
+    return user or ANONYMOUS_USER
@@ -0,0 +1,106 @@
+from m2m.M2mRequest import M2mRequest
+
+class M2mRequestTemplate(object):
+    '''Precompiled m2m stream request url.  The query string parameters that are
+    the same for every request (format, limit, execDPA, include_provenance,
+    selogging, user and email) are formatted once, when the template is created,
+    so that only the reference designator, delivery method, stream and time range
+    are filled in for each url.
+
+    Parameters:
+        m2m_base_url: m2m base url of the UFrame instance
+        application_type: 'netcdf' or 'json' (Default is 'netcdf')
+        limit: integer value ranging from -1 to 10000.  A value of -1 (default)
+            results in a non-decimated dataset
+        exec_dpa: boolean value specifying whether to execute all data product
+            algorithms to return L1/L2 parameters (Default is True)
+        provenance: boolean value specifying whether provenance information
+            should be included in the data set (Default is True)
+        selogging: boolean value specifying whether to enable stream engine
+            logging (Default is False)
+        user: user name sent with the request (Default is _nouser)
+        email: email address notified when the request is complete
+        refdes_index: RefDesIndex used to look up the url path and sensor of each
+            reference designator instead of splitting it
+    '''
+
+    def __init__(self, m2m_base_url, application_type='netcdf', limit=-1, exec_dpa=True, provenance=True, selogging=False, user='_nouser', email=None, refdes_index=None):
+
+        self._m2m_base_url = m2m_base_url
+        self._params = {'format' : 'application/{:s}'.format(application_type),
+            'limit' : limit,
+            'execDPA' : str(exec_dpa).lower(),
+            'include_provenance' : str(provenance).lower(),
+            'selogging' : str(selogging).lower(),
+            'user' : user}
+
+        self._prefix = '{:s}/12576/sensor/inv/'.format(m2m_base_url)
+        self._suffix = '&format={:s}&limit={:d}&execDPA={:s}&include_provenance={:s}&selogging={:s}&user={:s}'.format(
+            self._params['format'],
+            limit,
+            self._params['execDPA'],
+            self._params['include_provenance'],
+            self._params['selogging'],
+            user)
+        if email:
+            self._params['email'] = email
+            self._suffix = '{:s}&email={:s}'.format(self._suffix, email)
+
+        self._refdes_index = refdes_index
+
+        # Url path and subsite, node and sensor of reference designators that are
+        # not in the index
+        self._instrument_paths = {}
+        self._instrument_tokens = {}
+
+    @property
+    def m2m_base_url(self):
+        return self._m2m_base_url
+
+    @property
+    def params(self):
+        '''Query string parameters shared by every request'''
+        return dict(self._params)
+
+    def url(self, reference_designator, method, stream, begin_dt, end_dt):
+        '''Return the request url for the instrument stream and ISO-8601 formatted
+        begin_dt and end_dt'''
+
+        instrument_path = None
+        if self._refdes_index:
+            instrument_path = self._refdes_index.path(reference_designator)
+        if not instrument_path:
+            instrument_path = self._instrument_paths.get(reference_designator)
+        if not instrument_path:
+            r_tokens = reference_designator.split('-')
+            instrument_path = '{:s}/{:s}/{:s}-{:s}/'.format(r_tokens[0], r_tokens[1], r_tokens[2], r_tokens[3])
+            self._instrument_paths[reference_designator] = instrument_path
+
+        return self._prefix + instrument_path + method + '/' + stream + '?beginDT=' + begin_dt + '&endDT=' + end_dt + self._suffix
+
+    def request(self, reference_designator, method, stream, begin_dt, end_dt):
+        '''Return the request as an M2mRequest instead of a url.  All requests
+        created by the template share the same options dictionary.'''
+
+        if self._refdes_index and reference_designator in self._refdes_index:
+            components = self._refdes_index.components(reference_designator)
+            return M2mRequest(12576, components[0], components[1], self._refdes_index.sensor(reference_designator), method, stream, begin_dt, end_dt, self._params)
+
+        tokens = self._instrument_tokens.get(reference_designator)
+        if not tokens:
+            r_tokens = reference_designator.split('-')
+            tokens = (r_tokens[0], r_tokens[1], '{:s}-{:s}'.format(r_tokens[2], r_tokens[3]))
+            self._instrument_tokens[reference_designator] = tokens
+
+        return M2mRequest(12576, tokens[0], tokens[1], tokens[2], method, stream, begin_dt, end_dt, self._params)
+
+    def format_request(self, request):
+        '''Return the url for the M2mRequest'''
+
+        if request.options is not self._params:
+            return request.url(self._m2m_base_url)
+
+        return self._prefix + request.subsite + '/' + request.node + '/' + request.sensor + '/' + request.method + '/' + request.stream + '?beginDT=' + request.begin_dt + '&endDT=' + request.end_dt + self._suffix
+
+    def __repr__(self):
+        return '<M2mRequestTemplate(url={:s}...{:s})>'.format(self._prefix, self._suffix)
@@ -0,0 +1,254 @@
+import logging
+import multiprocessing
+import os
+import tempfile
+from m2m.M2mClient import M2mClient
+from m2m.M2mRequest import M2mRequest
+from m2m.IncrementalRequestPlanner import IncrementalRequestPlanner
+from m2m.tocfile import load_toc
+from m2m.SharedToc import is_shared_toc
+
+# M2mClient and IncrementalRequestPlanner created once in each worker process
+_worker_client = None
+_worker_planner = None
+# Table of contents load failure of the worker process, raised by every task so
+# that the run is aborted instead of each worker fetching the table of contents
+_worker_error = None
+
+class M2mShardPool(object):
+    '''Process pool for system-wide runs.  Instruments and requests are split into
+    one shard per subsite and the shards are built or sent by the worker
+    processes, so that date parsing, url formatting and waiting on the UFrame
+    instance are spread across all cores.
+
+    Each worker loads the table of contents once, when it starts, from toc_file,
+    or attaches to it if toc_file is a shared table of contents file written by
+    M2mClient.publish_toc.  If no toc_file is specified, the client table of
+    contents is published to a temporary shared table of contents file for the
+    workers to attach to, instead of pickling the table of contents with every
+    shard, so that all workers share one copy of it.  Results are returned in
+    shard order, so the output is the same for any number of processes.  If a
+    worker fails to load toc_file, the IOError is raised in the parent by
+    build_instrument_m2m_queries or send_m2m_requests.
+
+    Parameters:
+        client: M2mClient instance whose table of contents is used to create the
+            shards
+        processes: number of worker processes (Default is the number of cores)
+        toc_file: JSON or shared table of contents file loaded or attached to by
+            each worker
+        watermark_file: IncrementalRequestPlanner watermark file used by the
+            workers to plan requests
+        api_username: API user name used by the workers to send requests
+        api_token: API token used by the workers to send requests
+    '''
+
+    def __init__(self, client, processes=None, toc_file=None, watermark_file=None, api_username=None, api_token=None):
+
+        self._client = client
+        self._processes = processes or multiprocessing.cpu_count()
+        self._toc_file = toc_file
+        self._watermark_file = watermark_file
+        self._api_username = api_username
+        self._api_token = api_token
+
+        self._logger = logging.getLogger(__name__)
+
+        self._pool = None
+        self._snapshot_file = None
+
+    @property
+    def processes(self):
+        return self._processes
+
+    def start(self):
+        '''Start the worker processes'''
+
+        if self._pool:
+            return
+
+        toc_file = self._toc_file
+        if not toc_file:
+            # Publish the client table of contents for the workers
+            (fd, self._snapshot_file) = tempfile.mkstemp(prefix='m2m_toc_', suffix='.m2m')
+            os.close(fd)
+            self._client.publish_toc(self._snapshot_file)
+            toc_file = self._snapshot_file
+
+        self._pool = multiprocessing.Pool(self._processes,
+            initializer=_init_worker,
+            initargs=(self._client.base_url,
+                toc_file,
+                self._client.timeout,
+                self._client.num_retries,
+                self._api_username,
+                self._api_token,
+                self._watermark_file))
+
+        self._logger.debug('Started {:0.0f} worker processes'.format(self._processes))
+
+    def close(self):
+        '''Wait for the workers to finish and stop them'''
+
+        if self._pool:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+        if self._snapshot_file:
+            os.remove(self._snapshot_file)
+            self._snapshot_file = None
+
+    def shard(self, instruments):
+        '''Return the list of (subsite, instruments) tuples splitting the fully-qualified
+        reference designators by subsite, in M2mClient.subsites order'''
+
+        by_subsite = {}
+        for instrument in instruments:
+            by_subsite.setdefault(instrument.split('-')[0], []).append(instrument)
+
+        return [(subsite, by_subsite[subsite]) for subsite in self._client.subsites if subsite in by_subsite]
+
+    def build_instrument_m2m_queries(self, instruments, planned=False, structured=False, **kwargs):
+        '''Generator yielding a (subsite, requests) tuple for each subsite shard of the
+        fully-qualified reference designators in instruments.
+
+        Parameters:
+            instruments: list of fully-qualified reference designators
+            planned: build the requests with IncrementalRequestPlanner.plan, using
+                the pool watermark_file, instead of
+                M2mClient.build_instrument_m2m_queries
+            structured: return M2mRequest instances instead of urls
+
+        Additional keyword arguments are passed to
+        M2mClient.build_instrument_m2m_queries or IncrementalRequestPlanner.plan.
+        '''
+
+        self.start()
+
+        tasks = [(subsite, shard_instruments, planned, structured, kwargs) for (subsite, shard_instruments) in self.shard(instruments)]
+
+        for (subsite, requests) in self._pool.imap(_build_shard, tasks):
+            if structured:
+                requests = [M2mRequest.from_dict(r) for r in requests]
+            yield subsite, requests
+
+    def send_m2m_requests(self, requests):
+        '''Generator yielding a (request, response) tuple for each request url or
+        M2mRequest, where response is the M2mClient.send_m2m_request response or
+        None if the request was not sent.  Requests are grouped by subsite in the
+        order each subsite first appears.'''
+
+        self.start()
+
+        subsites = []
+        by_subsite = {}
+        for request in requests:
+            subsite = _request_subsite(request)
+            if subsite not in by_subsite:
+                subsites.append(subsite)
+                by_subsite[subsite] = []
+            by_subsite[subsite].append(request)
+
+        tasks = [[_serialize_request(r) for r in by_subsite[subsite]] for subsite in subsites]
+
+        for (subsite, responses) in zip(subsites, self._pool.imap(_send_shard, tasks)):
+            for (request, response) in zip(by_subsite[subsite], responses):
+                yield request, response
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return '<M2mShardPool(processes={:0.0f})>'.format(self._processes)
+
+def _init_worker(base_url, toc_file, timeout, num_retries, api_username, api_token, watermark_file):
+    '''Pool initializer: load or attach to the table of contents and create the
+    worker client'''
+
+    global _worker_client, _worker_planner, _worker_error
+
+    toc = None
+    shared_toc = None
+    try:
+        if is_shared_toc(toc_file):
+            shared_toc = toc_file
+        else:
+            toc = load_toc(toc_file)
+    except (IOError, OSError, ValueError) as e:
+        # Raising here would only make the pool restart the worker: keep the
+        # error for the tasks to report to the parent
+        _worker_error = '{:s}: {:s}'.format(toc_file, str(e))
+        logging.getLogger(__name__).error(_worker_error)
+        return
+
+    _worker_client = M2mClient(base_url, timeout=timeout, num_retries=num_retries, api_username=api_username, api_token=api_token, toc=toc, shared_toc=shared_toc)
+
+    if watermark_file:
+        _worker_planner = IncrementalRequestPlanner(_worker_client, watermark_file)
+
+def _build_shard(task):
+
+    _check_worker()
+
+    (subsite, instruments, planned, structured, kwargs) = task
+
+    requests = []
+    try:
+        for instrument in instruments:
+            if planned:
+                requests = requests + _worker_planner.plan(instrument, structured=structured, **kwargs)
+            else:
+                requests = requests + _worker_client.build_instrument_m2m_queries(instrument, structured=structured, **kwargs)
+    except Exception as e:
+        # Report the failure and keep the rest of the run going
+        logging.getLogger(__name__).exception('{:s}: {:s}'.format(subsite, str(e)))
+        return subsite, []
+
+    if structured:
+        requests = [r.to_dict() for r in requests]
+
+    return subsite, requests
+
+def _send_shard(requests):
+
+    _check_worker()
+
+    responses = []
+    for (structured, request) in requests:
+        if structured:
+            request = M2mRequest.from_dict(request)
+        try:
+            responses.append(_worker_client.send_m2m_request(request))
+        except Exception as e:
+            logging.getLogger(__name__).exception(str(e))
+            responses.append(None)
+
+    return responses
+
+def _check_worker():
+
+    if _worker_error:
+        raise IOError('Table of contents not loaded: {:s}'.format(_worker_error))
+
+def _request_subsite(request):
+
+    if isinstance(request, M2mRequest):
+        return request.subsite
+
+    parsed = M2mRequest.from_url(request)
+    if not parsed:
+        return ''
+
+    return parsed.subsite
+
+def _serialize_request(request):
+
+    if isinstance(request, M2mRequest):
+        return True, request.to_dict()
+
+    return False, request
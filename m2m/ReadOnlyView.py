@@ -0,0 +1,100 @@
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:
+    from collections import Mapping, Sequence
+
+class ReadOnlyView(Mapping):
+    '''Read-only view of a table of contents dictionary.  No data is copied:
+    lookups go to the underlying dictionary and nested dictionaries and lists are
+    returned as read-only views, so the shared table of contents cannot be
+    modified through the view.
+
+    Parameters:
+        mapping: dictionary to view
+        extra: optional dictionary of additional keys, which take precedence over
+            the keys in mapping
+    '''
+
+    __slots__ = ('_mapping', '_extra')
+
+    def __init__(self, mapping, extra=None):
+
+        self._mapping = mapping
+        self._extra = extra
+
+    def __getitem__(self, key):
+
+        if self._extra and key in self._extra:
+            return _view(self._extra[key])
+
+        return _view(self._mapping[key])
+
+    def __contains__(self, key):
+
+        return key in self._mapping or bool(self._extra and key in self._extra)
+
+    def __iter__(self):
+
+        for key in self._mapping:
+            yield key
+
+        if self._extra:
+            for key in self._extra:
+                if key not in self._mapping:
+                    yield key
+
+    def __len__(self):
+
+        if not self._extra:
+            return len(self._mapping)
+
+        return len(self._mapping) + len([k for k in self._extra if k not in self._mapping])
+
+    def copy(self):
+        '''Return a shallow copy of the viewed dictionary, as a regular dict'''
+
+        d = dict(self._mapping)
+        if self._extra:
+            d.update(self._extra)
+
+        return d
+
+    def __repr__(self):
+        return '<ReadOnlyView({:s})>'.format(repr(self.copy()))
+
+class ReadOnlyListView(Sequence):
+    '''Read-only view of a table of contents list, returning nested dictionaries
+    and lists as read-only views
+
+    Parameters:
+        sequence: list to view
+    '''
+
+    __slots__ = ('_sequence',)
+
+    def __init__(self, sequence):
+
+        self._sequence = sequence
+
+    def __getitem__(self, i):
+
+        if isinstance(i, slice):
+            return ReadOnlyListView(self._sequence[i])
+
+        return _view(self._sequence[i])
+
+    def __len__(self):
+
+        return len(self._sequence)
+
+    def __repr__(self):
+        return '<ReadOnlyListView(items={:0.0f})>'.format(len(self._sequence))
+
+def _view(value):
+
+    if isinstance(value, dict):
+        return ReadOnlyView(value)
+    elif isinstance(value, list):
+        return ReadOnlyListView(value)
+
+    return value
@@ -0,0 +1,163 @@
+import logging
+import bisect
+
+class RefDesIndex(object):
+    '''Index of the components of fully-qualified instrument reference designators
+    (i.e.: CE01ISSM-MFD35-02-PRESFA000), parsed once.  Each reference designator
+    is split into its subsite (CE01ISSM), node (MFD35), port (02), instrument
+    (PRESFA000) and instrument class (PRESF).  Component strings are interned, so
+    that every reference designator on the same subsite, node or port shares the
+    same string instance.
+
+    Reference designators are indexed by subsite, node and instrument class, so
+    that queries like all CTDs on a node or all nodes of a subsite are direct
+    lookups.  The url path and sensor (port-instrument) of each reference
+    designator are also precomputed for building requests.
+
+    Parameters:
+        instruments: iterable of fully-qualified reference designators
+    '''
+
+    def __init__(self, instruments):
+
+        self._logger = logging.getLogger(__name__)
+
+        # Interned strings
+        self._strings = {}
+
+        # Reference designator to (subsite, node, port, instrument, instrument_class)
+        self._components = {}
+        # Reference designator to the sensor (port-instrument) and the url path
+        self._sensors = {}
+        self._paths = {}
+        # (subsite, node, sensor) to reference designator
+        self._reference_designators = {}
+
+        # Subsites of all reference designators, including those not indexed
+        self._subsites = set()
+
+        # Sorted reference designators by subsite, node (subsite-node) and class
+        self._by_subsite = {}
+        self._by_node = {}
+        self._by_class = {}
+
+        for reference_designator in sorted(set(instruments)):
+
+            tokens = reference_designator.split('-')
+            self._subsites.add(self._intern(tokens[0]))
+            if len(tokens) != 4:
+                self._logger.debug('Skipping reference designator: {:s}'.format(reference_designator))
+                continue
+
+            reference_designator = self._intern(reference_designator)
+            (subsite, node, port, instrument) = [self._intern(t) for t in tokens]
+            instrument_class = self._intern(instrument[:5])
+            node_key = self._intern('{:s}-{:s}'.format(subsite, node))
+            sensor = self._intern('{:s}-{:s}'.format(port, instrument))
+
+            self._components[reference_designator] = (subsite, node, port, instrument, instrument_class)
+            self._sensors[reference_designator] = sensor
+            self._paths[reference_designator] = '{:s}/{:s}/{:s}/'.format(subsite, node, sensor)
+            self._reference_designators[(subsite, node, sensor)] = reference_designator
+
+            self._by_subsite.setdefault(subsite, []).append(reference_designator)
+            self._by_node.setdefault(node_key, []).append(reference_designator)
+            self._by_class.setdefault(instrument_class, []).append(reference_designator)
+
+        # Sorted node keys of each subsite
+        self._subsite_nodes = {}
+        for node_key in sorted(self._by_node.keys()):
+            self._subsite_nodes.setdefault(self._components[self._by_node[node_key][0]][0], []).append(node_key)
+
+    @property
+    def subsites(self):
+        '''Sorted list of subsites: the first component of every reference
+        designator, including those that are not fully-qualified'''
+        return sorted(self._subsites)
+
+    @property
+    def instrument_classes(self):
+        '''Sorted list of instrument classes'''
+        return sorted(self._by_class.keys())
+
+    def nodes(self, subsite=None):
+        '''Return the sorted list of nodes, as subsite-node (i.e.: CE01ISSM-MFD35),
+        on the subsite (Default is all subsites)'''
+
+        if subsite:
+            return list(self._subsite_nodes.get(subsite, []))
+
+        return sorted(self._by_node.keys())
+
+    def instruments(self, subsite=None, node=None, instrument_class=None):
+        '''Return the sorted list of reference designators matching all of the
+        specified components.
+
+        Parameters:
+            subsite: subsite (i.e.: CE01ISSM)
+            node: subsite-node (i.e.: CE01ISSM-MFD35) or, if subsite is specified,
+                the node name (i.e.: MFD35)
+            instrument_class: 5 character instrument class (i.e.: CTDBP)
+        '''
+
+        if node and subsite and node.find('-') == -1:
+            node = '{:s}-{:s}'.format(subsite, node)
+
+        # Start from the smallest candidate list and filter by the other components
+        candidates = []
+        if node:
+            candidates.append(self._by_node.get(node, []))
+        if subsite:
+            candidates.append(self._by_subsite.get(subsite, []))
+        if instrument_class:
+            candidates.append(self._by_class.get(instrument_class, []))
+
+        if not candidates:
+            return sorted(self._components.keys())
+
+        candidates.sort(key=len)
+        instruments = candidates[0]
+        for other in candidates[1:]:
+            instruments = [r for r in instruments if _contains(other, r)]
+
+        return list(instruments)
+
+    def components(self, reference_designator):
+        '''Return the (subsite, node, port, instrument, instrument_class) tuple for
+        the reference designator or None if it is not indexed'''
+        return self._components.get(reference_designator)
+
+    def sensor(self, reference_designator):
+        '''Return the sensor (port-instrument) of the reference designator or None
+        if it is not indexed'''
+        return self._sensors.get(reference_designator)
+
+    def path(self, reference_designator):
+        '''Return the subsite/node/port-instrument/ url path of the reference
+        designator or None if it is not indexed'''
+        return self._paths.get(reference_designator)
+
+    def reference_designator(self, subsite, node, sensor):
+        '''Return the interned reference designator for the subsite, node and sensor
+        (port-instrument), or None if it is not indexed'''
+        return self._reference_designators.get((subsite, node, sensor))
+
+    def _intern(self, s):
+
+        return self._strings.setdefault(s, s)
+
+    def __contains__(self, reference_designator):
+        return reference_designator in self._components
+
+    def __len__(self):
+        return len(self._components)
+
+    def __repr__(self):
+        return '<RefDesIndex(instruments={:0.0f}, subsites={:0.0f}, nodes={:0.0f})>'.format(len(self._components), len(self._by_subsite), len(self._by_node))
+
+def _contains(sorted_list, item):
+    '''Return True if item is in the sorted list'''
+
+    i = bisect.bisect_left(sorted_list, item)
+
+    return i < len(sorted_list) and sorted_list[i] == item
@@ -0,0 +1,368 @@
+import logging
+import os
+import mmap
+import json
+import struct
+import bisect
+
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:
+    from collections import Mapping, Sequence
+
+# Leading bytes identifying shared table of contents files and the format version
+_MAGIC = b'M2MTOC\x00\x01'
+
+# Header: magic bytes followed by the length of the JSON table directory
+_HEADER = struct.Struct('<8sI')
+
+# Byte offsets of the keys and records in each table
+_OFFSET = struct.Struct('<Q')
+
+class SharedToc(object):
+    '''Read-only, memory-mapped table of contents file written by
+    write_shared_toc, i.e.: with M2mClient.publish_toc.  The file contains the
+    compiled table of contents indexes as tables of sorted keys, each with an
+    optional JSON record per key.  Keys and records are decoded from the mapped
+    file when they are accessed, so every process attaching to the same file
+    shares a single copy of the data in the operating system page cache instead
+    of building its own.
+
+    Parameters:
+        path: shared table of contents file
+
+    Raises IOError/OSError if the file cannot be read and ValueError if it is not
+    a shared table of contents file.
+    '''
+
+    def __init__(self, path):
+
+        self._logger = logging.getLogger(__name__)
+
+        self._path = path
+
+        with open(path, 'rb') as fid:
+            self._mmap = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mmap) < _HEADER.size:
+            self._mmap.close()
+            raise ValueError('Invalid shared table of contents: {:s}'.format(path))
+
+        (magic, directory_length) = _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC:
+            self._mmap.close()
+            raise ValueError('Invalid shared table of contents: {:s}'.format(path))
+
+        data_start = _HEADER.size + directory_length
+        directory = json.loads(self._mmap[_HEADER.size:data_start].decode('utf-8'))
+
+        # Region offsets are relative to the end of the directory
+        self._tables = {}
+        for (name, regions) in directory.items():
+            self._tables[name] = {r:(data_start + offset, length) for (r, (offset, length)) in regions.items()}
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def tables(self):
+        '''Sorted list of table names'''
+        return sorted(self._tables.keys())
+
+    def keys(self, name):
+        '''Return the sorted keys of table name as a StringTable'''
+
+        regions = self._get_table(name)
+
+        return StringTable(self._mmap, regions['keys'], regions['key_offsets'])
+
+    def table(self, name):
+        '''Return table name as a RecordTable mapping each key to its record'''
+
+        regions = self._get_table(name)
+        if 'records' not in regions:
+            raise KeyError('Table has no records: {:s}'.format(name))
+
+        return RecordTable(self.keys(name), self._mmap, regions['records'], regions['record_offsets'])
+
+    def close(self):
+        '''Unmap the file.  Tables returned by this instance can no longer be used.'''
+
+        self._mmap.close()
+
+    def _get_table(self, name):
+
+        if name not in self._tables:
+            raise KeyError('Table not found: {:s}'.format(name))
+
+        return self._tables[name]
+
+    def __contains__(self, name):
+        return name in self._tables
+
+    def __repr__(self):
+        return '<SharedToc(path={:s}, tables={:0.0f})>'.format(self._path, len(self._tables))
+
+class SharedText(object):
+    '''Read-only view of a region of a memory-mapped file containing utf-8 text,
+    searched in place
+
+    Parameters:
+        data: mmap instance
+        region: (offset, length) of the text in data
+    '''
+
+    __slots__ = ('_data', '_start', '_end')
+
+    def __init__(self, data, region):
+
+        self._data = data
+        self._start = region[0]
+        self._end = region[0] + region[1]
+
+    def find(self, sub, start=0):
+        '''Return the lowest byte offset of sub in the text, at or after start, or
+        -1 if not found'''
+
+        if not isinstance(sub, bytes):
+            sub = sub.encode('utf-8')
+
+        i = self._data.find(sub, self._start + start, self._end)
+        if i == -1:
+            return i
+
+        return i - self._start
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __str__(self):
+        return self._data[self._start:self._end].decode('utf-8')
+
+class OffsetArray(Sequence):
+    '''Read-only view of a region of a memory-mapped file containing unsigned
+    64-bit integers
+
+    Parameters:
+        data: mmap instance
+        region: (offset, length) of the array in data
+    '''
+
+    __slots__ = ('_data', '_start', '_length')
+
+    def __init__(self, data, region):
+
+        self._data = data
+        self._start = region[0]
+        self._length = region[1] // _OFFSET.size
+
+    def __getitem__(self, i):
+
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._length))]
+
+        if i < 0:
+            i += self._length
+        if i < 0 or i >= self._length:
+            raise IndexError('index out of range')
+
+        return _OFFSET.unpack_from(self._data, self._start + i * _OFFSET.size)[0]
+
+    def __len__(self):
+        return self._length
+
+class StringTable(Sequence):
+    '''Read-only sorted list of strings stored in a memory-mapped file as
+    newline-delimited text and the byte offset of each string in the text, with
+    one extra offset for the end of the text.  The text and offsets may be
+    searched in place as M2mClient does with the reference designators.
+
+    Parameters:
+        data: mmap instance
+        text_region: (offset, length) of the text in data
+        offsets_region: (offset, length) of the string offsets in data
+    '''
+
+    __slots__ = ('_data', '_start', '_text', '_offsets', '_length')
+
+    def __init__(self, data, text_region, offsets_region):
+
+        self._data = data
+        self._start = text_region[0]
+        self._text = SharedText(data, text_region)
+        self._offsets = OffsetArray(data, offsets_region)
+        self._length = len(self._offsets) - 1
+
+    @property
+    def text(self):
+        return self._text
+
+    @property
+    def offsets(self):
+        return self._offsets
+
+    def index(self, s):
+        '''Return the index of the string s or raise ValueError if not found'''
+
+        i = bisect.bisect_left(self, s)
+        if i < self._length and self[i] == s:
+            return i
+
+        raise ValueError('{:s} is not in the table'.format(s))
+
+    def __getitem__(self, i):
+
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._length))]
+
+        if i < 0:
+            i += self._length
+        if i < 0 or i >= self._length:
+            raise IndexError('index out of range')
+
+        start = self._start + self._offsets[i]
+        end = self._start + self._offsets[i+1] - 1
+
+        return self._data[start:end].decode('utf-8')
+
+    def __iter__(self):
+
+        start = self._start + self._offsets[0]
+        for i in range(1, self._length + 1):
+            end = self._start + self._offsets[i]
+            yield self._data[start:end - 1].decode('utf-8')
+            start = end
+
+    def __contains__(self, s):
+
+        try:
+            self.index(s)
+        except ValueError:
+            return False
+
+        return True
+
+    def __len__(self):
+        return self._length
+
+    def __repr__(self):
+        return '<StringTable(strings={:0.0f})>'.format(self._length)
+
+class RecordTable(Mapping):
+    '''Read-only dictionary mapping each key of a StringTable to a JSON record
+    stored in a memory-mapped file.  Records are decoded each time they are
+    accessed, so changes made to a returned record are never shared.
+
+    Parameters:
+        keys: StringTable of sorted keys
+        data: mmap instance
+        records_region: (offset, length) of the concatenated records in data
+        offsets_region: (offset, length) of the record offsets in data
+    '''
+
+    __slots__ = ('_keys', '_data', '_start', '_offsets')
+
+    def __init__(self, keys, data, records_region, offsets_region):
+
+        self._keys = keys
+        self._data = data
+        self._start = records_region[0]
+        self._offsets = OffsetArray(data, offsets_region)
+
+    def record(self, i):
+        '''Decode and return the record at index i'''
+
+        start = self._start + self._offsets[i]
+        end = self._start + self._offsets[i+1]
+
+        return json.loads(self._data[start:end].decode('utf-8'))
+
+    def __getitem__(self, key):
+
+        try:
+            i = self._keys.index(key)
+        except ValueError:
+            raise KeyError(key)
+
+        return self.record(i)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return '<RecordTable(records={:0.0f})>'.format(len(self._keys))
+
+def is_shared_toc(path):
+    '''Return True if path is a shared table of contents file'''
+
+    with open(path, 'rb') as fid:
+        return fid.read(len(_MAGIC)) == _MAGIC
+
+def write_shared_toc(path, tables):
+    '''Write the tables to the shared table of contents file path, to be attached
+    to with SharedToc.  The file is written to a temporary file which is then
+    renamed, so that processes attached to the previous file keep using it and
+    new processes never read a partial file.
+
+    Parameters:
+        path: file to write
+        tables: dictionary mapping each table name to a (keys, records) tuple,
+            where keys is the sorted list of strings and records is the list of
+            JSON serializable records, one per key, or None if the table only
+            contains keys
+    '''
+
+    chunks = []
+    directory = {}
+    size = 0
+    for name in sorted(tables.keys()):
+
+        (keys, records) = tables[name]
+
+        regions = {}
+        encoded = [k.encode('utf-8') for k in keys]
+        for (region, data) in (('keys', b''.join([k + b'\n' for k in encoded])),
+            ('key_offsets', _pack_offsets([len(k) + 1 for k in encoded]))):
+            regions[region] = (size, len(data))
+            chunks.append(data)
+            size += len(data)
+
+        if records is not None:
+            if len(records) != len(keys):
+                raise ValueError('{:s}: {:0.0f} records for {:0.0f} keys'.format(name, len(records), len(keys)))
+            encoded = [json.dumps(r, separators=(',', ':')).encode('utf-8') for r in records]
+            for (region, data) in (('records', b''.join(encoded)),
+                ('record_offsets', _pack_offsets([len(r) for r in encoded]))):
+                regions[region] = (size, len(data))
+                chunks.append(data)
+                size += len(data)
+
+        directory[name] = regions
+
+    directory = json.dumps(directory).encode('utf-8')
+
+    tmp_path = '{:s}.tmp'.format(path)
+    with open(tmp_path, 'wb') as fid:
+        fid.write(_HEADER.pack(_MAGIC, len(directory)))
+        fid.write(directory)
+        for chunk in chunks:
+            fid.write(chunk)
+
+    os.rename(tmp_path, path)
+
+def _pack_offsets(lengths):
+    '''Return the packed offsets of consecutive items of the specified lengths,
+    starting at 0 and ending with the total length'''
+
+    offsets = [0]
+    for length in lengths:
+        offsets.append(offsets[-1] + length)
+
+    return struct.pack('<{:0.0f}Q'.format(len(offsets)), *offsets)
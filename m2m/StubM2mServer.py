@@ -0,0 +1,370 @@
+import logging
+import json
+import threading
+import uuid
+import random
+import time
+import zlib
+import hashlib
+import re
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit, parse_qs
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit, parse_qs
+
+# Smallest response compressed for clients accepting gzip
+_GZIP_MIN_BYTES = 1024
+
+# Byte range of a Range request header
+_RANGE_REGEX = re.compile(r'bytes=(\d+)-(\d*)$')
+
+class StubM2mServer(object):
+    '''Local stand-in for the UFrame m2m API, used to exercise M2mClient without a
+    network.  Serves the table of contents (12576/sensor/inv/toc), deployment
+    events (12587/events/deployment/query) and accepts stream data requests
+    (12576/sensor/inv/...).  Stream requests for format=application/json are
+    answered with num_particles synthetic particles, all others with an
+    asynchronous request response.  The output directory of each asynchronous
+    request is served as an html listing of one NetCDF file of file_size
+    synthetic bytes, which may be downloaded in byte ranges.  Point an M2mClient
+    at StubM2mServer.base_url once the server is started.
+
+    Latency, errors and rate limiting may be added to load test the client:
+    every request is delayed by latency plus a random fraction of jitter seconds,
+    error_rate of the requests fail with HTTP 500 and requests exceeding
+    rate_limit requests per second fail with HTTP 429.  Responses larger than 1
+    KB are gzip compressed for clients sending Accept-Encoding: gzip.
+
+    Parameters:
+        toc: table of contents returned by the toc endpoint
+        deployment_events: list of raw deployment events searched by the
+            deployment events endpoint
+        host: interface to listen on (Default is 127.0.0.1)
+        port: port to listen on.  The default (0) uses any free port.
+        latency: seconds added to every response (Default is 0)
+        jitter: maximum random number of seconds added to latency (Default is 0)
+        error_rate: fraction, from 0 to 1, of requests answered with an HTTP 500
+            error (Default is 0)
+        rate_limit: maximum number of requests per second.  Requests over the
+            limit are answered with an HTTP 429 error.  Default is no limit.
+        num_particles: number of particles returned by JSON stream requests
+            (Default is 100)
+        file_size: number of bytes in each asynchronous request output file
+            (Default is 1 MB)
+        seed: random number generator seed for the jitter and errors
+    '''
+
+    def __init__(self, toc=None, deployment_events=None, host='127.0.0.1', port=0, latency=0, jitter=0, error_rate=0, rate_limit=None, num_particles=100, file_size=1048576, seed=None):
+
+        self._toc = toc or {'instruments' : [], 'parameter_definitions' : [], 'parameters_by_stream' : {}}
+        self._host = host
+        self._port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.num_particles = num_particles
+        self.file_size = file_size
+
+        self._rng = random.Random(seed)
+
+        self._logger = logging.getLogger(__name__)
+
+        # Pair each deployment event with its reference designator for searching
+        self._deployment_events = []
+        for event in deployment_events or []:
+            ref_des = '{:s}-{:s}-{:s}'.format(event['referenceDesignator']['subsite'],
+                event['referenceDesignator']['node'],
+                event['referenceDesignator']['sensor'])
+            self._deployment_events.append((ref_des, event))
+
+        # Parameter names contained in each stream, used to build particles
+        particle_keys = {p['pdId']:p['particle_key'] for p in self._toc['parameter_definitions']}
+        self._stream_parameters = {}
+        for stream, pd_ids in self._toc['parameters_by_stream'].items():
+            self._stream_parameters[stream] = [particle_keys[pd_id] for pd_id in pd_ids if pd_id in particle_keys]
+
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._num_requests = 0
+        self._status_codes = {}
+
+        # Token bucket used for rate limiting
+        self._tokens = None
+        self._token_time = None
+
+    @property
+    def base_url(self):
+        return 'http://{:s}:{:0.0f}'.format(self._host, self._port)
+
+    @property
+    def num_requests(self):
+        return self._num_requests
+
+    def stats(self):
+        '''Return a dictionary containing the number of requests received and the
+        number of responses sent for each HTTP status code'''
+
+        with self._lock:
+            return {'num_requests' : self._num_requests,
+                'status_codes' : dict(self._status_codes)}
+
+    def start(self):
+        '''Start answering requests in a background thread'''
+
+        if self._server:
+            return
+
+        self._server = _ThreadingHTTPServer((self._host, self._port), _StubM2mRequestHandler)
+        self._server.stub = self
+        self._port = self._server.server_address[1]
+
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+        self._logger.debug('Serving stub m2m API at {:s}'.format(self.base_url))
+
+    def stop(self):
+        '''Stop answering requests'''
+
+        if not self._server:
+            return
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+
+    def respond(self, path, query):
+        '''Return the tuple (http_status_code, response) for the request path and
+        parsed query string, after applying the configured latency, errors and
+        rate limit'''
+
+        error = self._admit()
+        if error:
+            status_code, response = error
+        else:
+            status_code, response = self._route(path, query)
+
+        self._count(status_code)
+
+        return status_code, response
+
+    def respond_file(self, path, byte_range=None):
+        '''Return the tuple (http_status_code, headers, body) for the asynchronous
+        request output directory or file path and the Range header byte_range,
+        after applying the configured latency, errors and rate limit'''
+
+        error = self._admit()
+        if error:
+            (status_code, response) = error
+            self._count(status_code)
+            return status_code, {'Content-Type' : 'application/json'}, json.dumps(response).encode('utf-8')
+
+        tokens = path.strip('/').split('/')
+        if len(tokens) == 3:
+            # Output directory listing
+            body = '<html><body><a href="../">Parent Directory</a>\n<a href="{:s}.nc">{:s}.nc</a>\n</body></html>\n'.format(tokens[2], tokens[2])
+            status_code, headers, body = 200, {'Content-Type' : 'text/html'}, body.encode('utf-8')
+        elif len(tokens) == 4 and tokens[3] == '{:s}.nc'.format(tokens[2]):
+            status_code, headers, body = self._file_range(tokens[3], byte_range)
+        else:
+            status_code, headers, body = 404, {'Content-Type' : 'text/plain'}, b'Not found'
+
+        self._count(status_code)
+
+        return status_code, headers, body
+
+    def _admit(self):
+        '''Count the request and apply the latency.  Returns the (http_status_code,
+        response) error tuple if the request is rate limited or failed.'''
+
+        with self._lock:
+            self._num_requests += 1
+            rate_limited = not self._take_token()
+            failed = self.error_rate and self._rng.random() < self.error_rate
+            delay = self.latency
+            if self.jitter:
+                delay = delay + self._rng.random() * self.jitter
+
+        if delay:
+            time.sleep(delay)
+
+        if rate_limited:
+            return 429, {'message' : 'Too many requests: limit is {:0.1f} requests per second'.format(self.rate_limit)}
+        elif failed:
+            return 500, {'message' : 'Stub internal server error'}
+
+    def _count(self, status_code):
+
+        with self._lock:
+            self._status_codes[status_code] = self._status_codes.get(status_code, 0) + 1
+
+    def _route(self, path, query):
+
+        tokens = path.strip('/').split('/')
+        if len(tokens) < 4 or tokens[:2] != ['api', 'm2m']:
+            return 404, {'message' : 'Not found: {:s}'.format(path)}
+
+        port = tokens[2]
+        end_point = '/'.join(tokens[3:])
+
+        if port == '12576' and end_point == 'sensor/inv/toc':
+            return 200, self._toc
+
+        if port == '12587' and end_point == 'events/deployment/query':
+            ref_des = query.get('refdes', [''])[-1]
+            return 200, [e for (r, e) in self._deployment_events if r.startswith(ref_des)]
+
+        if port == '12576' and end_point.startswith('sensor/inv/') and len(tokens) == 10:
+            if query.get('format', [''])[-1] == 'application/json':
+                return 200, self._particles(tokens[5:])
+            return 200, self._async_response(tokens[5:])
+
+        return 404, {'message' : 'Not found: {:s}'.format(path)}
+
+    def _take_token(self):
+        '''Remove a token from the rate limit bucket, which refills at rate_limit
+        tokens per second.  Returns False if the bucket is empty.'''
+
+        if not self.rate_limit:
+            return True
+
+        now = time.time()
+        if self._tokens is None:
+            self._tokens = float(self.rate_limit)
+        else:
+            self._tokens = min(float(self.rate_limit), self._tokens + (now - self._token_time) * self.rate_limit)
+        self._token_time = now
+
+        if self._tokens < 1:
+            return False
+
+        self._tokens -= 1
+
+        return True
+
+    def _particles(self, stream_tokens):
+
+        (subsite, node, sensor, method, stream) = stream_tokens
+        parameters = self._stream_parameters.get(stream, [])
+
+        particles = []
+        for i in range(self.num_particles):
+            t = 3600000000.0 + i
+            particle = {'pk' : {'subsite' : subsite,
+                    'node' : node,
+                    'sensor' : sensor,
+                    'method' : method,
+                    'stream' : stream,
+                    'deployment' : 1,
+                    'time' : t},
+                'time' : t,
+                'preferred_timestamp' : 'port_timestamp'}
+            for p, parameter in enumerate(parameters):
+                if parameter not in particle:
+                    particle[parameter] = i + p * 0.001
+            particles.append(particle)
+
+        return particles
+
+    def _file_range(self, name, byte_range):
+        '''Return the (http_status_code, headers, body) response containing the
+        synthetic bytes of the file name in byte_range, or the whole file'''
+
+        seed = hashlib.md5(name.encode('utf-8')).digest()
+        data = (seed * (self.file_size // len(seed) + 1))[:self.file_size]
+
+        headers = {'Content-Type' : 'application/x-netcdf',
+            'Accept-Ranges' : 'bytes'}
+
+        match = _RANGE_REGEX.match(byte_range or '')
+        if not match:
+            return 200, headers, data
+
+        first = int(match.group(1))
+        last = self.file_size - 1
+        if match.group(2):
+            last = min(last, int(match.group(2)))
+        if first >= self.file_size or first > last:
+            headers['Content-Range'] = 'bytes */{:0.0f}'.format(self.file_size)
+            return 416, headers, b''
+
+        headers['Content-Range'] = 'bytes {:0.0f}-{:0.0f}/{:0.0f}'.format(first, last, self.file_size)
+
+        return 206, headers, data[first:last+1]
+
+    def _async_response(self, stream_tokens):
+
+        request_uuid = str(uuid.uuid4())
+        output_dir = '{:s}/async_results/stub/{:s}-{:s}'.format(self.base_url, request_uuid, '-'.join(stream_tokens))
+
+        return {'requestUUID' : request_uuid,
+            'outputURL' : output_dir,
+            'allURLs' : [output_dir],
+            'sizeCalculation' : 1000000,
+            'timeCalculation' : 60,
+            'numberOfSubJobs' : 1}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def __repr__(self):
+        return '<StubM2mServer(url={:s})>'.format(self.base_url)
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class _StubM2mRequestHandler(BaseHTTPRequestHandler):
+    '''Translates GET requests into StubM2mServer responses'''
+
+    def do_GET(self):
+
+        tokens = urlsplit(self.path)
+        if tokens.path.startswith('/async_results/'):
+            self._send_file(tokens.path)
+            return
+
+        status_code, response = self.server.stub.respond(tokens.path, parse_qs(tokens.query))
+
+        body = json.dumps(response).encode('utf-8')
+        gzipped = len(body) > _GZIP_MIN_BYTES and 'gzip' in self.headers.get('Accept-Encoding', '')
+        if gzipped:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            body = compressor.compress(body) + compressor.flush()
+        self.send_response(status_code)
+        if status_code == 429:
+            self.send_header('Retry-After', '1')
+        self.send_header('Content-Type', 'application/json')
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_file(self, path):
+
+        status_code, headers, body = self.server.stub.respond_file(path, self.headers.get('Range'))
+        self.send_response(status_code)
+        if status_code == 429:
+            self.send_header('Retry-After', '1')
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format % args)
@@ -0,0 +1,100 @@
+import logging
+import time
+import heapq
+
+class TrigramIndex(object):
+    '''Trigram index for typo-tolerant searches over a list of names, i.e.:
+    reference designators, streams or parameters.  Each name is split into its
+    overlapping, case-insensitive 3 character substrings (trigrams) and each
+    trigram maps to the names containing it.
+
+    A query is scored against each name sharing one or more of its trigrams.
+    The score is the fraction of the query trigrams found in the name, so that
+    partial names score as high as full names, with ties ranked by the trigram
+    similarity (Jaccard index) of the query and the name, then by name.
+
+    Parameters:
+        names: iterable of strings to index
+    '''
+
+    def __init__(self, names):
+
+        self._logger = logging.getLogger(__name__)
+
+        self._names = sorted(set(names))
+        self._num_trigrams = []
+        postings = {}
+        for (i, name) in enumerate(self._names):
+            trigrams = _trigrams(name)
+            self._num_trigrams.append(len(trigrams))
+            for t in trigrams:
+                postings.setdefault(t, []).append(i)
+
+        self._postings = postings
+
+    @property
+    def size(self):
+        return len(self._names)
+
+    def search(self, query, limit=10, min_score=0.5, time_budget=None):
+        '''Return the list of up to limit (name, score) tuples best matching the
+        query, ranked by decreasing score.
+
+        Parameters:
+            query: partial or full name, possibly misspelled
+            limit: maximum number of matches (Default is 10)
+            min_score: minimum fraction of the query trigrams found in a name,
+                from 0 to 1 (Default is 0.5)
+            time_budget: maximum number of seconds spent collecting candidates.
+                Trigrams are visited from the rarest to the most common, so that
+                the most selective ones are counted first if the budget runs out,
+                in which case the scores are relative to the trigrams visited.
+                Default is no limit.
+        '''
+
+        query_trigrams = _trigrams(query)
+        if not query_trigrams:
+            # Queries shorter than a trigram are matched as substrings
+            if not query:
+                return []
+            query = query.lower()
+            return [(n, 1.0) for n in self._names if n.lower().find(query) >= 0][:limit]
+
+        start_time = time.time()
+
+        postings = sorted([self._postings[t] for t in query_trigrams if t in self._postings], key=len)
+
+        # Query trigrams not found in any name count as visited
+        num_query = len(query_trigrams) - len(postings)
+
+        shared = {}
+        for posting in postings:
+            for i in posting:
+                shared[i] = shared.get(i, 0) + 1
+            num_query += 1
+            if time_budget is not None and time.time() - start_time > time_budget:
+                self._logger.debug('Time budget exceeded: {:s}'.format(query))
+                break
+
+        ranked = []
+        for (i, count) in shared.items():
+            score = float(count) / num_query
+            if score < min_score:
+                continue
+            similarity = float(count) / (num_query + self._num_trigrams[i] - count)
+            ranked.append((-score, -similarity, self._names[i]))
+
+        return [(name, -score) for (score, similarity, name) in heapq.nsmallest(limit, ranked)]
+
+    def __len__(self):
+        return len(self._names)
+
+    def __repr__(self):
+        return '<TrigramIndex(names={:0.0f}, trigrams={:0.0f})>'.format(len(self._names), len(self._postings))
+
+def _trigrams(s):
+    '''Return the set of lower case trigrams in s'''
+
+    s = s.lower()
+
+    return set([s[i:i+3] for i in range(len(s) - 2)])
@@ -0,0 +1,55 @@
+import logging
+import sys
+
+_logger = logging.getLogger(__name__)
+
+def read_batch_queries(batch_file, valid_options=()):
+    '''Generator yielding a (reference_designator, options) tuple for each query in
+    the batch_file.  Each line contains a partial or fully-qualified reference
+    designator optionally followed by whitespace-separated name=value options:
+
+        CE01ISSM-MFD35-02-PRESFA000 telemetry=recovered start_date=2017-01-01
+
+    Blank lines and lines beginning with # are skipped.  Lines containing options
+    not in valid_options are logged and skipped.
+
+    Parameters:
+        batch_file: name of the file containing the queries or - to read STDIN
+        valid_options: names of the options that may be specified on each line
+    '''
+
+    if batch_file == '-':
+        fid = sys.stdin
+    else:
+        fid = open(batch_file)
+
+    try:
+        for line_num, line in enumerate(fid, 1):
+
+            tokens = line.split()
+            if not tokens or tokens[0].startswith('#'):
+                continue
+
+            options = {}
+            for token in tokens[1:]:
+                if token.find('=') < 1:
+                    _logger.warning('{:s}:{:0.0f}: Invalid option ({:s})'.format(batch_file, line_num, token))
+                    options = None
+                    break
+
+                (name, value) = token.split('=', 1)
+                if name not in valid_options:
+                    _logger.warning('{:s}:{:0.0f}: Invalid option ({:s})'.format(batch_file, line_num, name))
+                    options = None
+                    break
+
+                options[name] = value
+
+            if options is None:
+                continue
+
+            yield tokens[0], options
+
+    finally:
+        if fid is not sys.stdin:
+            fid.close()
@@ -0,0 +1,161 @@
+import logging
+import csv
+import datetime
+from dateutil import parser
+from m2m.M2mClient import _to_epoch_ms
+
+# Columns of the stream coverage matrix
+COVERAGE_COLUMNS = ('reference_designator',
+    'method',
+    'stream',
+    'begin_ms',
+    'end_ms',
+    'deployment_number',
+    'deployment_start_ms',
+    'deployment_stop_ms',
+    'coverage_start_ms',
+    'coverage_stop_ms',
+    'active')
+
+# Columns containing unix timestamps, in milliseconds
+_TIME_COLUMNS = ('begin_ms',
+    'end_ms',
+    'deployment_start_ms',
+    'deployment_stop_ms',
+    'coverage_start_ms',
+    'coverage_stop_ms')
+
+_logger = logging.getLogger(__name__)
+
+def build_coverage_matrix(client, ref_des=None, deployments=True):
+    '''Return the stream coverage matrix, as a dictionary mapping each of the
+    COVERAGE_COLUMNS to a list of values, for all streams produced by the partial
+    or fully-qualified reference designator (Default is all instruments).  Each
+    row joins the stream time coverage (beginTime and endTime from the table of
+    contents) with one deployment of the instrument that overlaps it.  The
+    coverage_start_ms and coverage_stop_ms columns contain the overlap.  Streams
+    with no overlapping deployment have one row with empty deployment columns.
+
+    Deployment events are fetched with one query per subsite or node, sent
+    concurrently (see M2mClient.query_deployments_batch), instead of one query per
+    instrument.
+
+    Parameters:
+        client: M2mClient or M2mDaemonClient instance
+        ref_des: partial or fully-qualified reference designator
+        deployments: join the deployment events (Default is True).  If False, one
+            row is returned for each stream.
+    '''
+
+    if ref_des:
+        instruments = client.search_instruments(ref_des, metadata=True)
+    else:
+        instruments = sorted(client.toc['instruments'], key=lambda i: i['reference_designator'])
+
+    events = {}
+    if deployments and instruments:
+        events = _query_deployments(client, ref_des)
+
+    columns = {c:[] for c in COVERAGE_COLUMNS}
+
+    for instrument in instruments:
+
+        reference_designator = instrument['reference_designator']
+        instrument_events = events.get(reference_designator, [])
+
+        for stream in sorted(instrument['streams'], key=lambda s: (s['stream'], s['method'])):
+
+            try:
+                begin_ms = _to_epoch_ms(parser.parse(stream['beginTime']))
+                end_ms = _to_epoch_ms(parser.parse(stream['endTime']))
+            except ValueError as e:
+                _logger.warning('{:s}-{:s}: Invalid stream time coverage ({:s})'.format(reference_designator, stream['stream'], str(e)))
+                continue
+
+            num_rows = 0
+            for event in instrument_events:
+
+                # Active deployments extend to the end of the stream
+                stop_ms = event['event_stop_ms'] or end_ms
+                if event['event_start_ms'] > end_ms or stop_ms < begin_ms:
+                    continue
+
+                _append_row(columns, reference_designator, stream, begin_ms, end_ms,
+                    event['deployment_number'],
+                    event['event_start_ms'],
+                    event['event_stop_ms'],
+                    max(begin_ms, event['event_start_ms']),
+                    min(end_ms, stop_ms),
+                    event['active'])
+                num_rows += 1
+
+            if not num_rows:
+                _append_row(columns, reference_designator, stream, begin_ms, end_ms, None, None, None, begin_ms, end_ms, None)
+
+    return columns
+
+def write_coverage_csv(columns, fid):
+    '''Write the coverage matrix to the open file fid as CSV, with timestamps
+    formatted as ISO-8601 strings with second resolution and empty values for
+    missing deployment columns.  Returns the number of rows written.'''
+
+    csv_writer = csv.writer(fid)
+    csv_writer.writerow([c.replace('_ms', '') for c in COVERAGE_COLUMNS])
+
+    num_rows = len(columns['reference_designator'])
+    formatted = [[_format_ms(v) for v in columns[c]] if c in _TIME_COLUMNS else columns[c] for c in COVERAGE_COLUMNS]
+    for row in zip(*formatted):
+        csv_writer.writerow(['' if v is None else v for v in row])
+
+    return num_rows
+
+def write_coverage_parquet(columns, path):
+    '''Write the coverage matrix to the Parquet file path, with timestamp columns
+    stored as UTC millisecond timestamps.  Requires pyarrow.  Returns the number
+    of rows written.'''
+
+    import pyarrow
+    import pyarrow.parquet
+
+    arrays = []
+    for c in COVERAGE_COLUMNS:
+        if c in _TIME_COLUMNS:
+            arrays.append(pyarrow.array(columns[c], type=pyarrow.timestamp('ms', tz='UTC')))
+        else:
+            arrays.append(pyarrow.array(columns[c]))
+
+    table = pyarrow.Table.from_arrays(arrays, names=[c.replace('_ms', '') for c in COVERAGE_COLUMNS])
+    pyarrow.parquet.write_table(table, path)
+
+    return table.num_rows
+
+def _query_deployments(client, ref_des):
+    '''Return a dictionary mapping each reference designator to its deployment
+    events, sorted by start time'''
+
+    events = client.query_deployments_batch(ref_des)
+    for reference_designator in events:
+        events[reference_designator].sort(key=lambda e: e['event_start_ms'])
+
+    return events
+
+def _append_row(columns, reference_designator, stream, begin_ms, end_ms, deployment_number, deployment_start_ms, deployment_stop_ms, coverage_start_ms, coverage_stop_ms, active):
+
+    columns['reference_designator'].append(reference_designator)
+    columns['method'].append(stream['method'])
+    columns['stream'].append(stream['stream'])
+    columns['begin_ms'].append(begin_ms)
+    columns['end_ms'].append(end_ms)
+    columns['deployment_number'].append(deployment_number)
+    columns['deployment_start_ms'].append(deployment_start_ms)
+    columns['deployment_stop_ms'].append(deployment_stop_ms)
+    columns['coverage_start_ms'].append(coverage_start_ms)
+    columns['coverage_stop_ms'].append(coverage_stop_ms)
+    columns['active'].append(active)
+
+def _format_ms(ms):
+
+    if ms is None:
+        return None
+
+    return datetime.datetime.utcfromtimestamp(ms // 1000).strftime('%Y-%m-%dT%H:%M:%SZ')
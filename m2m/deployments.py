@@ -0,0 +1,159 @@
+import logging
+import datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Format of the event_start_ts and event_stop_ts deployment event timestamps
+DEPLOYMENT_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+_logger = logging.getLogger(__name__)
+
+def normalize_deployment_events(raw_events, status=None, ref_des_search_string=None, refdes_index=None):
+    '''Convert the raw UFrame deployment events to concise instrument deployment
+    events and filter them by status and reference designator.  Returns the
+    (raw_events, events) tuple of the raw events kept and their concise events,
+    in response order.
+
+    Events without a fully-qualified reference designator or eventStartTime are
+    dropped.  The status and reference designator filters are applied in a
+    single loop.  The event_start_ts and event_stop_ts timestamps of the events
+    kept are formatted with render_timestamps.
+
+    Parameters:
+        raw_events: list of raw deployment events returned by the
+            /events/deployment/query end point
+        status: all (Default), active or inactive
+        ref_des_search_string: keep only the events whose fully-qualified
+            reference designator contains this string
+        refdes_index: RefDesIndex used to look up the fully-qualified reference
+            designators, which are then shared with the table of contents,
+            instead of formatting them
+    '''
+
+    valid_events = []
+    for event in raw_events:
+
+        # Event must have a fully qualified reference designator
+        if not event['referenceDesignator']['full']:
+            _logger.warning('{:s}: Invalid instrument for event id={:0.0f}\n'.format(event['eventName'], event['eventId']))
+            continue
+
+        # Events must have a eventStartTime to be considered valid
+        if not event['eventStartTime']:
+            _logger.warning('{:s}: Deployment event (id={:0.0f}) has no eventStartTime\n'.format(event['eventName'], event['eventId']))
+            continue
+
+        valid_events.append(event)
+
+    if not valid_events:
+        return [], []
+
+    ref_des = [_reference_designator(e['referenceDesignator'], refdes_index) for e in valid_events]
+
+    status = status.lower() if status else None
+
+    keep = _select_events(valid_events, ref_des, status, ref_des_search_string)
+
+    selected_events = [valid_events[k] for k in keep]
+    events = render_timestamps([_concise_event(valid_events[k], ref_des[k]) for k in keep])
+
+    return selected_events, events
+
+def format_epoch_ms(ms):
+    '''Return the unix timestamp, in milliseconds, formatted as an ISO-8601
+    DEPLOYMENT_TIME_FORMAT string'''
+
+    return (_EPOCH + datetime.timedelta(milliseconds=ms)).strftime(DEPLOYMENT_TIME_FORMAT)
+
+def format_epoch_ms_array(ms):
+    '''Return the list of unix timestamps, in milliseconds, formatted as ISO-8601
+    DEPLOYMENT_TIME_FORMAT strings, using a single numpy conversion if numpy is
+    installed'''
+
+    if not len(ms):
+        return []
+
+    if numpy is None:
+        return [format_epoch_ms(t) for t in ms]
+
+    dt = numpy.asarray(ms, dtype='int64').astype('datetime64[ms]')
+
+    return numpy.char.add(numpy.datetime_as_string(dt, unit='us'), 'Z').tolist()
+
+def render_timestamps(events):
+    '''Set the event_start_ts and event_stop_ts ISO-8601 timestamps of the concise
+    deployment events from their event_start_ms and event_stop_ms times, with one
+    bulk conversion for all start times and one for all stop times.  Returns
+    events.'''
+
+    if not events:
+        return events
+
+    for (event, ts) in zip(events, format_epoch_ms_array([e['event_start_ms'] for e in events])):
+        event['event_start_ts'] = ts
+
+    inactive = [e for e in events if e['event_stop_ms']]
+    for (event, ts) in zip(inactive, format_epoch_ms_array([e['event_stop_ms'] for e in inactive])):
+        event['event_stop_ts'] = ts
+    for event in events:
+        if not event['event_stop_ms']:
+            event['event_stop_ts'] = None
+
+    return events
+
+def _select_events(events, ref_des, status, ref_des_search_string):
+    '''Return the indexes of the events passing the filters'''
+
+    if status not in ('active', 'inactive') and not ref_des_search_string:
+        return list(range(len(events)))
+
+    keep = []
+    for (k, event) in enumerate(events):
+
+        active = not event['eventStopTime']
+
+        # Optionally filter the event based on it's status (None, 'all', 'active', 'inactive')
+        if status == 'active' and not active:
+            continue
+        elif status == 'inactive' and active:
+            continue
+
+        # Search the reference_designator for ref_des_search_string if specified
+        if ref_des_search_string and ref_des[k].find(ref_des_search_string) == -1:
+            continue
+
+        keep.append(k)
+
+    return keep
+
+def _reference_designator(r, refdes_index):
+    '''Return the fully-qualified reference designator of the raw event
+    referenceDesignator'''
+
+    if refdes_index:
+        reference_designator = refdes_index.reference_designator(r['subsite'], r['node'], r['sensor'])
+        if reference_designator:
+            return reference_designator
+
+    return '{:s}-{:s}-{:s}'.format(r['subsite'], r['node'], r['sensor'])
+
+def _concise_event(event, reference_designator):
+    '''Return the concise instrument deployment event for the raw event'''
+
+    r = event['referenceDesignator']
+
+    return {'instrument' : {'reference_designator' : reference_designator,
+            'node' : r['node'],
+            'full' : r['full'],
+            'subsite' : r['subsite'],
+            'sensor' : r['sensor']},
+        'event_start_ms' : event['eventStartTime'],
+        'event_stop_ms' : event['eventStopTime'],
+        'deployment_number' : event['deploymentNumber'],
+        'active' : not event['eventStopTime'],
+        'valid' : True}
@@ -0,0 +1,244 @@
+import re
+import json
+import codecs
+import numbers
+from json.scanner import py_make_scanner
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Insignificant JSON whitespace
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# Longest JSON token a chunk boundary may cut into an invalid value (Infinity)
+_MAX_TOKEN_LENGTH = 8
+
+# Position of a decode error in the python 2 error messages
+_ERROR_POSITION = re.compile(r'\(char (\d+)')
+
+# Pure python decoder, used to locate the errors reported without a position by
+# the python 2 C scanner
+_PY_DECODER = json.JSONDecoder()
+_PY_DECODER.scan_once = py_make_scanner(_PY_DECODER)
+
+def iter_particles(chunks):
+    '''Generator yielding each particle of the JSON array returned by data requests
+    for application_type='json', decoded from the iterable of byte or text chunks
+    of the response body (i.e.: requests.Response.iter_content) as they arrive.
+    Only the particle being decoded is buffered, so memory use does not depend on
+    the number of particles.
+
+    Raises ValueError if the body is not a JSON array, contains an invalid
+    particle or is truncated.
+    '''
+
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+
+    def read():
+        for chunk in chunks:
+            if isinstance(chunk, bytes):
+                chunk = utf8.decode(chunk)
+            if chunk:
+                return chunk
+        return None
+
+    buf = u''
+    pos = 0
+    started = False
+    # Number of particles decoded and whether a particle or delimiter is next
+    num_particles = 0
+    expect_particle = True
+
+    while True:
+
+        pos = _WHITESPACE.match(buf, pos).end()
+        if pos == len(buf):
+            chunk = read()
+            if chunk is None:
+                raise ValueError('Truncated JSON array: {:0.0f} particles decoded'.format(num_particles))
+            buf = chunk
+            pos = 0
+            continue
+
+        if not started:
+            if buf[pos] != '[':
+                raise ValueError('Response is not a JSON array')
+            started = True
+            pos += 1
+            continue
+
+        if buf[pos] == ']' and (not expect_particle or num_particles == 0):
+            return
+
+        if not expect_particle:
+            if buf[pos] != ',':
+                raise ValueError('Expecting , delimiter after particle {:0.0f}'.format(num_particles))
+            expect_particle = True
+            pos += 1
+            continue
+
+        try:
+            (particle, end) = decoder.raw_decode(buf, pos)
+        except ValueError as e:
+            if not _is_truncated(e, buf, pos):
+                raise ValueError('Invalid particle {:0.0f}: {:s}'.format(num_particles + 1, str(e)))
+            # The particle continues in the next chunk
+            chunk = read()
+            if chunk is None:
+                raise ValueError('Truncated JSON array: {:0.0f} particles decoded'.format(num_particles))
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+
+        yield particle
+
+        num_particles += 1
+        expect_particle = False
+        pos = end
+
+def iter_particle_batches(particles, batch_size=1000):
+    '''Generator yielding the particles in batches of batch_size.  If numpy is
+    installed, each batch is a numpy record array with a field for each scalar
+    particle value, named after the parameter.  Nested values (i.e.: pk) are not
+    included.  The type of each field is taken from the first batch containing
+    it: numbers are float64, with missing and null values set to NaN, booleans
+    are bool, with missing values set to False, and all other values, including
+    fields of mixed types, are Python objects, with missing values set to None.
+    Fields whose values are all null are float64.  Fields first found in a later
+    batch are added from that batch on, and a field is changed to Python objects,
+    from that batch on, if a later batch has a value of another type.  If numpy
+    is not installed, each batch is a list of particles.
+
+    Parameters:
+        particles: iterable of particles, i.e.: from iter_particles
+        batch_size: number of particles in each batch (Default is 1000)
+    '''
+
+    # Fields of the batches so far and the names of the nested values
+    dtype = []
+    nested = set()
+    batch = []
+    for particle in particles:
+        batch.append(particle)
+        if len(batch) < batch_size:
+            continue
+        yield _to_records(batch, dtype, nested)
+        batch = []
+
+    if batch:
+        yield _to_records(batch, dtype, nested)
+
+def _is_truncated(e, buf, start):
+    '''Return True if the decode error e, raised decoding the particle at start in
+    buf, may be caused by the particle continuing past the end of buf'''
+
+    # Strings cut by the end of buf, the second from python 2 when only the
+    # opening quote is in buf
+    message = str(e)
+    if message.startswith('Unterminated string') or message == 'end is out of bounds':
+        return True
+
+    pos = getattr(e, 'pos', None)
+    if pos is None:
+        match = _ERROR_POSITION.search(message)
+        if not match:
+            try:
+                _PY_DECODER.raw_decode(buf, start)
+            except ValueError as py_error:
+                if str(py_error).startswith('Unterminated string'):
+                    return True
+                match = _ERROR_POSITION.search(str(py_error))
+        pos = int(match.group(1)) if match else start
+
+    return len(buf) - pos <= _MAX_TOKEN_LENGTH
+
+def _update_dtype(particles, dtype, nested):
+    '''Add the (name, type) fields of the scalar particle values not already in
+    dtype, keeping dtype sorted by name, and the names of the nested values to
+    nested'''
+
+    names = set()
+    for particle in particles:
+        names.update(particle.keys())
+
+    names.difference_update([name for (name, column_type) in dtype])
+    names.difference_update(nested)
+    if not names:
+        return
+
+    kinds = {name:None for name in names}
+    for particle in particles:
+        for name in names:
+            value = particle.get(name)
+            # Nulls are missing values of any type
+            if value is None or kinds[name] in ('nested', 'object'):
+                continue
+            if isinstance(value, (dict, list)):
+                kind = 'nested'
+            elif isinstance(value, bool):
+                kind = 'bool'
+            elif isinstance(value, numbers.Real):
+                kind = 'float'
+            else:
+                kind = 'object'
+            if kind != 'nested' and kinds[name] not in (None, kind):
+                kind = 'object'
+            kinds[name] = kind
+
+    types = {None : numpy.float64,
+        'bool' : numpy.bool_,
+        'float' : numpy.float64,
+        'object' : object}
+
+    for (name, kind) in kinds.items():
+        if kind == 'nested':
+            nested.add(name)
+        else:
+            dtype.append((str(name), types[kind]))
+
+    dtype.sort(key=lambda field: field[0])
+
+def _to_records(particles, dtype, nested):
+    '''Return the particles as a numpy record array, or the list of particles if
+    numpy is not installed.  dtype and nested are updated with the fields first
+    found in particles, and fields with a value that does not fit their type are
+    changed to Python objects in dtype, which is kept for the following
+    batches.'''
+
+    if numpy is None:
+        return particles
+
+    _update_dtype(particles, dtype, nested)
+    if not dtype:
+        return numpy.recarray(len(particles), dtype=numpy.dtype([]))
+
+    columns = []
+    for (k, (name, column_type)) in enumerate(dtype):
+        values = [p.get(name) for p in particles]
+        if column_type is not object and not _fits(values, column_type):
+            column_type = object
+            dtype[k] = (name, object)
+        if column_type is numpy.float64:
+            column = numpy.array([numpy.nan if v is None else v for v in values], dtype=column_type)
+        elif column_type is numpy.bool_:
+            column = numpy.array([bool(v) for v in values], dtype=column_type)
+        else:
+            # Filled one value at a time so that list values are not broadcast
+            column = numpy.empty(len(values), dtype=object)
+            for (i, v) in enumerate(values):
+                column[i] = v
+        columns.append(column)
+
+    return numpy.rec.fromarrays(columns, dtype=numpy.dtype(dtype))
+def _fits(values, column_type):
+    '''Return True if all of the non-null values are of the float64 or bool
+    column_type'''
+
+    if column_type is numpy.bool_:
+        return all(v is None or isinstance(v, bool) for v in values)
+
+    return all(v is None or (isinstance(v, numbers.Real) and not isinstance(v, bool)) for v in values)
@@ -0,0 +1,167 @@
+import random
+import datetime
+import calendar
+
+# Building blocks for realistic reference designators and stream names
+_ARRAYS = ('CE', 'CP', 'GA', 'GI', 'GP', 'GS', 'RS')
+_SITE_TYPES = ('ISSM', 'ISSP', 'SHSM', 'OSPM', 'SUMO', 'PROF')
+_NODE_TYPES = ('MFD', 'SBD', 'RID', 'MFC', 'DP0', 'SF0')
+_INSTRUMENT_CLASSES = ('CTDBP', 'DOSTA', 'FLORT', 'PARAD', 'VELPT', 'ADCPT',
+    'PCO2W', 'PHSEN', 'NUTNR', 'OPTAA', 'SPKIR', 'METBK', 'PRESF', 'ZPLSC')
+_METHODS = ('telemetered', 'recovered_host', 'recovered_inst', 'streamed')
+
+# Parameters produced by every stream
+_COMMON_PARAMETERS = ('time',
+    'port_timestamp',
+    'driver_timestamp',
+    'internal_timestamp',
+    'preferred_timestamp',
+    'ingestion_timestamp')
+
+_EPOCH = datetime.datetime(2013, 1, 1)
+
+def build_synthetic_toc(num_subsites=20, nodes_per_subsite=4, instruments_per_node=6, streams_per_instrument=3, parameters_per_stream=25, seed=0):
+    '''Return a synthetic UI table of contents, with the same structure as the
+    /sensor/inv/toc response, containing num_subsites * nodes_per_subsite *
+    instruments_per_node instruments.  Instruments of the same class produce the
+    same streams, each instrument produces streams_per_instrument stream and
+    delivery method combinations and each stream contains parameters_per_stream
+    parameters, including the timestamp parameters shared by all streams.
+
+    Parameters:
+        num_subsites: number of subsites
+        nodes_per_subsite: number of nodes on each subsite
+        instruments_per_node: number of instruments on each node
+        streams_per_instrument: number of stream and delivery method combinations
+            produced by each instrument
+        parameters_per_stream: number of parameters contained in each stream
+        seed: random number generator seed.  The same arguments and seed always
+            produce the same table of contents.
+    '''
+
+    rng = random.Random(seed)
+
+    parameter_definitions = []
+    parameter_ids = {}
+    parameters_by_stream = {}
+
+    def parameter_id(particle_key):
+        if particle_key not in parameter_ids:
+            pd_id = 'PD{:0.0f}'.format(len(parameter_ids) + 1)
+            parameter_ids[particle_key] = pd_id
+            parameter_definitions.append({'pdId' : pd_id,
+                'particle_key' : particle_key,
+                'type' : 'FLOAT',
+                'unsigned' : False,
+                'shape' : 'SCALAR',
+                'fill_value' : '-9999999',
+                'units' : '1',
+                'display_name' : particle_key.replace('_', ' ').title()})
+        return parameter_ids[particle_key]
+
+    # Streams produced by each instrument class.  Each stream is delivered by
+    # two methods, i.e.: telemetered and recovered_host
+    class_streams = {}
+    for instrument_class in _INSTRUMENT_CLASSES:
+        streams = []
+        for s in range(streams_per_instrument // 2 + 1):
+            stream = '{:s}_{:s}_instrument'.format(instrument_class.lower(), ('sample', 'cdef_dcl', 'metadata', 'engineering')[s % 4])
+            if s >= 4:
+                stream = '{:s}_{:0.0f}'.format(stream, s)
+            streams.append(stream)
+
+            pd_ids = [parameter_id(p) for p in _COMMON_PARAMETERS]
+            for p in range(max(0, parameters_per_stream - len(_COMMON_PARAMETERS))):
+                pd_ids.append(parameter_id('{:s}_{:s}_{:0.0f}'.format(instrument_class.lower(), ('temperature', 'pressure', 'conductivity', 'voltage', 'counts')[p % 5], p)))
+            parameters_by_stream[stream] = pd_ids
+        class_streams[instrument_class] = streams
+
+    instruments = []
+    subsites = set()
+    while len(subsites) < num_subsites:
+        subsites.add('{:s}{:02d}{:s}'.format(rng.choice(_ARRAYS), rng.randint(1, 99), rng.choice(_SITE_TYPES)))
+
+    for subsite in sorted(subsites):
+        nodes = set()
+        while len(nodes) < nodes_per_subsite:
+            nodes.add('{:s}{:02d}'.format(rng.choice(_NODE_TYPES), rng.randint(0, 99)))
+
+        for node in sorted(nodes):
+            for i in range(instruments_per_node):
+                instrument_class = _INSTRUMENT_CLASSES[rng.randrange(len(_INSTRUMENT_CLASSES))]
+                sensor = '{:02d}-{:s}{:s}{:03d}'.format(i + 1, instrument_class, rng.choice('ABCDEF'), rng.randint(0, 999))
+                reference_designator = '{:s}-{:s}-{:s}'.format(subsite, node, sensor)
+
+                streams = []
+                for s in range(streams_per_instrument):
+                    stream = class_streams[instrument_class][s // 2]
+                    method = _METHODS[s % len(_METHODS)]
+                    begin_dt = _EPOCH + datetime.timedelta(days=rng.randint(0, 1000), seconds=rng.randint(0, 86399))
+                    end_dt = begin_dt + datetime.timedelta(days=rng.randint(1, 1500), seconds=rng.randint(0, 86399))
+                    streams.append({'stream' : stream,
+                        'method' : method,
+                        'sensor' : reference_designator,
+                        'count' : rng.randint(1, 10000000),
+                        'beginTime' : _format_ts(begin_dt),
+                        'endTime' : _format_ts(end_dt)})
+
+                instruments.append({'reference_designator' : reference_designator,
+                    'platform_code' : subsite,
+                    'mooring_code' : node,
+                    'instrument_code' : sensor,
+                    'instrument_display_name' : instrument_class,
+                    'streams' : streams})
+
+    return {'instruments' : instruments,
+        'parameter_definitions' : parameter_definitions,
+        'parameters_by_stream' : parameters_by_stream}
+
+def build_synthetic_deployment_events(toc, deployments_per_instrument=3, seed=0):
+    '''Return the list of raw deployment events, with the same structure as the
+    /events/deployment/query response, for every instrument in the synthetic
+    table of contents.  The last deployment of every other instrument has no
+    eventStopTime, marking it as active.
+
+    Parameters:
+        toc: table of contents created by build_synthetic_toc
+        deployments_per_instrument: number of deployment events per instrument
+        seed: random number generator seed
+    '''
+
+    rng = random.Random(seed)
+
+    events = []
+    event_id = 0
+    for i, instrument in enumerate(toc['instruments']):
+        (subsite, node, sensor) = instrument['reference_designator'].split('-', 2)
+
+        start_dt = _EPOCH + datetime.timedelta(days=rng.randint(0, 200))
+        for d in range(deployments_per_instrument):
+            event_id = event_id + 1
+            stop_dt = start_dt + datetime.timedelta(days=rng.randint(90, 200))
+
+            event_stop_ms = _epoch_ms(stop_dt)
+            if d == deployments_per_instrument - 1 and i % 2 == 0:
+                event_stop_ms = None
+
+            events.append({'@class' : '.XDeployment',
+                'eventId' : event_id,
+                'eventName' : '{:s}-{:s}'.format(subsite, node),
+                'eventType' : 'DEPLOYMENT',
+                'deploymentNumber' : d + 1,
+                'eventStartTime' : _epoch_ms(start_dt),
+                'eventStopTime' : event_stop_ms,
+                'referenceDesignator' : {'full' : True,
+                    'subsite' : subsite,
+                    'node' : node,
+                    'sensor' : sensor}})
+
+            start_dt = stop_dt + datetime.timedelta(days=rng.randint(1, 30))
+
+    return events
+
+def _format_ts(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+def _epoch_ms(dt):
+    return calendar.timegm(dt.timetuple()) * 1000
@@ -0,0 +1,126 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+from m2m.BulkDownloader import BulkDownloader
+from m2m.StubM2mServer import StubM2mServer
+
+FILE_SIZE = 100000
+
+class BulkDownloaderTest(unittest.TestCase):
+    '''Downloads from the asynchronous request output directories served by
+    StubM2mServer'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.stub = StubM2mServer(file_size=FILE_SIZE)
+        cls.stub.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stub.stop()
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        self.directory_url = '{:s}/async_results/stub/request-1'.format(self.stub.base_url)
+        self.url = '{:s}/request-1.nc'.format(self.directory_url)
+
+        # Expected contents of the synthetic file
+        (status_code, headers, self.data) = self.stub.respond_file('/async_results/stub/request-1/request-1.nc')
+        self.md5 = hashlib.md5(self.data).hexdigest()
+
+        self.downloader = BulkDownloader(self.dir, chunk_size=4096, num_retries=0)
+        self.path = self.downloader.destination(self.url)
+        self.part_file = '{:s}.part'.format(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write_part(self, data):
+
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.part_file, 'wb') as fid:
+            fid.write(data)
+
+    def _read(self):
+
+        with open(self.path, 'rb') as fid:
+            return fid.read()
+
+    def test_list_files(self):
+        self.assertEqual(self.downloader.list_files(self.directory_url), [self.url])
+
+    def test_download(self):
+
+        result = self.downloader.download_file(self.url)
+
+        self.assertTrue(result['status'])
+        self.assertEqual(result['status_code'], 200)
+        self.assertEqual(result['bytes'], FILE_SIZE)
+        self.assertEqual(result['checksum'], self.md5)
+        self.assertEqual(self._read(), self.data)
+        self.assertFalse(os.path.exists(self.part_file))
+        self.assertEqual(self.downloader.manifest[self.url]['size'], FILE_SIZE)
+
+        # Completed files are skipped by later runs
+        result = BulkDownloader(self.dir).download_file(self.url, verify=True)
+        self.assertTrue(result['skipped'])
+
+    def test_resume(self):
+
+        self._write_part(self.data[:30000])
+
+        result = self.downloader.download_file(self.url)
+
+        self.assertTrue(result['status'])
+        self.assertEqual(result['status_code'], 206)
+        self.assertTrue(result['resumed'])
+        self.assertEqual(result['bytes'], FILE_SIZE - 30000)
+        self.assertEqual(result['checksum'], self.md5)
+        self.assertEqual(self._read(), self.data)
+
+    def test_resume_complete_part_file(self):
+
+        self._write_part(self.data)
+
+        result = self.downloader.download_file(self.url)
+
+        self.assertTrue(result['status'])
+        self.assertEqual(result['status_code'], 416)
+        self.assertEqual(result['bytes'], 0)
+        self.assertEqual(result['checksum'], self.md5)
+        self.assertEqual(self._read(), self.data)
+        self.assertFalse(os.path.exists(self.part_file))
+
+    def test_resume_larger_part_file(self):
+
+        self._write_part(self.data + b'extra')
+
+        # The part file is discarded and the retry downloads the whole file
+        result = BulkDownloader(self.dir, num_retries=1).download_file(self.url)
+
+        self.assertTrue(result['status'])
+        self.assertEqual(result['status_code'], 200)
+        self.assertEqual(self._read(), self.data)
+
+    def test_checksum_mismatch(self):
+
+        result = self.downloader.download_file(self.url, checksum='0' * 32)
+
+        self.assertFalse(result['status'])
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.part_file))
+        self.assertNotIn(self.url, self.downloader.manifest)
+
+    def test_metrics_labels(self):
+
+        self.downloader.download_file(self.url)
+
+        endpoints = [r['endpoint'] for r in self.downloader.metrics.to_dict()['requests']]
+        self.assertEqual(endpoints, ['async_results/*'])
+
+if __name__ == '__main__':
+    unittest.main()
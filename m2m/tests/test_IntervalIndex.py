@@ -0,0 +1,52 @@
+import random
+import unittest
+
+from m2m.IntervalIndex import IntervalIndex
+
+def _overlap(intervals, begin, end):
+    '''Brute force IntervalIndex.overlap'''
+    return sorted(v for (b, e, v) in intervals if b <= e and (end is None or b <= end) and (begin is None or e >= begin))
+
+class IntervalIndexTest(unittest.TestCase):
+
+    def setUp(self):
+
+        rng = random.Random(0)
+        self.intervals = []
+        for i in range(500):
+            begin = rng.randint(0, 10000)
+            self.intervals.append((begin, begin + rng.randint(0, 500), i))
+        # Invalid intervals are not indexed
+        self.intervals.append((20, 10, 'invalid'))
+        self.index = IntervalIndex(self.intervals)
+
+    def test_size(self):
+        self.assertEqual(len(self.index), 500)
+        self.assertEqual(IntervalIndex([]).overlap(None, None), [])
+
+    def test_overlap(self):
+
+        rng = random.Random(1)
+        for n in range(200):
+            begin = rng.randint(-100, 10600)
+            end = begin + rng.randint(0, 1000)
+            self.assertEqual(sorted(self.index.overlap(begin, end)), _overlap(self.intervals, begin, end))
+
+    def test_closed_bounds(self):
+
+        index = IntervalIndex([(10, 20, 'a'), (20, 30, 'b'), (31, 40, 'c')])
+        self.assertEqual(sorted(index.overlap(20, 20)), ['a', 'b'])
+        self.assertEqual(sorted(index.overlap(30, 31)), ['b', 'c'])
+        self.assertEqual(index.overlap(0, 9), [])
+        self.assertEqual(index.overlap(25, 20), [])
+
+    def test_open_bounds(self):
+        for (begin, end) in ((None, 5000), (5000, None), (None, None)):
+            self.assertEqual(sorted(self.index.overlap(begin, end)), _overlap(self.intervals, begin, end))
+
+    def test_at(self):
+        for t in (0, 15, 5000, 10500):
+            self.assertEqual(sorted(self.index.at(t)), _overlap(self.intervals, t, t))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from m2m.M2mRequest import M2mRequest, read_requests, write_requests
+
+M2M_BASE_URL = 'https://ooinet.oceanobservatories.org/api/m2m'
+
+class M2mRequestTest(unittest.TestCase):
+
+    def setUp(self):
+
+        options = {'format' : 'application/netcdf',
+            'limit' : -1,
+            'execDPA' : 'true',
+            'include_provenance' : 'true',
+            'user' : 'tester'}
+        self.requests = [M2mRequest(12576,
+            'CE01ISSM',
+            'MFD37',
+            '03-CTDBPC000',
+            'telemetered',
+            'ctdbp_cdef_dcl_instrument',
+            '2016-01-01T00:00:00.000Z',
+            '2016-02-01T00:00:00.000Z',
+            options),
+            M2mRequest(12576,
+            'RS01SBPS',
+            'SF01A',
+            '2A-CTDPFA102',
+            'streamed',
+            'ctdpf_sbe43_sample',
+            '2017-01-01T00:00:00.000Z',
+            '2017-01-02T00:00:00.000Z',
+            {'format' : 'application/json', 'limit' : 1000})]
+
+    def test_url(self):
+
+        request = self.requests[0]
+        self.assertEqual(request.reference_designator, 'CE01ISSM-MFD37-03-CTDBPC000')
+        self.assertEqual(request.url(M2M_BASE_URL),
+            '{:s}/12576/sensor/inv/CE01ISSM/MFD37/03-CTDBPC000/telemetered/ctdbp_cdef_dcl_instrument?beginDT=2016-01-01T00:00:00.000Z&endDT=2016-02-01T00:00:00.000Z&format=application/netcdf&limit=-1&execDPA=true&include_provenance=true&user=tester'.format(M2M_BASE_URL))
+
+    def test_url_round_trip(self):
+        for request in self.requests:
+            self.assertEqual(M2mRequest.from_url(request.url(M2M_BASE_URL)), request)
+
+    def test_not_a_stream_request(self):
+        self.assertIsNone(M2mRequest.from_url('{:s}/12576/sensor/inv/toc'.format(M2M_BASE_URL)))
+        self.assertIsNone(M2mRequest.from_url('{:s}/12587/events/deployment/inv/CE01ISSM/MFD37/03-CTDBPC000'.format(M2M_BASE_URL)))
+        self.assertIsNone(M2mRequest.from_url('{:s}/12576/sensor/inv/CE01ISSM/MFD37/03-CTDBPC000/telemetered/ctdbp_cdef_dcl_instrument'.format(M2M_BASE_URL)))
+
+    def test_dict_round_trip(self):
+        for request in self.requests:
+            self.assertEqual(M2mRequest.from_dict(request.to_dict()), request)
+        self.assertNotIn('email', self.requests[0].to_dict())
+
+    def test_file_round_trip(self):
+
+        for file_format in ('jsonl', 'csv', 'url'):
+            fid = StringIO()
+            self.assertEqual(write_requests(self.requests, fid, file_format=file_format, m2m_base_url=M2M_BASE_URL), len(self.requests))
+            fid.seek(0)
+            self.assertEqual(list(read_requests(fid, file_format=file_format)), self.requests, file_format)
+
+    def test_invalid_lines_skipped(self):
+
+        fid = StringIO()
+        write_requests(self.requests, fid)
+        fid = StringIO('\n{not json}\n' + fid.getvalue() + '{"port": 12576}\n')
+        self.assertEqual(list(read_requests(fid)), self.requests)
+
+    def test_invalid_format(self):
+        with self.assertRaises(ValueError):
+            write_requests(self.requests, StringIO(), file_format='xml')
+        with self.assertRaises(ValueError):
+            write_requests(self.requests, StringIO(), file_format='url')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import tempfile
+import unittest
+
+from m2m.SharedToc import SharedToc, is_shared_toc, write_shared_toc
+
+class SharedTocTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.keys = [u'CE01ISSM-MFD35-02-PRESFA000', u'CE01ISSM-MFD37-03-CTDBPC000', u'RS01SBPS-SF01A-2A-CTDPFA102', u'caf\u00e9']
+        self.records = [{'reference_designator' : k, 'streams' : [{'stream' : 's{:0.0f}'.format(i)}]} for (i, k) in enumerate(self.keys)]
+
+        (fd, self.path) = tempfile.mkstemp(suffix='.m2m')
+        os.close(fd)
+        write_shared_toc(self.path, {'instruments' : (self.keys, self.records),
+            'subsites' : ([u'CE01ISSM', u'RS01SBPS'], None),
+            'empty' : ([], [])})
+        self.toc = SharedToc(self.path)
+
+    def tearDown(self):
+        self.toc.close()
+        os.remove(self.path)
+
+    def test_tables(self):
+        self.assertTrue(is_shared_toc(self.path))
+        self.assertEqual(self.toc.tables, ['empty', 'instruments', 'subsites'])
+        self.assertIn('subsites', self.toc)
+        with self.assertRaises(KeyError):
+            self.toc.keys('streams')
+        with self.assertRaises(KeyError):
+            self.toc.table('subsites')
+
+    def test_not_shared_toc(self):
+        with open(self.path, 'wb') as fid:
+            fid.write(b'{"instruments": []}')
+        self.assertFalse(is_shared_toc(self.path))
+        with self.assertRaises(ValueError):
+            SharedToc(self.path)
+
+    def test_string_table(self):
+
+        keys = self.toc.keys('instruments')
+
+        self.assertEqual(len(keys), len(self.keys))
+        self.assertEqual(list(keys), self.keys)
+        self.assertEqual([keys[i] for i in range(len(keys))], self.keys)
+        self.assertEqual(keys[-1], self.keys[-1])
+        self.assertEqual(keys[1:3], self.keys[1:3])
+        with self.assertRaises(IndexError):
+            keys[len(self.keys)]
+
+        self.assertEqual(keys.index(self.keys[2]), 2)
+        self.assertIn(self.keys[3], keys)
+        self.assertNotIn(u'CE01ISSM', keys)
+        with self.assertRaises(ValueError):
+            keys.index(u'CE02SHSM')
+
+    def test_string_table_text(self):
+
+        keys = self.toc.keys('instruments')
+        text = u''.join([k + u'\n' for k in self.keys]).encode('utf-8')
+
+        # Offsets are byte offsets of each key in the text
+        self.assertEqual(len(keys.text), len(text))
+        self.assertEqual(list(keys.offsets), [0] + [text.index(k.encode('utf-8')) for k in self.keys[1:]] + [len(text)])
+        self.assertEqual(keys.text.find(u'MFD37'), text.index(b'MFD37'))
+        self.assertEqual(keys.text.find(u'CE01ISSM', 1), text.index(b'CE01ISSM', 1))
+        self.assertEqual(keys.text.find(u'NOMATCH'), -1)
+
+    def test_record_table(self):
+
+        records = self.toc.table('instruments')
+
+        self.assertEqual(len(records), len(self.keys))
+        self.assertEqual(list(records), self.keys)
+        self.assertEqual(dict(records.items()), dict(zip(self.keys, self.records)))
+        self.assertEqual(records[self.keys[3]], self.records[3])
+        self.assertEqual(records.get(u'CE02SHSM'), None)
+        with self.assertRaises(KeyError):
+            records[u'CE02SHSM']
+
+        # Records are decoded on each access
+        records[self.keys[0]]['streams'] = []
+        self.assertEqual(records[self.keys[0]], self.records[0])
+
+    def test_empty_table(self):
+        self.assertEqual(len(self.toc.keys('empty')), 0)
+        self.assertEqual(dict(self.toc.table('empty')), {})
+
+    def test_mismatched_records(self):
+        with self.assertRaises(ValueError):
+            write_shared_toc(self.path, {'instruments' : (self.keys, self.records[:1])})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import json
+import math
+import unittest
+
+from m2m.particles import iter_particles, iter_particle_batches, numpy
+
+def _chunks(text, size):
+    '''Split the encoded text into chunks of size bytes'''
+    data = text.encode('utf-8')
+    return [data[i:i+size] for i in range(0, len(data), size)]
+
+class IterParticlesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.particles = [{'time' : 3.6e9 + i,
+            'pk' : {'sensor' : 'CTDBPA000', 'deployment' : i},
+            'temperature' : 10.5 + i,
+            'flag' : i % 2 == 0,
+            'comment' : u'\u00b0C "quoted" \\ value',
+            'missing' : None} for i in range(5)]
+        self.text = json.dumps(self.particles, indent=1)
+
+    def test_chunk_sizes(self):
+        for size in (1, 2, 3, 5, 7, 64, len(self.text) + 1):
+            self.assertEqual(list(iter_particles(_chunks(self.text, size))), self.particles)
+
+    def test_text_chunks(self):
+        chunks = [self.text[i:i+3] for i in range(0, len(self.text), 3)]
+        self.assertEqual(list(iter_particles(chunks)), self.particles)
+
+    def test_empty_array(self):
+        self.assertEqual(list(iter_particles([b' [', b' ] '])), [])
+
+    def test_not_an_array(self):
+        with self.assertRaises(ValueError):
+            list(iter_particles([b'{"message": "error"}']))
+
+    def test_truncated(self):
+        with self.assertRaises(ValueError):
+            list(iter_particles(_chunks(self.text[:-10], 4)))
+
+    def test_invalid_particle_fails_fast(self):
+
+        def chunks():
+            yield b'[{"a": 1}, {"a": tru}, {"a": 3}, {"a": 4}, '
+            # The rest of the body must not be read
+            raise AssertionError('Read past the invalid particle')
+
+        particles = iter_particles(chunks())
+        self.assertEqual(next(particles), {'a' : 1})
+        with self.assertRaises(ValueError):
+            next(particles)
+
+    def test_missing_delimiter(self):
+        with self.assertRaises(ValueError):
+            list(iter_particles([b'[{"a": 1} {"a": 2}]']))
+
+class IterParticleBatchesTest(unittest.TestCase):
+
+    def test_batch_sizes(self):
+        particles = [{'time' : float(i), 'value' : i} for i in range(7)]
+        batches = list(iter_particle_batches(particles, batch_size=3))
+        self.assertEqual([len(b) for b in batches], [3, 3, 1])
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_record_fields(self):
+        particles = [{'time' : 1., 'count' : 2, 'flag' : True, 'name' : 'a', 'pk' : {'deployment' : 1}},
+            {'time' : 2., 'flag' : False, 'name' : None, 'pk' : {'deployment' : 1}}]
+        (batch,) = list(iter_particle_batches(particles, batch_size=2))
+        self.assertEqual(sorted(batch.dtype.names), ['count', 'flag', 'name', 'time'])
+        self.assertEqual(batch.dtype['time'], numpy.float64)
+        self.assertEqual(batch.dtype['flag'], numpy.bool_)
+        self.assertEqual(list(batch['time']), [1., 2.])
+        self.assertEqual(batch['count'][0], 2)
+        self.assertTrue(math.isnan(batch['count'][1]))
+        self.assertEqual(list(batch['name']), ['a', None])
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_null_and_late_fields(self):
+        particles = [{'time' : 1., 'a' : None}, {'time' : 2., 'a' : 5., 'b' : 'x'}]
+        (first, second) = list(iter_particle_batches(particles, batch_size=1))
+        self.assertEqual(sorted(first.dtype.names), ['a', 'time'])
+        self.assertTrue(math.isnan(first['a'][0]))
+        self.assertEqual(sorted(second.dtype.names), ['a', 'b', 'time'])
+        self.assertEqual(second['a'][0], 5.)
+        self.assertEqual(second['b'][0], 'x')
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_widened_fields(self):
+        particles = [{'value' : 1.}, {'value' : 'n/a'}]
+        (first, second) = list(iter_particle_batches(particles, batch_size=1))
+        self.assertEqual(first.dtype['value'], numpy.float64)
+        self.assertEqual(second.dtype['value'], numpy.object_)
+        self.assertEqual(second['value'][0], 'n/a')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from m2m.tocfile import load_toc, save_toc, toc_compression, zstandard
+
+class TocFileTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.toc = {'instruments' : [{'reference_designator' : u'CE01ISSM-MFD37-03-CTDBPC000',
+                'streams' : [{'stream' : u'ctdbp_cdef_dcl_instrument', 'method' : u'telemetered'}]}],
+            'parameter_definitions' : [{'pdId' : u'PD7', 'particle_key' : u'time', 'units' : u'seconds since 1900-01-01'}],
+            'parameters_by_stream' : {u'ctdbp_cdef_dcl_instrument' : [u'PD7']}}
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _round_trip(self, name, compression=None):
+
+        path = os.path.join(self.dir, name)
+        used = save_toc(self.toc, path, compression=compression)
+        self.assertEqual(toc_compression(path), used)
+        self.assertEqual(load_toc(path), self.toc)
+        self.assertFalse(os.path.exists('{:s}.tmp'.format(path)))
+
+        return used
+
+    def test_extensions(self):
+        self.assertEqual(self._round_trip('toc.json'), 'none')
+        self.assertEqual(self._round_trip('toc.json.gz'), 'gzip')
+        self.assertEqual(self._round_trip('toc.json.bz2'), 'bz2')
+
+    def test_compression_overrides_extension(self):
+        for compression in ('none', 'gzip', 'bz2'):
+            self.assertEqual(self._round_trip('toc.json', compression=compression), compression)
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_zstd(self):
+        self.assertEqual(self._round_trip('toc.json.zst'), 'zstd')
+
+    @unittest.skipIf(zstandard is not None, 'zstandard is installed')
+    def test_zstd_not_installed(self):
+        with self.assertRaises(ValueError):
+            save_toc(self.toc, os.path.join(self.dir, 'toc.json.zst'))
+
+    def test_invalid_compression(self):
+        with self.assertRaises(ValueError):
+            save_toc(self.toc, os.path.join(self.dir, 'toc.json'), compression='lzma')
+
+    def test_invalid_json(self):
+
+        path = os.path.join(self.dir, 'toc.json')
+        with open(path, 'wb') as fid:
+            fid.write(b'{"instruments": [')
+        with self.assertRaises(ValueError):
+            load_toc(path)
+
+if __name__ == '__main__':
+    unittest.main()
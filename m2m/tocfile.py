@@ -0,0 +1,135 @@
+import os
+import json
+import gzip
+import bz2
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Table of contents file compression formats
+COMPRESSIONS = ('none',
+    'gzip',
+    'bz2',
+    'zstd')
+
+# File name extension of each compression format, used to choose the format
+# of saved files
+_EXTENSIONS = {'.gz' : 'gzip',
+    '.gzip' : 'gzip',
+    '.bz2' : 'bz2',
+    '.zst' : 'zstd',
+    '.zstd' : 'zstd'}
+
+# Leading bytes identifying compressed files
+_MAGIC_BYTES = ((b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'))
+
+# Size of the blocks read from zstd streams, which may not record the size of
+# the decompressed data
+_CHUNK_SIZE = 1 << 20
+
+def toc_compression(path):
+    '''Return the compression format of the table of contents file path, detected
+    from the leading bytes of the file: none, gzip, bz2 or zstd'''
+
+    with open(path, 'rb') as fid:
+        magic = fid.read(4)
+
+    for (magic_bytes, compression) in _MAGIC_BYTES:
+        if magic.startswith(magic_bytes):
+            return compression
+
+    return 'none'
+
+def load_toc(path):
+    '''Load and return the table of contents from the plain or compressed JSON
+    file path.  The compression format is detected from the file contents,
+    regardless of the file name.  The whole file is decompressed in memory and
+    then decoded at once, so a compressed file only saves disk space and read
+    time, not memory.  zstd files require the zstandard package.
+
+    Raises IOError/OSError if the file cannot be read and ValueError if it does
+    not contain valid JSON or is compressed with zstd and zstandard is not
+    installed.'''
+
+    compression = toc_compression(path)
+
+    if compression == 'gzip':
+        with gzip.open(path, 'rb') as fid:
+            return _decode(fid.read())
+    elif compression == 'bz2':
+        fid = bz2.BZ2File(path, 'rb')
+        try:
+            return _decode(fid.read())
+        finally:
+            fid.close()
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstandard is required to read zstd files: {:s}'.format(path))
+        with open(path, 'rb') as fid:
+            reader = zstandard.ZstdDecompressor().stream_reader(fid)
+            chunks = []
+            while True:
+                chunk = reader.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            return _decode(b''.join(chunks))
+
+    with open(path, 'rb') as fid:
+        return _decode(fid.read())
+
+def save_toc(toc, path, compression=None):
+    '''Write the table of contents to path as JSON, compressed as specified, and
+    return the compression format used.  The file is written to a temporary file
+    which is then renamed, so that other processes never read a partial file.
+
+    Parameters:
+        toc: table of contents, as returned by the /sensor/inv/toc end point
+        path: file to write
+        compression: none, gzip, bz2 or zstd.  Default is to choose the format
+            from the path extension: .gz, .bz2 or .zst, or none for any other
+            extension.  zstd requires the zstandard package.
+    '''
+
+    if not compression:
+        compression = _EXTENSIONS.get(os.path.splitext(path)[1].lower(), 'none')
+
+    if compression not in COMPRESSIONS:
+        raise ValueError('Invalid compression: {:s}'.format(compression))
+
+    if compression == 'zstd' and zstandard is None:
+        raise ValueError('zstandard is required to write zstd files: {:s}'.format(path))
+
+    data = json.dumps(toc).encode('utf-8')
+
+    tmp_path = '{:s}.tmp'.format(path)
+    if compression == 'gzip':
+        with gzip.open(tmp_path, 'wb') as fid:
+            fid.write(data)
+    elif compression == 'bz2':
+        fid = bz2.BZ2File(tmp_path, 'wb')
+        try:
+            fid.write(data)
+        finally:
+            fid.close()
+    elif compression == 'zstd':
+        with open(tmp_path, 'wb') as fid:
+            fid.write(zstandard.ZstdCompressor().compress(data))
+    else:
+        with open(tmp_path, 'wb') as fid:
+            fid.write(data)
+
+    os.rename(tmp_path, path)
+
+    return compression
+
+def _decode(data):
+
+    if not isinstance(data, str):
+        data = data.decode('utf-8')
+
+    return json.loads(data)
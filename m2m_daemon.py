@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+import logging
+import argparse
+import os
+import sys
+from m2m.M2mClient import M2mClient
+from m2m.M2mDaemon import M2mDaemon
+from m2m.tocfile import load_toc
+
+def main(args):
+    '''Run a resident service that keeps the UFrame table of contents, its indexes
+    and pooled HTTP connections loaded and answers search, stream, deployment and
+    request url queries over a local HTTP endpoint.  Point the search and request
+    scripts at the service with --daemon or the M2M_DAEMON_URL environment variable.'''
+
+    # Set up the m2m package logger
+    log_level = getattr(logging, args.loglevel.upper())
+    log_format = '%(asctime)s:%(module)s:%(levelname)s:%(message)s [line %(lineno)d]'
+    m2m_logger = logging.getLogger('m2m')
+    m2m_logger.setLevel(log_level)
+    ch = logging.StreamHandler()
+    formatter = logging.Formatter(log_format)
+    ch.setFormatter(formatter)
+    m2m_logger.addHandler(ch)
+
+    # Set up the stream logger
+    logger = logging.getLogger(__name__)
+    logger.setLevel(log_level)
+    sh = logging.StreamHandler()
+    sh_formatter = logging.Formatter('%(module)s:%(levelname)s:%(message)s [line %(lineno)d]')
+    sh.setFormatter(sh_formatter)
+    logger.addHandler(sh)
+
+    base_url = args.base_url
+    if not base_url:
+        base_url = os.getenv('UFRAME_BASE_URL')
+
+    if not base_url:
+        logger.error('No UFrame instance specified')
+        return 1
+
+    # Create the M2mClient instance
+    toc = None
+    if args.tocfile:
+        if not os.path.isfile(args.tocfile):
+            logger.error('Invalid TOC json file ({:s})'.format(args.tocfile))
+            return 1
+        try:
+            toc = load_toc(args.tocfile)
+        except (IOError, OSError, ValueError) as e:
+            logger.error(e)
+            return 1
+
+    uframe = M2mClient(base_url, timeout=args.timeout, api_username=args.api_username, api_token=args.api_token, toc=toc)
+    if not uframe.instruments:
+        logger.error('No table of contents found')
+        return 1
+
+    daemon = M2mDaemon(uframe, host=args.host, port=args.port, refresh_interval=args.refresh)
+    daemon.warm()
+
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('Shutting down')
+
+    return 0
+
+if __name__ == '__main__':
+
+    arg_parser = argparse.ArgumentParser(description=main.__doc__)
+    arg_parser.add_argument('--host',
+        default='127.0.0.1',
+        help='Interface to listen on <Default:127.0.0.1>')
+    arg_parser.add_argument('-p', '--port',
+        type=int,
+        default=8765,
+        help='Port to listen on <Default:8765>')
+    arg_parser.add_argument('--refresh',
+        type=int,
+        help='Fetch a new copy of the table of contents after this many seconds.  Ignored if --tocfile is specified')
+    arg_parser.add_argument('--api_username',
+        default=os.getenv('UFRAME_API_USERNAME'),
+        help='API user name associated with the registered user\'s profile.  Value is taken from the UFRAME_API_USERNAME environment variable, if set')
+    arg_parser.add_argument('--api_token',
+        default=os.getenv('UFRAME_API_TOKEN'),
+        help='API token associated with the registered user\'s profile.  Value is taken from the UFRAME_API_TOKEN environment variable, if set')
+    arg_parser.add_argument('-b', '--baseurl',
+        dest='base_url',
+        help='Specify an alternate uFrame server URL. Must start with \'https://\' or \'http://\'.  Must be specified if UFRAME_BASE_URL environment variable is not set')
+    arg_parser.add_argument('-t', '--timeout',
+        type=int,
+        default=120,
+        help='Specify the timeout, in seconds <Default:120>')
+    arg_parser.add_argument('--tocfile',
+        help='JSON file, optionally gzip, bz2 or zstd compressed, containing a full copy of the UI table of contents.  If specified, this file is used instead of fetching it from the system (MUCH faster!)')
+    arg_parser.add_argument('--loglevel',
+        help='Verbosity level',
+        choices=['debug', 'info', 'warning', 'error', 'critical'],
+        default='info')
+
+    parsed_args = arg_parser.parse_args()
+
+    sys.exit(main(parsed_args))
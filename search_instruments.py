@@ -7,16 +7,20 @@ import os
 import sys
 import csv
 from m2m.M2mClient import M2mClient
+from m2m.M2mDaemonClient import M2mDaemonClient
+from m2m.M2mProfiler import add_profile_arguments, profile_main, phase
+from m2m.batch import read_batch_queries
+from m2m.tocfile import load_toc
 
 def main(args):
     '''Return the fully qualified reference designator list for all instruments
     contained in asset management.  If a partial or fully-qualified reference designator 
     is specified, matching instruments are returned.'''
     
-    # Set up the m2m.M2mClient logger
+    # Set up the m2m package logger
     log_level = getattr(logging, args.loglevel.upper())
     log_format = '%(asctime)s:%(module)s:%(levelname)s:%(message)s [line %(lineno)d]'
-    m2m_logger = logging.getLogger('m2m.M2mClient')
+    m2m_logger = logging.getLogger('m2m')
     m2m_logger.setLevel(log_level)
     ch = logging.StreamHandler()
     formatter = logging.Formatter(log_format)
@@ -31,30 +35,54 @@ def main(args):
     sh.setFormatter(sh_formatter)
     logger.addHandler(sh)
 
-    base_url = args.base_url
-    if not base_url:
-        base_url = os.getenv('UFRAME_BASE_URL')
+    daemon_url = args.daemon or os.getenv('M2M_DAEMON_URL')
+    if daemon_url:
+        # Use the table of contents already loaded by the resident m2m_daemon.py service
+        uframe = M2mDaemonClient(daemon_url, timeout=args.timeout)
+        if not uframe.status():
+            logger.error('No M2mDaemon found at {:s}'.format(daemon_url))
+            return 1
+    else:
+        base_url = args.base_url
+        if not base_url:
+            base_url = os.getenv('UFRAME_BASE_URL')
         
-    if not base_url:
-        logger.error('No UFrame instance specified')
-        return 1
-    
-    # Create the M2mClient instance
-    toc = None
-    if args.tocfile:
-        if not os.path.isfile(args.tocfile):
-            logger.error('Invalid TOC json file ({:s})'.format(args.tocfile))
+        if not base_url:
+            logger.error('No UFrame instance specified')
             return 1
+    
+        # Create the M2mClient instance
+        toc = None
+        if args.tocfile:
+            if not os.path.isfile(args.tocfile):
+                logger.error('Invalid TOC json file ({:s})'.format(args.tocfile))
+                return 1
+            try:
+                with phase('json_decode'):
+                    toc = load_toc(args.tocfile)
+            except (IOError, OSError, ValueError) as e:
+                logger.error(e)
+                return 1
+            
+        uframe = M2mClient(base_url, timeout=args.timeout, toc=toc)
+    
+    if args.batch:
         try:
-            with open(args.tocfile) as fid:
-                toc = json.load(fid)
-        except (OSError, ValueError) as e:
+            targets = [q[0] for q in read_batch_queries(args.batch)]
+        except (IOError, OSError) as e:
             logger.error(e)
             return 1
-            
-    uframe = M2mClient(base_url, timeout=args.timeout, toc=toc)
-    
-    if args.reference_designator:
+        return search_batch(uframe, targets, args)
+        
+    if args.reference_designator and args.fuzzy:
+        # Ranked typo-tolerant matches
+        instruments = [m['match'] for m in uframe.fuzzy_search(args.reference_designator, limit=args.top)]
+        if args.streams:
+            streams = []
+            for instrument in instruments:
+                streams = streams + uframe.instrument_to_streams(instrument)
+            instruments = streams
+    elif args.reference_designator:
         if args.streams:
             instruments = uframe.instrument_to_streams(args.reference_designator)
         else:
@@ -87,12 +115,71 @@ def main(args):
     
     return 0
     
+def search_batch(uframe, targets, args):
+    '''Search for each of the target reference designators using the same client
+    and write the results for each target as soon as they are found.  JSON results
+    are written as one object per line.'''
+    
+    csv_writer = None
+    if args.csv:
+        csv_writer = csv.writer(sys.stdout)
+        
+    if args.fuzzy:
+        matches = ((t, [m['match'] for m in uframe.fuzzy_search(t, limit=args.top)]) for t in targets)
+    else:
+        matches = uframe.search_instruments_batch(targets)
+        
+    cols = None
+    for (target, instruments) in matches:
+        
+        if args.streams:
+            results = []
+            for instrument in instruments:
+                results = results + uframe.instrument_to_streams(instrument)
+        else:
+            results = instruments
+            
+        if not csv_writer:
+            sys.stdout.write('{:s}\n'.format(json.dumps({'reference_designator' : target, 'results' : results})))
+            sys.stdout.flush()
+            continue
+            
+        if not results:
+            continue
+            
+        if not cols:
+            cols = ['reference_designator']
+            if args.streams:
+                cols = ['reference_designator',
+                    'stream']
+                if args.metadata:
+                    cols = sorted(results[0].keys())
+            csv_writer.writerow(cols)
+                
+        for result in results:
+            if args.streams:
+                csv_writer.writerow([result[k] for k in cols])
+            else:
+                csv_writer.writerow([result])
+        sys.stdout.flush()
+        
+    return 0
+    
 if __name__ == '__main__':
 
     arg_parser = argparse.ArgumentParser(description=main.__doc__)
     arg_parser.add_argument('reference_designator',
         nargs='?',
         help='Name of the instrument to search')
+    arg_parser.add_argument('--batch',
+        help='File containing one partial or fully-qualified reference designator per line, or - to read STDIN.  All reference designators are searched using the same table of contents and the results for each are printed as they are found')
+    arg_parser.add_argument('--fuzzy',
+        action='store_true',
+        help='Typo-tolerant search: return the instruments best matching the reference designator, ranked by similarity')
+    arg_parser.add_argument('--top',
+        type=int,
+        default=10,
+        help='Maximum number of instruments returned by a --fuzzy search <Default=10>')
     arg_parser.add_argument('-s', '--streams',
         action='store_true',
         help='Include streams produced by the instrument')
@@ -110,13 +197,16 @@ if __name__ == '__main__':
         type=int,
         default=120,
         help='Specify the timeout, in seconds (Default is 120 seconds).')
+    arg_parser.add_argument('--daemon',
+        help='Url of a running m2m_daemon.py service to answer the query instead of loading the table of contents.  Value is taken from the M2M_DAEMON_URL environment variable, if set')
     arg_parser.add_argument('-l', '--loglevel',
         help='Verbosity level',
         choices=['debug', 'info', 'warning', 'error', 'critical'],
         default='info')
     arg_parser.add_argument('--tocfile',
-        help='JSON file containing a full copy of the UI table of contents.  If specified, this file is used instead of fetching it from the system (MUCH faster!)')
+        help='JSON file, optionally gzip, bz2 or zstd compressed, containing a full copy of the UI table of contents.  If specified, this file is used instead of fetching it from the system (MUCH faster!)')
+    add_profile_arguments(arg_parser)
 
     parsed_args = arg_parser.parse_args()
 
-    sys.exit(main(parsed_args))
+    sys.exit(profile_main(main, parsed_args))
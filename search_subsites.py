@@ -6,15 +6,18 @@ import json
 import os
 import sys 
 from m2m.M2mClient import M2mClient
+from m2m.M2mDaemonClient import M2mDaemonClient
+from m2m.M2mProfiler import add_profile_arguments, profile_main, phase
+from m2m.tocfile import load_toc
 
 def main(args):
     '''Return the list of all registered subsites in the UFrame instance or
     subsites matching the specified subsite'''
     
-    # Set up the m2m.M2mClient logger
+    # Set up the m2m package logger
     log_level = getattr(logging, args.loglevel.upper())
     log_format = '%(asctime)s:%(module)s:%(levelname)s:%(message)s [line %(lineno)d]'
-    m2m_logger = logging.getLogger('m2m.M2mClient')
+    m2m_logger = logging.getLogger('m2m')
     m2m_logger.setLevel(log_level)
     ch = logging.StreamHandler()
     formatter = logging.Formatter(log_format)
@@ -29,29 +32,37 @@ def main(args):
     sh.setFormatter(sh_formatter)
     logger.addHandler(sh)
 
-    base_url = args.base_url
-    if not base_url:
-        base_url = os.getenv('UFRAME_BASE_URL')
-        
-    if not base_url:
-        sys.stderr.write('No UFrame instance specified')
-        sys.stderr.flush()
-        return 1
-    
-    # Create the M2mClient instance
-    toc = None
-    if args.tocfile:
-        if not os.path.isfile(args.tocfile):
-            logger.error('Invalid TOC json file ({:s})'.format(args.tocfile))
+    daemon_url = args.daemon or os.getenv('M2M_DAEMON_URL')
+    if daemon_url:
+        # Use the table of contents already loaded by the resident m2m_daemon.py service
+        uframe = M2mDaemonClient(daemon_url, timeout=args.timeout)
+        if not uframe.status():
+            logger.error('No M2mDaemon found at {:s}'.format(daemon_url))
             return 1
-        try:
-            with open(args.tocfile) as fid:
-                toc = json.load(fid)
-        except (OSError, ValueError) as e:
-            logger.error(e)
+    else:
+        base_url = args.base_url
+        if not base_url:
+            base_url = os.getenv('UFRAME_BASE_URL')
+        
+        if not base_url:
+            sys.stderr.write('No UFrame instance specified')
+            sys.stderr.flush()
             return 1
+    
+        # Create the M2mClient instance
+        toc = None
+        if args.tocfile:
+            if not os.path.isfile(args.tocfile):
+                logger.error('Invalid TOC json file ({:s})'.format(args.tocfile))
+                return 1
+            try:
+                with phase('json_decode'):
+                    toc = load_toc(args.tocfile)
+            except (IOError, OSError, ValueError) as e:
+                logger.error(e)
+                return 1
             
-    uframe = M2mClient(base_url, timeout=args.timeout, toc=toc)
+        uframe = M2mClient(base_url, timeout=args.timeout, toc=toc)
     
     if (args.subsite):
         subsites = uframe.search_subsites(args.subsite)
@@ -84,15 +95,18 @@ if __name__ == '__main__':
         type=int,
         default=120,
         help='Specify the timeout, in seconds (Default is 120 seconds).')
+    arg_parser.add_argument('--daemon',
+        help='Url of a running m2m_daemon.py service to answer the query instead of loading the table of contents.  Value is taken from the M2M_DAEMON_URL environment variable, if set')
     arg_parser.add_argument('-l', '--loglevel',
         help='Verbosity level',
         choices=['debug', 'info', 'warning', 'error', 'critical'],
         default='info')
     arg_parser.add_argument('--tocfile',
-        help='JSON file containing a full copy of the UI table of contents.  If specified, this file is used instead of fetching it from the system (MUCH faster!)')
+        help='JSON file, optionally gzip, bz2 or zstd compressed, containing a full copy of the UI table of contents.  If specified, this file is used instead of fetching it from the system (MUCH faster!)')
+    add_profile_arguments(arg_parser)
 
     parsed_args = arg_parser.parse_args()
 #    print parsed_args
 #    sys.exit(0)
 
-    sys.exit(main(parsed_args))
+    sys.exit(profile_main(main, parsed_args))
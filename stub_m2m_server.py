@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+import logging
+import argparse
+import os
+import sys
+import json
+import time
+from m2m.StubM2mServer import StubM2mServer
+from m2m.synthetic import build_synthetic_toc, build_synthetic_deployment_events
+from m2m.tocfile import load_toc
+
+def main(args):
+    '''Run a local stub of the UFrame m2m API serving the table of contents,
+    deployment events, stream data requests and asynchronous request output files,
+    with configurable latency, error rate, rate limit and response size.  Point
+    the client scripts at the printed base url with -b/--baseurl to test them
+    without a network.'''
+
+    # Set up the m2m package logger
+    log_level = getattr(logging, args.loglevel.upper())
+    log_format = '%(asctime)s:%(module)s:%(levelname)s:%(message)s [line %(lineno)d]'
+    m2m_logger = logging.getLogger('m2m')
+    m2m_logger.setLevel(log_level)
+    ch = logging.StreamHandler()
+    formatter = logging.Formatter(log_format)
+    ch.setFormatter(formatter)
+    m2m_logger.addHandler(ch)
+
+    # Set up the stream logger
+    logger = logging.getLogger(__name__)
+    logger.setLevel(log_level)
+    sh = logging.StreamHandler()
+    sh_formatter = logging.Formatter('%(module)s:%(levelname)s:%(message)s [line %(lineno)d]')
+    sh.setFormatter(sh_formatter)
+    logger.addHandler(sh)
+
+    # Serve the specified table of contents or create a synthetic one
+    if args.tocfile:
+        if not os.path.isfile(args.tocfile):
+            logger.error('Invalid TOC json file ({:s})'.format(args.tocfile))
+            return 1
+        try:
+            toc = load_toc(args.tocfile)
+        except (IOError, OSError, ValueError) as e:
+            logger.error(e)
+            return 1
+    else:
+        toc = build_synthetic_toc(num_subsites=args.subsites,
+            nodes_per_subsite=args.nodes,
+            instruments_per_node=args.instruments,
+            seed=args.seed)
+
+    if args.eventsfile:
+        try:
+            with open(args.eventsfile) as fid:
+                events = json.load(fid)
+        except (IOError, OSError, ValueError) as e:
+            logger.error(e)
+            return 1
+    else:
+        events = build_synthetic_deployment_events(toc, seed=args.seed)
+
+    stub = StubM2mServer(toc=toc,
+        deployment_events=events,
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        num_particles=args.particles,
+        file_size=args.file_size,
+        seed=args.seed)
+    stub.start()
+
+    sys.stdout.write('{:s}\n'.format(stub.base_url))
+    sys.stdout.flush()
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stub.stop()
+        logger.info(json.dumps(stub.stats()))
+
+    return 0
+
+if __name__ == '__main__':
+
+    arg_parser = argparse.ArgumentParser(description=main.__doc__)
+    arg_parser.add_argument('--tocfile',
+        help='JSON file, optionally gzip, bz2 or zstd compressed, containing the table of contents to serve.  A synthetic table of contents is served if not specified')
+    arg_parser.add_argument('--eventsfile',
+        help='JSON file containing the list of raw deployment events to serve.  Synthetic events are created for the table of contents if not specified')
+    arg_parser.add_argument('--subsites',
+        type=int,
+        default=20,
+        help='Number of subsites in the synthetic table of contents <Default:20>')
+    arg_parser.add_argument('--nodes',
+        type=int,
+        default=4,
+        help='Number of nodes on each synthetic subsite <Default:4>')
+    arg_parser.add_argument('--instruments',
+        type=int,
+        default=6,
+        help='Number of instruments on each synthetic node <Default:6>')
+    arg_parser.add_argument('--latency',
+        type=float,
+        default=0,
+        help='Seconds added to every response <Default:0>')
+    arg_parser.add_argument('--jitter',
+        type=float,
+        default=0,
+        help='Maximum random number of seconds added to --latency <Default:0>')
+    arg_parser.add_argument('--error_rate',
+        type=float,
+        default=0,
+        help='Fraction, from 0 to 1, of requests answered with an HTTP 500 error <Default:0>')
+    arg_parser.add_argument('--rate_limit',
+        type=float,
+        help='Maximum number of requests per second.  Requests over the limit are answered with an HTTP 429 error')
+    arg_parser.add_argument('--particles',
+        type=int,
+        default=100,
+        help='Number of particles returned by format=application/json stream requests <Default:100>')
+    arg_parser.add_argument('--file_size',
+        type=int,
+        default=1048576,
+        help='Number of bytes in the file served from each asynchronous request output directory <Default:1048576>')
+    arg_parser.add_argument('--seed',
+        type=int,
+        default=0,
+        help='Random number generator seed <Default:0>')
+    arg_parser.add_argument('--host',
+        default='127.0.0.1',
+        help='Interface to listen on <Default:127.0.0.1>')
+    arg_parser.add_argument('-p', '--port',
+        type=int,
+        default=0,
+        help='Port to listen on.  Any free port is used by default')
+    arg_parser.add_argument('--loglevel',
+        help='Verbosity level',
+        choices=['debug', 'info', 'warning', 'error', 'critical'],
+        default='info')
+
+    parsed_args = arg_parser.parse_args()
+
+    sys.exit(main(parsed_args))
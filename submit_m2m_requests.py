@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+import logging
+import argparse
+import os
+import sys
+import json
+from m2m.M2mClient import M2mClient
+from m2m.IncrementalRequestPlanner import IncrementalRequestPlanner
+from m2m.M2mMetrics import exporter_for_file
+from m2m.M2mRequest import read_requests
+from m2m.M2mRequestScheduler import M2mRequestScheduler
+from m2m.M2mShardPool import M2mShardPool
+from m2m.tocfile import load_toc
+from m2m.SharedToc import is_shared_toc
+
+def main(args):
+    '''Send the requests created by build_instrument_requests.py to the UFrame
+    instance.  Requests are read, as urls, JSON Lines or CSV rows, from the
+    specified files or STDIN.  The response to each request is printed to STDOUT
+    as a line of valid JSON.  With --threads, requests are sent
+    concurrently, taking turns between the users of the requests.'''
+
+    # Set up the m2m package logger
+    log_level = getattr(logging, args.loglevel.upper())
+    log_format = '%(asctime)s:%(module)s:%(levelname)s:%(message)s [line %(lineno)d]'
+    m2m_logger = logging.getLogger('m2m')
+    m2m_logger.setLevel(log_level)
+    ch = logging.StreamHandler()
+    formatter = logging.Formatter(log_format)
+    ch.setFormatter(formatter)
+    m2m_logger.addHandler(ch)
+
+    # Set up the stream logger
+    logger = logging.getLogger(__name__)
+    logger.setLevel(log_level)
+    sh = logging.StreamHandler()
+    sh_formatter = logging.Formatter('%(module)s:%(levelname)s:%(message)s [line %(lineno)d]')
+    sh.setFormatter(sh_formatter)
+    logger.addHandler(sh)
+
+    base_url = args.base_url
+    if not base_url:
+        base_url = os.getenv('UFRAME_BASE_URL')
+
+    if not base_url:
+        logger.error('No UFrame instance specified')
+        return 1
+
+    # Create the M2mClient instance
+    toc = None
+    shared_toc = None
+    if args.tocfile:
+        if not os.path.isfile(args.tocfile):
+            logger.error('Invalid TOC json file ({:s})'.format(args.tocfile))
+            return 1
+        try:
+            if is_shared_toc(args.tocfile):
+                shared_toc = args.tocfile
+            else:
+                toc = load_toc(args.tocfile)
+        except (IOError, OSError, ValueError) as e:
+            logger.error(e)
+            return 1
+
+    uframe = M2mClient(base_url, timeout=args.timeout, num_retries=args.retries, api_username=args.api_username, api_token=args.api_token, toc=toc, shared_toc=shared_toc)
+    if shared_toc and not uframe.shared_toc:
+        return 1
+
+    if args.metrics:
+        uframe.metrics.add_exporter(exporter_for_file(args.metrics))
+
+    planner = None
+    if args.watermarks:
+        planner = IncrementalRequestPlanner(uframe, args.watermarks)
+
+    # Send the requests for each subsite from a separate worker process
+    pool = None
+    scheduler = None
+    if args.processes > 1:
+        pool = M2mShardPool(uframe, processes=args.processes, toc_file=args.tocfile, api_username=args.api_username, api_token=args.api_token)
+    elif args.threads > 1:
+        scheduler = M2mRequestScheduler(uframe, num_threads=args.threads, reserved_threads=0)
+
+    url_files = args.url_files or ['-']
+    for url_file in url_files:
+        if url_file == '-':
+            fid = sys.stdin
+        else:
+            try:
+                fid = open(url_file)
+            except (IOError, OSError) as e:
+                logger.error(e)
+                continue
+
+        if args.request_format == 'url':
+            requests = (line.strip() for line in fid if line.strip())
+        else:
+            requests = read_requests(fid, file_format=args.request_format)
+
+        if pool:
+            # Responses are returned grouped by subsite
+            responses = pool.send_m2m_requests(list(requests))
+        elif scheduler:
+            responses = scheduler.send_m2m_requests(requests)
+        else:
+            responses = ((url, uframe.send_m2m_request(url)) for url in requests)
+
+        for (url, response) in responses:
+
+            if not response:
+                logger.warning('Request not sent: {:s}'.format(url if args.request_format == 'url' else repr(url)))
+                continue
+
+            # Advance the stream watermark if the request was successful
+            if planner and response['status']:
+                planner.record_request(url)
+
+            sys.stdout.write('{:s}\n'.format(json.dumps(response)))
+            sys.stdout.flush()
+
+        if fid is not sys.stdin:
+            fid.close()
+
+    if pool:
+        pool.close()
+
+    if scheduler:
+        scheduler.close()
+
+    if planner:
+        planner.save()
+
+    uframe.metrics.export()
+
+    return 0
+
+if __name__ == '__main__':
+
+    arg_parser = argparse.ArgumentParser(description=main.__doc__)
+    arg_parser.add_argument('url_files',
+        nargs='*',
+        help='Files containing the requests.  Requests are read from STDIN if no files or - is specified')
+    arg_parser.add_argument('--request_format',
+        choices=['url', 'jsonl', 'csv'],
+        default='url',
+        help='Format of the request files: one url per line (<Default:url>), one JSON object per line (jsonl) or CSV rows, as written by build_instrument_requests.py --request_format')
+    arg_parser.add_argument('--watermarks',
+        help='JSON file containing the last endDT successfully requested for each instrument stream.  The watermark of each successfully submitted request is advanced to the request endDT')
+    arg_parser.add_argument('-p', '--processes',
+        type=int,
+        default=1,
+        help='Number of worker processes.  Requests are split by subsite and the responses are printed grouped by subsite, in the order each subsite first appears.  Metrics are only collected for requests sent by this process <Default:1>')
+    arg_parser.add_argument('-n', '--threads',
+        type=int,
+        default=1,
+        help='Number of requests sent concurrently.  Users, given by the user query string parameter of the requests, take turns so that each gets a fair share of the threads.  Ignored if --processes is greater than 1 <Default:1>')
+    arg_parser.add_argument('--metrics',
+        help='Write request latency, status code, byte and timing metrics to this file.  Files ending in .prom are written in the Prometheus text format, all others as JSON')
+    arg_parser.add_argument('--api_username',
+        default=os.getenv('UFRAME_API_USERNAME'),
+        help='API user name associated with the registered user\'s profile.  Value is taken from the UFRAME_API_USERNAME environment variable, if set')
+    arg_parser.add_argument('--api_token',
+        default=os.getenv('UFRAME_API_TOKEN'),
+        help='API token associated with the registered user\'s profile.  Value is taken from the UFRAME_API_TOKEN environment variable, if set')
+    arg_parser.add_argument('-b', '--baseurl',
+        dest='base_url',
+        help='Specify an alternate uFrame server URL. Must start with \'https://\' or \'http://\'.  Must be specified if UFRAME_BASE_URL environment variable is not set')
+    arg_parser.add_argument('-t', '--timeout',
+        type=int,
+        default=120,
+        help='Specify the timeout, in seconds <Default:120>')
+    arg_parser.add_argument('-r', '--retries',
+        type=int,
+        default=0,
+        help='Number of times a request is resent after a connection error, timeout, HTTP 429 or 5xx response <Default:0>')
+    arg_parser.add_argument('--tocfile',
+        help='JSON file, optionally gzip, bz2 or zstd compressed, or shared table of contents file written by fetch_toc.py --shared, containing a full copy of the UI table of contents.  If specified, this file is used instead of fetching it from the system (MUCH faster!)')
+    arg_parser.add_argument('--loglevel',
+        help='Verbosity level',
+        choices=['debug', 'info', 'warning', 'error', 'critical'],
+        default='info')
+
+    parsed_args = arg_parser.parse_args()
+
+    sys.exit(main(parsed_args))